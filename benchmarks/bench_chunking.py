@@ -0,0 +1,76 @@
+# bench_chunking.py
+# Busca sobre CVs inteiros (um vetor por CV, do qual o all-MiniLM-L6-v2 só vê o começo) contra
+# a busca sobre passagens agregada por CV (passagens.cv): recall@k de consultas tiradas de trechos
+# do fim dos CVs, fração dos word pieces de cada CV que o embedder enxerga, tokens de contexto
+# entregues ao gerador e latência da busca.
+#
+# Uso (após python src/ingestion.py --chunk-words 128): python -m benchmarks.bench_chunking --consultas 200
+import argparse
+import os
+import time
+import numpy as np
+from src.model import RAGRunnable
+
+
+def consultas_do_fim(contextos, n, palavras=12, inicio_minimo=200, seed=0):
+    """(trecho, linha do CV) com trechos tirados depois das primeiras inicio_minimo palavras,
+    a parte do CV que o embedding do documento inteiro não cobre."""
+    rng = np.random.default_rng(seed)
+    candidatos = [i for i in range(len(contextos)) if len(contextos[i].split()) >= inicio_minimo + palavras]
+    consultas = []
+    for i in rng.choice(candidatos, min(n, len(candidatos)), replace=False):
+        words = contextos[int(i)].split()
+        inicio = int(rng.integers(inicio_minimo, len(words) - palavras + 1))
+        consultas.append((' '.join(words[inicio:inicio + palavras]), int(i)))
+    return consultas
+
+
+def medir(agent, consultas, k):
+    acertos, tokens, tempos = [], [], []
+    for trecho, cv in consultas:
+        inicio = time.perf_counter()
+        _, ids = agent.search([trecho], top_k=k)
+        tempos.append(time.perf_counter() - inicio)
+        ids = [int(i) for i in ids[0] if i >= 0]
+        linhas = [int(agent.passage_cv[i]) for i in ids] if agent.passage_cv is not None else ids
+        acertos.append(cv in linhas)
+        if agent.context_token_counts is not None:
+            tokens.append(sum(int(agent.context_token_counts[i]) for i in ids))
+    return {
+        'recall': np.mean(acertos),
+        'tokens_contexto': np.mean(tokens) if tokens else float('nan'),
+        'p50_ms': np.percentile(tempos, 50) * 1000,
+    }
+
+
+def cobertura(agent):
+    """Fração média dos word pieces de cada texto do retriever dentro da janela do embedder."""
+    tokenizer = agent.embedder.tokenizer
+    limite = agent.embedder.max_seq_length
+    amostra = range(0, len(agent.retriever_contexts), max(1, len(agent.retriever_contexts) // 1000))
+    fracoes = []
+    for i in amostra:
+        n = len(tokenizer(agent.retriever_contexts[i], add_special_tokens=True)['input_ids'])
+        fracoes.append(min(n, limite) / max(n, 1))
+    return np.mean(fracoes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--consultas', type=int, default=200)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--processed-dir', default=os.path.join('data', 'processed'),
+                        help='Diretório com os artefatos da ingestão (make data)')
+    args = parser.parse_args()
+
+    documentos = RAGRunnable(prefix_cache_tokens=0, passages=False, processed_dir=args.processed_dir).agent
+    passagens = RAGRunnable(prefix_cache_tokens=0, passages=True, processed_dir=args.processed_dir).agent
+    if passagens.passage_cv is None:
+        raise SystemExit("passagens.cv não encontrado: rode a ingestão com --chunk-words")
+    consultas = consultas_do_fim(documentos.retriever_contexts, args.consultas)
+    print(f"{len(consultas)} consultas de trechos após a palavra 200 do CV, k={args.k}")
+    print(f"{'corpus':<11} {'textos':>8} {'cobertura':>9} {'recall@k':>9} {'tokens ctx':>10} {'p50 ms':>8}")
+    for nome, agent in [('documentos', documentos), ('passagens', passagens)]:
+        r = medir(agent, consultas, args.k)
+        print(f"{nome:<11} {len(agent.retriever_contexts):>8} {cobertura(agent):>9.0%} {r['recall']:>9.3f} "
+              f"{r['tokens_contexto']:>10.0f} {r['p50_ms']:>8.2f}")
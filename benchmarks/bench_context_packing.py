@@ -0,0 +1,79 @@
+# bench_context_packing.py
+# Tokens por requisição antes (contextos concatenados e prompt truncado pelo tokenizador) e depois
+# do empacotamento de contextos por contagem de tokens da ingestão (contextos.ntok): tokens
+# tokenizados, tokens que chegam ao modelo, contextos cortados no meio e tempo de montagem do prompt.
+# No modo pré-tokenizado os input_ids vêm dos tokens gravados (contextos.tok) e só a pergunta é tokenizada.
+#
+# Uso: python -m benchmarks.bench_context_packing --max-perguntas 200
+import argparse
+import os
+import time
+import numpy as np
+from benchmarks.bench_generation_policy import carregar_logs
+from src.model import RAGRunnable
+
+
+def medir_pretokenizado(agent, perguntas):
+    tokenizados, processados, tempos = [], [], []
+    for pergunta in perguntas:
+        inicio = time.perf_counter()
+        ids = agent.prompt_inputs([pergunta])['input_ids'][0]
+        tempos.append(time.perf_counter() - inicio)
+        tokenizados.append(len(agent.tokenizer([agent.build_prompt(pergunta, [])])['input_ids'][0]))
+        processados.append(len(ids))
+    return {
+        'tokenizados': np.mean(tokenizados),
+        'processados': np.mean(processados),
+        'prompts_cortados': 0.0,
+        'montagem_ms': np.mean(tempos) * 1000,
+    }
+
+
+def medir(agent, perguntas, empacotar):
+    contagens = agent.context_token_counts
+    agent.context_token_counts = contagens if empacotar else None
+    tokenizados, processados, cortados, tempos = [], [], [], []
+    try:
+        for pergunta in perguntas:
+            inicio = time.perf_counter()
+            prompt = agent.build_prompts([pergunta])[0]
+            n = len(agent.tokenizer([prompt])['input_ids'][0])
+            tempos.append(time.perf_counter() - inicio)
+            # Sem empacotamento o prompt inteiro é tokenizado e a truncagem descarta o excesso
+            tokenizados.append(n)
+            processados.append(min(n, agent.input_budget()))
+            cortados.append(n > agent.input_budget())
+    finally:
+        agent.context_token_counts = contagens
+    return {
+        'tokenizados': np.mean(tokenizados),
+        'processados': np.mean(processados),
+        'prompts_cortados': np.mean(cortados),
+        'montagem_ms': np.mean(tempos) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logs', default=os.path.join('monitoring', 'rag_recrutamento', 'data'))
+    parser.add_argument('--max-perguntas', type=int, default=200)
+    parser.add_argument('--processed-dir', default=os.path.join('data', 'processed'),
+                        help='Diretório com os artefatos da ingestão (make data)')
+    args = parser.parse_args()
+
+    perguntas = list(dict.fromkeys(p for p, _ in carregar_logs(args.logs)))[:args.max_perguntas]
+    agent = RAGRunnable(prefix_cache_tokens=0, processed_dir=args.processed_dir).agent
+    if agent.context_token_counts is None:
+        raise SystemExit("contextos.ntok não encontrado: rode a ingestão para gravar as contagens de tokens")
+    print(f"{len(perguntas)} perguntas, orçamento de entrada de {agent.input_budget()} tokens")
+    print(f"{'modo':<14} {'tokenizados':>11} {'processados':>11} {'cortados':>9} {'montagem ms':>12}")
+    tokens = agent.context_tokens
+    agent.context_tokens = None
+    resultados = [(nome, medir(agent, perguntas, empacotar))
+                  for nome, empacotar in [('truncamento', False), ('empacotamento', True)]]
+    agent.context_tokens = tokens
+    if tokens is not None:
+        resultados.append(('pretokenizado', medir_pretokenizado(agent, perguntas)))
+    for nome, r in resultados:
+        print(f"{nome:<14} {r['tokenizados']:>11.0f} {r['processados']:>11.0f} "
+              f"{r['prompts_cortados']:>9.0%} {r['montagem_ms']:>12.2f}")
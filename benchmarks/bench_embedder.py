@@ -0,0 +1,53 @@
+# bench_embedder.py
+# Compara a latência do retrieve() com o encoder carregado a cada pergunta (cold)
+# contra o encoder compartilhado pelo RAGAgent (warm).
+#
+# Uso: python -m benchmarks.bench_embedder --repeticoes 20
+import argparse
+import time
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from src.model import EMBEDDER_NAME, RAGAgent, get_embedder
+
+PERGUNTA = "Quais competências técnicas são mais valorizadas para a vaga Python?"
+
+
+def retrieve_cold(agent, query, top_k=3):
+    # Comportamento antigo: instancia o SentenceTransformer em toda chamada
+    agent.embedder = SentenceTransformer(EMBEDDER_NAME)
+    agent.query_cache.clear()
+    return agent.retrieve(query, top_k=top_k)
+
+
+def retrieve_warm(agent, query, top_k=3):
+    # Encoder compartilhado; sem o cache de embeddings das perguntas, para medir o encode
+    agent.embedder = get_embedder()
+    agent.query_cache.clear()
+    return agent.retrieve(query, top_k=top_k)
+
+
+def medir(fn, repeticoes, *args):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        fn(*args)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return np.percentile(tempos, 50), np.percentile(tempos, 95)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--corpus', type=int, default=10000, help='Número de embeddings sintéticos no corpus')
+    args = parser.parse_args()
+
+    corpus = np.random.default_rng(0).standard_normal((args.corpus, 384)).astype(np.float32)
+    # Um único RAGAgent (aquece o cache de disco/HF para não medir o download); as duas variantes
+    # passam pelo mesmo agent.retrieve e só trocam o encoder
+    agent = RAGAgent('distilgpt2', corpus, [f'CV {i}' for i in range(args.corpus)], embedder=get_embedder())
+
+    cold_p50, cold_p95 = medir(retrieve_cold, args.repeticoes, agent, PERGUNTA)
+    warm_p50, warm_p95 = medir(retrieve_warm, args.repeticoes, agent, PERGUNTA)
+    print(f"cold (encoder por chamada): p50={cold_p50:.1f} ms  p95={cold_p95:.1f} ms")
+    print(f"warm (encoder compartilhado): p50={warm_p50:.1f} ms  p95={warm_p95:.1f} ms")
+    print(f"speedup p50: {cold_p50 / warm_p50:.1f}x")
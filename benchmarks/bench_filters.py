@@ -0,0 +1,81 @@
+# bench_filters.py
+# Filtros de metadados aplicados antes da busca (listas de ids do metadados.npz; só as linhas
+# selecionadas são pontuadas) contra o pós-filtro (busca no corpus inteiro trazendo fator * k
+# resultados e descarte dos CVs fora do filtro): latência p50/p95, fração das consultas que
+# ainda recebem k CVs e sobreposição com o top-k do pré-filtro, por filtro e seletividade.
+#
+# Uso (após a ingestão com as colunas de metadados): python -m benchmarks.bench_filters --consultas 100 --k 3
+import argparse
+import os
+import time
+import numpy as np
+from benchmarks.bench_chunking import consultas_do_fim
+from benchmarks.bench_hybrid import linhas_cv
+from src.model import RAGRunnable
+from src.store import corpus_files, open_context_store
+
+
+def filtros_exemplo(metadata, n_valores=2):
+    """Filtros de seletividades diferentes: aprovados e os valores mais frequentes de alguns campos."""
+    filtros = [{'aprovado': True}] if 'aprovado' in metadata.lists else []
+    for campo in ('titulo', 'modalidade', 'nivel_ingles', 'vaga'):
+        if campo not in metadata.lists:
+            continue
+        offsets, _ = metadata.lists[campo]
+        tamanhos = np.diff(offsets.astype(np.int64))
+        for code in np.argsort(-tamanhos)[:n_valores]:
+            filtros.append({campo: metadata.values[campo][int(code)]})
+    return filtros
+
+
+def medir(agent, consultas, filtros, k, fator=None):
+    linhas = set(agent.metadata.select(filtros).tolist())
+    tempos, completas, resultados = [], [], []
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        if fator is None:
+            _, ids = agent.search([consulta], top_k=k, filters=filtros)
+            cvs = linhas_cv(agent, ids[0])
+        else:
+            _, ids = agent.search([consulta], top_k=k * fator)
+            cvs = [cv for cv in linhas_cv(agent, ids[0]) if cv in linhas][:k]
+        tempos.append(time.perf_counter() - inicio)
+        completas.append(len(cvs) == min(k, len(linhas)))
+        resultados.append(cvs)
+    return {
+        'p50_ms': np.percentile(tempos, 50) * 1000,
+        'p95_ms': np.percentile(tempos, 95) * 1000,
+        'completas': np.mean(completas),
+        'resultados': resultados,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--consultas', type=int, default=100, help='Trechos de CV usados como consultas')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--fatores', type=int, nargs='*', default=[1, 10, 100],
+                        help='Resultados trazidos pelo pós-filtro, em múltiplos de k')
+    parser.add_argument('--processed-dir', default=os.path.join('data', 'processed'),
+                        help='Diretório com os artefatos da ingestão (make data)')
+    args = parser.parse_args()
+
+    agent = RAGRunnable(prefix_cache_tokens=0, processed_dir=args.processed_dir).agent
+    if agent.metadata is None or not agent.metadata.fields:
+        raise SystemExit("metadados.npz ausente ou sem campos: rode a ingestão com as colunas de metadados")
+    cvs = open_context_store(corpus_files(args.processed_dir)['contexts'])
+    consultas = [trecho for trecho, _ in consultas_do_fim(cvs, args.consultas, inicio_minimo=0)]
+    print(f"{len(consultas)} consultas, k={args.k}, {len(agent.metadata)} CVs")
+    print(f"{'filtro':<40} {'CVs':>7} {'modo':<12} {'p50 ms':>8} {'p95 ms':>8} {'k cheios':>9} {'overlap':>8}")
+    for filtros in filtros_exemplo(agent.metadata):
+        n = len(agent.metadata.select(filtros))
+        pre = medir(agent, consultas, filtros, args.k)
+        nome = str(filtros)[:40]
+        print(f"{nome:<40} {n:>7} {'pré-filtro':<12} {pre['p50_ms']:>8.2f} {pre['p95_ms']:>8.2f} "
+              f"{pre['completas']:>9.3f} {1.0:>8.3f}")
+        for fator in args.fatores:
+            pos = medir(agent, consultas, filtros, args.k, fator=fator)
+            overlap = np.mean([len(set(a) & set(b)) / max(1, len(b))
+                               for a, b in zip(pos['resultados'], pre['resultados'])])
+            print(f"{'':<40} {'':>7} {f'pós x{fator}':<12} {pos['p50_ms']:>8.2f} {pos['p95_ms']:>8.2f} "
+                  f"{pos['completas']:>9.3f} {overlap:>8.3f}")
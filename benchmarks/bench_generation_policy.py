@@ -0,0 +1,94 @@
+# bench_generation_policy.py
+# Compara tokens gerados e latência por requisição com e sem as políticas de geração do
+# RAGAgent (bloqueio de n-gramas repetidos, stop sequences e parada em bloco repetido),
+# usando as perguntas registradas pelo monitoramento do BentoML.
+#
+# Uso: python -m benchmarks.bench_generation_policy --logs monitoring/rag_recrutamento/data
+#      python -m benchmarks.bench_generation_policy --offline   (só analisa as respostas registradas)
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+from src.model import DEFAULT_GENERATION_POLICY, RAGRunnable, repeated_tail
+
+SEM_POLITICA = {'no_repeat_ngram_size': 0, 'stop_sequences': (), 'repeated_span': None}
+
+
+def carregar_logs(diretorio):
+    """Pares (pergunta, resposta) de todos os arquivos de log do monitoramento."""
+    pares = []
+    for path in sorted(glob.glob(os.path.join(diretorio, '*'))):
+        with open(path, encoding='utf-8') as f:
+            for linha in f:
+                linha = linha.strip()
+                if not linha:
+                    continue
+                registro = json.loads(linha)
+                pares.extend(zip(registro.get('request', []), registro.get('response', [])))
+    return pares
+
+
+def analisar_respostas(pares):
+    # Estimativa em linhas: fração de cada resposta registrada que vem depois do primeiro
+    # bloco de linhas repetido em seguida, ou seja, o que a parada em bloco repetido cortaria
+    fracoes = []
+    for _, resposta in pares:
+        linhas = resposta.split('\n')
+        corte = len(linhas)
+        for i in range(2, len(linhas) + 1):
+            k = repeated_tail(linhas[:i], 1, 8)
+            if k:
+                corte = i - k
+                break
+        fracoes.append(sum(len(l) + 1 for l in linhas[corte:]) / max(1, len(resposta)))
+    return np.array(fracoes)
+
+
+def medir(agent, perguntas):
+    gerados, tempos = [], []
+    original = agent.model.generate
+
+    def contando(*args, **kwargs):
+        output = original(*args, **kwargs)
+        # Com o prefix cache o generate devolve um GenerateDecoderOnlyOutput
+        sequences = getattr(output, 'sequences', output)
+        gerados.append(sequences.shape[1] - kwargs['input_ids'].shape[1])
+        return output
+
+    agent.model.generate = contando
+    try:
+        for pergunta in perguntas:
+            inicio = time.perf_counter()
+            agent.generate(pergunta)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+    finally:
+        agent.model.generate = original
+    return np.array(gerados), np.array(tempos)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logs', default=os.path.join('monitoring', 'rag_recrutamento', 'data'))
+    parser.add_argument('--max-perguntas', type=int, default=50)
+    parser.add_argument('--offline', action='store_true', help='Só analisa as respostas já registradas')
+    parser.add_argument('--processed-dir', default=os.path.join('data', 'processed'),
+                        help='Diretório com os artefatos da ingestão (make data)')
+    args = parser.parse_args()
+
+    pares = carregar_logs(args.logs)
+    fracoes = analisar_respostas(pares)
+    print(f"{len(pares)} respostas registradas; fração média após o primeiro bloco repetido: "
+          f"{fracoes.mean():.1%} (p95 {np.percentile(fracoes, 95):.1%})")
+    if args.offline:
+        raise SystemExit(0)
+
+    perguntas = list(dict.fromkeys(p for p, _ in pares))[:args.max_perguntas]
+    # Sem prefix cache: a segunda política reaproveitaria o K/V dos prompts da primeira
+    agent = RAGRunnable(prefix_cache_tokens=0, processed_dir=args.processed_dir).agent
+    for nome, politica in [('sem política', SEM_POLITICA), ('política padrão', DEFAULT_GENERATION_POLICY)]:
+        agent.generation_policy = {**DEFAULT_GENERATION_POLICY, **politica}
+        gerados, tempos = medir(agent, perguntas)
+        print(f"{nome:>16}: tokens/req média={gerados.mean():.1f} p95={np.percentile(gerados, 95):.0f}  "
+              f"latência p50={np.percentile(tempos, 50):.0f} ms p95={np.percentile(tempos, 95):.0f} ms")
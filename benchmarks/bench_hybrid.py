@@ -0,0 +1,72 @@
+# bench_hybrid.py
+# Busca só densa (MiniLM) contra a busca híbrida (densa + BM25 fundidas por RRF) do RAGAgent:
+# precisão@k de perguntas por tecnologia ("vaga Python"), medida pela fração dos CVs recuperados
+# que citam o termo; recall@k de trechos tirados dos próprios CVs (o CV de origem volta?), para
+# conferir que a parte semântica não piora; e latência p50/p95 da busca.
+#
+# Uso: python -m benchmarks.bench_hybrid --consultas 200 --k 3
+import argparse
+import os
+import time
+import numpy as np
+from benchmarks.bench_chunking import consultas_do_fim
+from src.lexical import tokenize
+from src.model import RAGRunnable
+from src.store import corpus_files, open_context_store
+
+TECNOLOGIAS = ['python', 'java', 'sap', 'sql', 'excel', 'javascript', 'react', 'angular', 'aws', 'azure',
+               'oracle', 'salesforce', 'c#', '.net', 'php', 'linux', 'power bi', 'scrum', 'abap', 'totvs']
+
+
+def linhas_cv(agent, ids):
+    ids = [int(i) for i in ids if i >= 0]
+    return [int(agent.passage_cv[i]) for i in ids] if agent.passage_cv is not None else ids
+
+
+def medir(agent, perguntas_tecnologia, trechos, cvs, k):
+    tempos, precisoes, acertos = [], [], []
+    for termo, pergunta in perguntas_tecnologia:
+        inicio = time.perf_counter()
+        _, ids = agent.search([pergunta], top_k=k)
+        tempos.append(time.perf_counter() - inicio)
+        linhas = linhas_cv(agent, ids[0])
+        termos = tokenize(termo)
+        precisoes.append(np.mean([all(t in tokenize(cvs[i]) for t in termos) for i in linhas]) if linhas else 0.0)
+    for trecho, cv in trechos:
+        inicio = time.perf_counter()
+        _, ids = agent.search([trecho], top_k=k)
+        tempos.append(time.perf_counter() - inicio)
+        acertos.append(cv in linhas_cv(agent, ids[0]))
+    return {
+        'precisao_tecnologia': np.mean(precisoes),
+        'recall_trechos': np.mean(acertos),
+        'p50_ms': np.percentile(tempos, 50) * 1000,
+        'p95_ms': np.percentile(tempos, 95) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--consultas', type=int, default=200, help='Trechos de CV usados como consultas')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--peso-lexico', type=float, nargs='*', default=[0.5, 1.0, 2.0])
+    parser.add_argument('--processed-dir', default=os.path.join('data', 'processed'),
+                        help='Diretório com os artefatos da ingestão (make data)')
+    args = parser.parse_args()
+
+    agent = RAGRunnable(prefix_cache_tokens=0, processed_dir=args.processed_dir).agent
+    lexico = agent.lexical_index
+    if lexico is None:
+        raise SystemExit("lexico.npz não encontrado: rode a ingestão para construir o índice BM25")
+    cvs = open_context_store(corpus_files(args.processed_dir)['contexts'])
+    presentes = set(t for i in range(0, len(cvs), max(1, len(cvs) // 2000)) for t in tokenize(cvs[i]))
+    perguntas = [(t, f'vaga {t}') for t in TECNOLOGIAS if all(p in presentes for p in tokenize(t))]
+    trechos = consultas_do_fim(cvs, args.consultas, inicio_minimo=0)
+    print(f"{len(perguntas)} perguntas por tecnologia, {len(trechos)} trechos, k={args.k}")
+    print(f"{'modo':<14} {'precisão tec':>12} {'recall trechos':>14} {'p50 ms':>8} {'p95 ms':>8}")
+    modos = [('densa', None, 1.0)] + [(f'híbrida w={w:g}', lexico, w) for w in args.peso_lexico]
+    for nome, indice, peso in modos:
+        agent.lexical_index, agent.lexical_weight = indice, peso
+        r = medir(agent, perguntas, trechos, cvs, args.k)
+        print(f"{nome:<14} {r['precisao_tecnologia']:>12.3f} {r['recall_trechos']:>14.3f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
@@ -0,0 +1,62 @@
+# bench_index.py
+# Compara latência de busca e recall@k dos índices do retriever (exato, IVF, HNSW).
+# Por padrão usa embeddings sintéticos; --embeddings aponta para o embeddings.npy real.
+#
+# Uso: python -m benchmarks.bench_index --corpus 100000 --consultas 200
+import argparse
+import time
+import numpy as np
+from src.vector_index import ExactIndex, HNSWIndex, IVFIndex, recall_at_k
+
+
+def dados_sinteticos(n, dim=384, n_clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centros = rng.standard_normal((n_clusters, dim))
+    return (centros[rng.integers(0, n_clusters, n)] + 0.5 * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def medir_busca(index, consultas, k, **params):
+    tempos = []
+    for q in consultas:
+        inicio = time.perf_counter()
+        index.search(q[None, :], k, **params)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return np.percentile(tempos, 50), np.percentile(tempos, 95)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--embeddings', default=None)
+    parser.add_argument('--corpus', type=int, default=100000)
+    parser.add_argument('--consultas', type=int, default=200)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--sem-hnsw', action='store_true', help='Pula o HNSW (build lento em Python puro)')
+    args = parser.parse_args()
+
+    corpus = np.load(args.embeddings) if args.embeddings else dados_sinteticos(args.corpus)
+    rng = np.random.default_rng(1)
+    consultas = corpus[rng.choice(len(corpus), args.consultas, replace=False)]
+    consultas = consultas + 0.1 * rng.standard_normal(consultas.shape).astype(np.float32)
+
+    exato = ExactIndex(corpus)
+    p50, p95 = medir_busca(exato, consultas, args.k)
+    print(f"{'exact':<18} build=    -   p50={p50:7.2f} ms  p95={p95:7.2f} ms  recall@{args.k}=1.000")
+
+    inicio = time.perf_counter()
+    ivf = IVFIndex.build(corpus)
+    build = time.perf_counter() - inicio
+    for nprobe in (1, 4, 8, 16, 32):
+        p50, p95 = medir_busca(ivf, consultas, args.k, nprobe=nprobe)
+        ivf.nprobe = nprobe
+        recall = recall_at_k(ivf, exato, consultas, k=args.k)
+        print(f"{'ivf nprobe=' + str(nprobe):<18} build={build:6.1f}s  p50={p50:7.2f} ms  p95={p95:7.2f} ms  recall@{args.k}={recall:.3f}")
+
+    if not args.sem_hnsw:
+        inicio = time.perf_counter()
+        hnsw = HNSWIndex.build(corpus)
+        build = time.perf_counter() - inicio
+        for ef in (16, 50, 100):
+            p50, p95 = medir_busca(hnsw, consultas, args.k, ef_search=ef)
+            hnsw.ef_search = ef
+            recall = recall_at_k(hnsw, exato, consultas, k=args.k)
+            print(f"{'hnsw ef=' + str(ef):<18} build={build:6.1f}s  p50={p50:7.2f} ms  p95={p95:7.2f} ms  recall@{args.k}={recall:.3f}")
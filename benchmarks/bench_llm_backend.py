@@ -0,0 +1,73 @@
+# bench_llm_backend.py
+# Compara os backends de inferência do LLM (pytorch float32 x int8 dinâmico): tokens/s,
+# latência p50/p95 por requisição, memória residente (RSS) e diferença das respostas
+# em relação ao backend atual. Cada backend roda num processo novo para o RSS não se misturar.
+#
+# Uso: python -m benchmarks.bench_llm_backend --backends pytorch int8 --max-perguntas 20
+import argparse
+import difflib
+import multiprocessing
+import os
+import time
+import numpy as np
+import psutil
+from benchmarks.bench_generation_policy import carregar_logs
+from src.model import LLM_BACKENDS, RAGRunnable
+
+
+def rodar_backend(backend, perguntas, processed_dir):
+    processo = psutil.Process()
+    rss_antes = processo.memory_info().rss
+    agent = RAGRunnable(backend=backend, prefix_cache_tokens=0, processed_dir=processed_dir).agent
+    rss_modelo = processo.memory_info().rss - rss_antes
+    gerados, tempos, respostas = [], [], []
+    original = agent.model.generate
+
+    def contando(*args, **kwargs):
+        output = original(*args, **kwargs)
+        gerados.append(output.shape[1] - kwargs['input_ids'].shape[1])
+        return output
+
+    agent.model.generate = contando
+    agent.generate(perguntas[0])  # aquecimento
+    gerados.clear()
+    for pergunta in perguntas:
+        inicio = time.perf_counter()
+        respostas.append(agent.generate(pergunta))
+        tempos.append(time.perf_counter() - inicio)
+    return {
+        'tokens_por_segundo': sum(gerados) / sum(tempos),
+        'p50_ms': np.percentile(tempos, 50) * 1000,
+        'p95_ms': np.percentile(tempos, 95) * 1000,
+        'rss_mb': processo.memory_info().rss / 2**20,
+        'rss_modelo_mb': rss_modelo / 2**20,
+        'respostas': respostas,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='*', choices=list(LLM_BACKENDS), default=list(LLM_BACKENDS))
+    parser.add_argument('--logs', default=os.path.join('monitoring', 'rag_recrutamento', 'data'))
+    parser.add_argument('--max-perguntas', type=int, default=20)
+    parser.add_argument('--processed-dir', default=os.path.join('data', 'processed'),
+                        help='Diretório com os artefatos da ingestão (make data)')
+    args = parser.parse_args()
+
+    perguntas = list(dict.fromkeys(p for p, _ in carregar_logs(args.logs)))[:args.max_perguntas]
+    ctx = multiprocessing.get_context('spawn')
+    resultados = {}
+    for backend in args.backends:
+        with ctx.Pool(1) as pool:
+            resultados[backend] = pool.apply(rodar_backend, (backend, perguntas, args.processed_dir))
+
+    referencia = resultados.get('pytorch')
+    for backend, r in resultados.items():
+        linha = (f"{backend:>8}: {r['tokens_por_segundo']:.1f} tokens/s  p50={r['p50_ms']:.0f} ms  "
+                 f"p95={r['p95_ms']:.0f} ms  RSS={r['rss_mb']:.0f} MB (modelo {r['rss_modelo_mb']:.0f} MB)")
+        if referencia is not None and backend != 'pytorch':
+            iguais = np.mean([a == b for a, b in zip(r['respostas'], referencia['respostas'])])
+            similaridade = np.mean([difflib.SequenceMatcher(None, a, b).ratio()
+                                    for a, b in zip(r['respostas'], referencia['respostas'])])
+            linha += f"  respostas idênticas={iguais:.0%}  similaridade={similaridade:.3f}"
+        print(linha)
@@ -0,0 +1,49 @@
+# bench_parallel_embedding.py
+# Mede a vazão (sentenças/segundo) da ingestão com o encoder em 1, 2, 4 e N processos,
+# comparando com o encode sequencial do processo atual.
+#
+# Uso: python -m benchmarks.bench_parallel_embedding --textos 4000 --workers 1 2 4
+import argparse
+import os
+import time
+import numpy as np
+from src.ingestion import EMBEDDER_NAME, ParallelEncoder, load_and_prepare_data
+from src.model import get_embedder
+
+
+def textos_sinteticos(n, seed=0):
+    # Comprimentos variados como os CVs reais: de poucas palavras a contextos que truncam no encoder
+    rng = np.random.default_rng(seed)
+    vocab = ['python', 'sql', 'gestão', 'projetos', 'sap', 'java', 'cloud', 'dados', 'análise',
+             'suporte', 'infraestrutura', 'scrum', 'comunicação', 'liderança', 'vendas']
+    return [' '.join(rng.choice(vocab, size=int(rng.integers(5, 400)))) for _ in range(n)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', default=None, help='CSV de contextos (ex.: cv_atividades_competencias.csv)')
+    parser.add_argument('--textos', type=int, default=4000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    if args.csv:
+        textos = load_and_prepare_data(args.csv)['contexto'].tolist()[:args.textos]
+    else:
+        textos = textos_sinteticos(args.textos)
+
+    inicio = time.perf_counter()
+    referencia = get_embedder(EMBEDDER_NAME).encode(textos, batch_size=args.batch_size)
+    base = len(textos) / (time.perf_counter() - inicio)
+    print(f"sequencial (processo atual): {base:.1f} sentenças/s")
+
+    for workers in sorted(set(args.workers)):
+        with ParallelEncoder(EMBEDDER_NAME, workers=workers, batch_size=args.batch_size) as encoder:
+            # Aquece os workers (carga do modelo) fora da medição
+            encoder.encode(textos[:workers * args.batch_size])
+            inicio = time.perf_counter()
+            embeddings = encoder.encode(textos)
+            vazao = len(textos) / (time.perf_counter() - inicio)
+        erro = np.abs(embeddings - referencia).max()
+        print(f"workers={workers:>3}: {vazao:.1f} sentenças/s  ({vazao / base:.2f}x)  "
+              f"erro máx. vs sequencial={erro:.1e}")
@@ -0,0 +1,114 @@
+# bench_scheduler.py
+# Reproduz em processo o cenário do locustfile.py (usuários que esperam entre 0,05 e 2 s e enviam
+# uma pergunta por vez) e compara o batching estático (lote fechado até a geração mais longa
+# terminar, como o batching adaptativo do BentoML sobre o generate) com o batching contínuo do
+# src/scheduler.py: throughput (perguntas/s) e latência p50/p95 por pergunta.
+#
+# Uso: python -m benchmarks.bench_scheduler --usuarios 16 --duracao 60 --max-batch-size 8
+import argparse
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from benchmarks.bench_generation_policy import carregar_logs
+from src.model import RAGRunnable
+from src.scheduler import ContinuousBatchScheduler
+
+
+class StaticBatcher:
+    """Junta o que está na fila (até max_batch_size, esperando até max_wait) num generate_batch."""
+
+    def __init__(self, agent, max_batch_size=8, max_wait=0.01):
+        self.agent = agent
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, query, cancel_event=None):
+        future = Future()
+        self.queue.put((query, future))
+        return future
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                lote = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.max_wait
+            while len(lote) < self.max_batch_size:
+                try:
+                    lote.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            respostas = self.agent.generate_batch([q for q, _ in lote])
+            for (_, future), resposta in zip(lote, respostas):
+                future.set_result(resposta)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def simular_usuarios(scheduler, perguntas, usuarios, duracao, seed=0):
+    """Cada usuário: espera between(0.05, 2) como o locustfile, envia uma pergunta e aguarda a resposta."""
+    latencias = []
+    lock = threading.Lock()
+    fim = time.monotonic() + duracao
+
+    def usuario(i):
+        rng = random.Random(seed + i)
+        while True:
+            time.sleep(rng.uniform(0.05, 2))
+            if time.monotonic() >= fim:
+                return
+            inicio = time.perf_counter()
+            scheduler.submit(rng.choice(perguntas)).result()
+            with lock:
+                latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=usuario, args=(i,)) for i in range(usuarios)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - inicio
+    return {
+        'perguntas': len(latencias),
+        'perguntas_por_segundo': len(latencias) / total,
+        'p50_ms': np.percentile(latencias, 50) * 1000,
+        'p95_ms': np.percentile(latencias, 95) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--usuarios', type=int, default=16)
+    parser.add_argument('--duracao', type=float, default=60.0, help='Segundos de carga por modo')
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait', type=float, default=0.01)
+    parser.add_argument('--processed-dir', default=os.path.join('data', 'processed'),
+                        help='Diretório com os artefatos da ingestão (make data)')
+    parser.add_argument('--logs', default=os.path.join('monitoring', 'rag_recrutamento', 'data'))
+    args = parser.parse_args()
+
+    perguntas = list(dict.fromkeys(p for p, _ in carregar_logs(args.logs)))
+    # Sem prefix cache: os dois modos processam o prompt inteiro
+    agent = RAGRunnable(prefix_cache_tokens=0, processed_dir=args.processed_dir).agent
+    agent.generate(perguntas[0])  # aquecimento
+    modos = {'estatico': StaticBatcher, 'continuo': ContinuousBatchScheduler}
+    print(f"{args.usuarios} usuários, {args.duracao:.0f} s por modo, max_batch_size={args.max_batch_size}")
+    print(f"{'modo':<10} {'perguntas':>9} {'perg/s':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for nome, classe in modos.items():
+        scheduler = classe(agent, max_batch_size=args.max_batch_size, max_wait=args.max_wait)
+        r = simular_usuarios(scheduler, perguntas, args.usuarios, args.duracao)
+        scheduler.close()
+        print(f"{nome:<10} {r['perguntas']:>9} {r['perguntas_por_segundo']:>8.2f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f}")
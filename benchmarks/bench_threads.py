@@ -0,0 +1,71 @@
+# bench_threads.py
+# Matriz workers x threads do torch por worker para o orçamento de CPU do serviço: throughput
+# agregado (perguntas/s) e latência p50/p95 por pergunta. Cada worker é um processo com seu
+# próprio RAGAgent, como os workers do BentoML; as perguntas são distribuídas dinamicamente.
+#
+# Uso: python -m benchmarks.bench_threads --workers 1 2 4 --threads 1 2 4 --cpus 4
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+import numpy as np
+from benchmarks.bench_generation_policy import carregar_logs
+from src.model import RAGRunnable
+from src.runtime import configure_threads
+
+# Agente carregado uma vez em cada processo do pool
+_agent = None
+
+
+def _init_worker(threads, barreira, processed_dir):
+    global _agent
+    configure_threads(threads)
+    _agent = RAGRunnable(prefix_cache_tokens=0, processed_dir=processed_dir).agent
+    _agent.generate("aquecimento")
+    # Todos os workers começam juntos: nenhum pega perguntas enquanto outro ainda carrega o modelo
+    barreira.wait()
+
+
+def _responder(pergunta):
+    inicio = time.perf_counter()
+    _agent.generate(pergunta)
+    return inicio, time.perf_counter()
+
+
+def rodar_configuracao(workers, threads, perguntas, processed_dir):
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(threads, ctx.Barrier(workers), processed_dir)) as pool:
+        intervalos = pool.map(_responder, perguntas, chunksize=1)
+    inicios, fins = zip(*intervalos)
+    tempos = [fim - inicio for inicio, fim in intervalos]
+    return {
+        'perguntas_por_segundo': len(perguntas) / (max(fins) - min(inicios)),
+        'p50_ms': np.percentile(tempos, 50) * 1000,
+        'p95_ms': np.percentile(tempos, 95) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', nargs='*', type=int, default=[1, 2, 4])
+    parser.add_argument('--threads', nargs='*', type=int, default=[1, 2, 4])
+    parser.add_argument('--cpus', type=int, default=os.cpu_count() or 1,
+                        help='Orçamento de CPU; combinações com workers x threads acima dele são puladas')
+    parser.add_argument('--oversubscription', action='store_true',
+                        help='Roda também as combinações que excedem o orçamento de CPU')
+    parser.add_argument('--logs', default=os.path.join('monitoring', 'rag_recrutamento', 'data'))
+    parser.add_argument('--max-perguntas', type=int, default=32)
+    parser.add_argument('--processed-dir', default=os.path.join('data', 'processed'),
+                        help='Diretório com os artefatos da ingestão (make data)')
+    args = parser.parse_args()
+
+    perguntas = list(dict.fromkeys(p for p, _ in carregar_logs(args.logs)))[:args.max_perguntas]
+    print(f"{len(perguntas)} perguntas, orçamento de {args.cpus} CPUs")
+    print(f"{'workers':>7} {'threads':>7} {'perg/s':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for workers, threads in itertools.product(args.workers, args.threads):
+        if workers * threads > args.cpus and not args.oversubscription:
+            continue
+        r = rodar_configuracao(workers, threads, perguntas, args.processed_dir)
+        print(f"{workers:>7} {threads:>7} {r['perguntas_por_segundo']:>8.2f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f}")
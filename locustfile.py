@@ -1,12 +1,22 @@
+import itertools
+import os
+
 from locust import HttpUser, between, task
 
 # Ajuste: importar EXAMPLE_INPUT do service_v2
 from service_v2 import EXAMPLE_INPUT
 
+# LOCUST_PERGUNTAS_UNICAS=1 torna cada pergunta única, para medir a geração e não o cache de respostas
+PERGUNTAS_UNICAS = os.environ.get("LOCUST_PERGUNTAS_UNICAS") == "1"
+_contador = itertools.count()
+
 class RAGRecrutamentoTestUser(HttpUser):
     @task
     def responder(self):
         url = "/responder"
-        self.client.post(url, json={"perguntas": EXAMPLE_INPUT})
+        perguntas = EXAMPLE_INPUT
+        if PERGUNTAS_UNICAS:
+            perguntas = [f"{p} (#{next(_contador)})" for p in EXAMPLE_INPUT]
+        self.client.post(url, json={"perguntas": perguntas})
 
     wait_time = between(0.05, 2)
@@ -1,11 +1,21 @@
 """Service para servir o modelo RAG de recrutamento via BentoML e MLflow."""
 
 from __future__ import annotations
-from typing import List, Dict
+from typing import AsyncGenerator, List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import inspect
+import os
 import bentoml
 import mlflow
 import pandas as pd
-import tempfile
+import threading
+import time
+from bentoml.exceptions import InvalidArgument
+from src.cache import RESPONSE_CACHE_DB, ResponseCache
+from src.prediction_logger import PredictionLogger
+from src.runtime import configure_threads, layout_from_env
+from src.scheduler import ContinuousBatchScheduler
 #
 # Configure o URI de tracking do MLflow.
 mlflow.set_tracking_uri("file:///C:/Users/win/Desktop/Projetos/Datathon/llm/src/mlruns")
@@ -14,13 +24,103 @@ EXAMPLE_INPUT = [
     "Quais competências técnicas são mais valorizadas para a vaga Python?"
 ]
 
+METRICS_NAMESPACE = "rag_recrutamento_service"
+# Recursos declarados ao BentoML. Os núcleos são divididos entre os workers (RAG_WORKERS) e,
+# em cada worker, entre as gerações simultâneas (RAG_INFERENCE_CONCURRENCY); ver src/runtime.py
+CPU_RESOURCE = 4
+REQUEST_TIMEOUT = 30
+THREAD_LAYOUT = layout_from_env(CPU_RESOURCE)
+# Batching contínuo da geração (src/scheduler.py); RAG_CONTINUOUS_BATCHING=0 volta ao generate por lote
+CONTINUOUS_BATCHING = os.environ.get("RAG_CONTINUOUS_BATCHING", "1") == "1"
+SCHEDULER_MAX_BATCH_SIZE = int(os.environ.get("RAG_MAX_BATCH_SIZE", 8))
+SCHEDULER_MAX_WAIT = float(os.environ.get("RAG_MAX_WAIT", 0.01))
+
+# Acertos/faltas do cache de embeddings de consulta do RAGAgent (src/cache.py)
+query_cache_hits = bentoml.metrics.Counter(
+    name="query_embedding_cache_hits",
+    documentation="Perguntas cujo embedding veio do cache LRU do retriever",
+    namespace=METRICS_NAMESPACE,
+)
+query_cache_misses = bentoml.metrics.Counter(
+    name="query_embedding_cache_misses",
+    documentation="Perguntas que precisaram passar pelo encoder",
+    namespace=METRICS_NAMESPACE,
+)
+# Cache de respostas completas; taxa de acerto = hits / (hits + misses)
+response_cache_hits = bentoml.metrics.Counter(
+    name="response_cache_hits",
+    documentation="Perguntas respondidas pelo cache de respostas, por camada (memory/disk)",
+    labelnames=["tier"],
+    namespace=METRICS_NAMESPACE,
+)
+response_cache_misses = bentoml.metrics.Counter(
+    name="response_cache_misses",
+    documentation="Perguntas que precisaram de geração pelo modelo",
+    namespace=METRICS_NAMESPACE,
+)
+# Registro assíncrono das predições no MLflow (src/prediction_logger.py)
+prediction_log_queue_depth = bentoml.metrics.Gauge(
+    name="prediction_log_queue_depth",
+    documentation="Registros de predição aguardando gravação no MLflow",
+    namespace=METRICS_NAMESPACE,
+)
+prediction_log_flush_seconds = bentoml.metrics.Histogram(
+    name="prediction_log_flush_seconds",
+    documentation="Duração de cada gravação em lote no MLflow",
+    namespace=METRICS_NAMESPACE,
+)
+prediction_log_records = bentoml.metrics.Counter(
+    name="prediction_log_records",
+    documentation="Registros de predição por destino (flushed/failed/dropped)",
+    labelnames=["status"],
+    namespace=METRICS_NAMESPACE,
+)
+
+# Endpoint de streaming: o streamer entrega texto em trechos (palavras), não token a token
+stream_time_to_first_token = bentoml.metrics.Histogram(
+    name="stream_time_to_first_token_seconds",
+    documentation="Tempo entre a chegada da pergunta e o primeiro trecho de texto enviado",
+    namespace=METRICS_NAMESPACE,
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0),
+)
+stream_inter_token_latency = bentoml.metrics.Histogram(
+    name="stream_inter_token_latency_seconds",
+    documentation="Intervalo entre trechos de texto consecutivos do streaming",
+    namespace=METRICS_NAMESPACE,
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+# Scheduler de batching contínuo: ocupação do lote em andamento e fila de espera
+generation_batch_size = bentoml.metrics.Gauge(
+    name="generation_batch_size",
+    documentation="Sequências no lote de decodificação em andamento",
+    namespace=METRICS_NAMESPACE,
+)
+generation_queue_depth = bentoml.metrics.Gauge(
+    name="generation_queue_depth",
+    documentation="Perguntas aguardando entrada no lote de decodificação",
+    namespace=METRICS_NAMESPACE,
+)
+
+
+def _on_scheduler_change(lote, fila):
+    # Gauge com set() explícito: set_function não é coletado no modo multiprocesso do Prometheus
+    generation_batch_size.set(lote)
+    generation_queue_depth.set(fila)
+
+
+def _on_prediction_log_flush(n_registros, segundos, ok):
+    prediction_log_flush_seconds.observe(segundos)
+    prediction_log_records.labels(status="flushed" if ok else "failed").inc(n_registros)
+
+
 @bentoml.service(
-    resources={"cpu": "4"},
-    traffic={"timeout": 30},
+    resources={"cpu": str(CPU_RESOURCE)},
+    workers=THREAD_LAYOUT["workers"],
+    traffic={"timeout": REQUEST_TIMEOUT},
     monitoring={"enabled": True},
     metrics={
         "enabled": True,
-        "namespace": "rag_recrutamento_service",
+        "namespace": METRICS_NAMESPACE,
     },
     cors={"enabled": True, "allow_origins": ["*"]}
 )
@@ -31,9 +131,39 @@ class RAGRecrutamentoService:
         """
         Inicializa o serviço, carrega o modelo e busca os metadados do MLflow UMA VEZ.
         """
+        # Antes de carregar o modelo: threads do torch/OpenMP/tokenizers deste worker
+        self.thread_layout = {**THREAD_LAYOUT, **configure_threads(THREAD_LAYOUT["intra_op_threads"],
+                                                                   THREAD_LAYOUT["inter_op_threads"])}
         self.bento_model = bentoml.models.get("RAG_Recrutamento:latest")
         self.model = bentoml.mlflow.load_model(self.bento_model)
         self.mlflow_client = mlflow.tracking.MlflowClient()
+        # Cache de embeddings de consulta do agente carregado, para exportar hits/misses
+        try:
+            self.runnable = self.model.unwrap_python_model()
+            self.query_cache = self.runnable.agent.query_cache
+            retrieval_config = self.runnable.retrieval_config
+        except Exception:
+            self.runnable = None
+            self.query_cache = None
+            retrieval_config = {}
+        # A geração roda fora do event loop: /info e metadados não esperam atrás de um generate.
+        # Uma thread por geração simultânea, cada uma com intra_op_threads threads do torch
+        self.inference_executor = ThreadPoolExecutor(max_workers=THREAD_LAYOUT["concurrency"],
+                                                     thread_name_prefix="rag-inference")
+        # Gerações de requisições diferentes dividem o mesmo lote, entrando e saindo a cada token
+        self.scheduler = None
+        if CONTINUOUS_BATCHING and self.runnable is not None:
+            self.scheduler = ContinuousBatchScheduler(self.runnable.agent, max_batch_size=SCHEDULER_MAX_BATCH_SIZE,
+                                                      max_wait=SCHEDULER_MAX_WAIT, on_change=_on_scheduler_change)
+        # Respostas em cache por (pergunta normalizada, versão do modelo, configuração de retrieval);
+        # a camada SQLite é compartilhada pelos workers e limpa pelo register.py a cada novo modelo
+        self.response_cache = ResponseCache(self.bento_model.tag, retrieval_config, db_path=RESPONSE_CACHE_DB)
+        self._last_cache_counts = {}
+        self._cache_lock = threading.Lock()
+        # Um run do MLflow por lote (100 registros ou 30 s), fora do caminho da requisição
+        self.prediction_logger = PredictionLogger(batch_size=100, flush_interval=30.0,
+                                                  on_flush=_on_prediction_log_flush,
+                                                  on_queue_change=prediction_log_queue_depth.set)
 
         MLFLOW_REGISTERED_MODEL_NAME = "RAG_Recrutamento"
         try:
@@ -62,36 +192,126 @@ class RAGRecrutamentoService:
             }
 
 
+    def _cache_counts(self):
+        counts = {
+            (response_cache_hits, "memory"): self.response_cache.hits["memory"],
+            (response_cache_hits, "disk"): self.response_cache.hits["disk"],
+            (response_cache_misses, None): self.response_cache.misses,
+        }
+        if self.query_cache is not None:
+            counts[(query_cache_hits, None)] = self.query_cache.hits
+            counts[(query_cache_misses, None)] = self.query_cache.misses
+        return counts
+
+    def _sync_cache_metrics(self):
+        """Repassa aos contadores Prometheus o que os caches contaram desde a última sincronização."""
+        with self._cache_lock:
+            counts = self._cache_counts()
+            deltas = {k: v - self._last_cache_counts.get(k, 0) for k, v in counts.items()}
+            self._last_cache_counts = counts
+        for (counter, tier), delta in deltas.items():
+            if delta > 0:
+                (counter.labels(tier=tier) if tier else counter).inc(delta)
+
+    def _generate(self, perguntas: List[str], cancel_event: threading.Event, filtros: Optional[Dict] = None) -> List[str]:
+        if self.runnable is not None:
+            # Chamada direta ao agente para poder repassar o evento de cancelamento ao generate
+            return self.runnable.agent.generate_batch(perguntas, cancel_event=cancel_event, filters=filtros)
+        respostas = self.model.predict(pd.DataFrame({"pergunta": perguntas}))
+        return respostas.tolist() if hasattr(respostas, 'tolist') else list(respostas)
+
+    async def _submit(self, perguntas: List[str], cancel_event: threading.Event,
+                      filtros: Optional[Dict] = None) -> List[str]:
+        loop = asyncio.get_running_loop()
+        if self.scheduler is None:
+            return await loop.run_in_executor(self.inference_executor, self._generate, perguntas, cancel_event,
+                                              filtros)
+        # Retrieval e tokenização no executor; a geração entra no lote contínuo do scheduler
+        futures = await loop.run_in_executor(self.inference_executor, self.scheduler.submit_many,
+                                             perguntas, cancel_event, filtros)
+        return list(await asyncio.gather(*(asyncio.wrap_future(f) for f in futures)))
+
+    async def _run_inference(self, perguntas: List[str], filtros: Optional[Dict] = None) -> List[str]:
+        cancel_event = threading.Event()
+        try:
+            return await asyncio.wait_for(self._submit(perguntas, cancel_event, filtros), timeout=REQUEST_TIMEOUT)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # Cliente desconectou ou estourou o timeout: o generate para no próximo token
+            # e libera a thread do executor, em vez de gerar até o fim para ninguém
+            cancel_event.set()
+            raise
+
+    async def _predict(self, perguntas: List[str], filtros: Optional[Dict] = None) -> List[str]:
+        """Responde pelo cache quando possível e gera só as perguntas que faltam."""
+        # A camada SQLite bloqueia: leitura e escrita rodam numa thread, fora do event loop
+        # (e fora do inference_executor, para não esperar atrás de uma geração)
+        respostas_list = await asyncio.to_thread(self.response_cache.get_many, perguntas, filtros)
+        faltando = [p for p, r in zip(perguntas, respostas_list) if r is None]
+        if faltando:
+            novas = await self._run_inference(faltando, filtros)
+            await asyncio.to_thread(self.response_cache.put_many, faltando, novas, filtros)
+            novas = iter(novas)
+            respostas_list = [r if r is not None else next(novas) for r in respostas_list]
+        self._sync_cache_metrics()
+        return respostas_list
+
     @bentoml.api()
-    def inserir_pergunta(self, perguntas: List[str]) -> Dict:
+    async def inserir_pergunta(self, perguntas: List[str], incluir_contextos: bool = False,
+                               filtros: Optional[Dict] = None) -> Dict:
         """
         Endpoint que recebe perguntas, retorna a resposta e os metadados do modelo.
+        Com incluir_contextos=True, retorna também os contextos recuperados (id + score) por pergunta.
+        filtros restringe os CVs buscados pelos metadados da ingestão (src/metadata.py), p.ex.
+        {"aprovado": true}, {"titulo": "Desenvolvedor Python"} ou
+        {"data_candidatura": {"de": "2021-01-01", "ate": "2021-12-31"}}.
         """
         if not perguntas or not isinstance(perguntas, list):
             return {"error": "Input deve ser uma lista de perguntas não vazia."}
-        
-        df = pd.DataFrame({"pergunta": perguntas})
-        respostas = self.model.predict(df)
-        respostas_list = respostas.tolist() if hasattr(respostas, 'tolist') else list(respostas)
-
-        # Loga esta interação específica como um novo run no MLflow
-        with mlflow.start_run(run_name="log_prediction_request") as log_run:
-            mlflow.log_param("num_perguntas", len(perguntas))
-            mlflow.log_param("perguntas", perguntas)
-            # Logar respostas como artefato é uma boa prática para textos longos
-            with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".txt", encoding='utf-8') as f:
-                f.write("\n".join(map(str, respostas_list)))
-                mlflow.log_artifact(f.name, artifact_path="respostas")
-        
+        if filtros:
+            if self.runnable is None:
+                return {"error": "Filtros exigem o agente RAG carregado no serviço."}
+            try:
+                # Valida os campos antes de gerar; a seleção é só união/interseção de listas de ids
+                self.runnable.agent.candidate_ids(filtros)
+            except ValueError as e:
+                return {"error": str(e)}
+
+        respostas_list = await self._predict(perguntas, filtros)
+
+        # Enfileira a interação; o escritor em segundo plano grava um run consolidado por lote.
+        # O id identifica o registro dentro do artefato predicoes/predicoes.jsonl do run
+        prediction_log_id = self.prediction_logger.log({
+            "perguntas": perguntas,
+            "filtros": filtros,
+            "respostas": respostas_list,
+            "bento_model_tag": str(self.bento_model.tag),
+        })
+        if prediction_log_id is None:
+            prediction_log_records.labels(status="dropped").inc()
+
         # Combina a resposta da predição com os metadados do modelo
-        return {
+        resultado = {
             "respostas": respostas_list,
-            "prediction_log_run_id": log_run.info.run_id,
+            "prediction_log_id": prediction_log_id,
             "model_metadata": self.model_metadata
         }
+        if incluir_contextos and self.runnable is not None:
+            # Retrieval leve (embedding em cache + busca no índice): fora do executor de inferência
+            loop = asyncio.get_running_loop()
+            resultado["contextos"] = await loop.run_in_executor(
+                None, lambda: self.runnable.agent.retrieved_contexts(perguntas, filters=filtros))
+        return resultado
+
+    @bentoml.on_shutdown
+    def _shutdown(self):
+        # Cancela gerações pendentes e grava os registros ainda na fila antes do worker encerrar
+        self.inference_executor.shutdown(wait=False, cancel_futures=True)
+        if self.scheduler is not None:
+            self.scheduler.close(timeout=5)
+        self.prediction_logger.close(timeout=10)
 
     @bentoml.api(batchable=True)
-    def responder(self, perguntas: List[str] = EXAMPLE_INPUT) -> List[str]:
+    async def responder(self, perguntas: List[str] = EXAMPLE_INPUT) -> List[str]:
         """
         Endpoint padrão de inferência que retorna apenas a lista de respostas.
         """
@@ -99,14 +319,72 @@ class RAGRecrutamentoService:
             return []
         with bentoml.monitor("rag_recrutamento") as mon:
             mon.log(perguntas, name="request", role="input", data_type="list")
-            df = pd.DataFrame({"pergunta": perguntas})
-            respostas = self.model.predict(df)
-            respostas_list = respostas.tolist() if hasattr(respostas, 'tolist') else list(respostas)
+            respostas_list = await self._predict(perguntas)
             mon.log(respostas_list, name="response", role="prediction", data_type="list")
             return respostas_list
 
+    @bentoml.api(route="/responder_stream")
+    async def responder_stream(self, pergunta: str = EXAMPLE_INPUT[0],
+                               filtros: Optional[Dict] = None) -> AsyncGenerator[str, None]:
+        """
+        Endpoint de inferência em streaming: envia a resposta em trechos à medida que o modelo gera.
+        Usa o mesmo cache de respostas e os mesmos filtros de metadados do inserir_pergunta.
+        """
+        inicio = time.perf_counter()
+        if filtros:
+            if self.runnable is None:
+                raise InvalidArgument("Filtros exigem o agente RAG carregado no serviço.")
+            try:
+                self.runnable.agent.candidate_ids(filtros)
+            except ValueError as e:
+                raise InvalidArgument(str(e)) from e
+        if self.runnable is None:
+            # Sem acesso ao agente não há streamer: envia a resposta inteira de uma vez
+            respostas_list = await self._predict([pergunta])
+            stream_time_to_first_token.observe(time.perf_counter() - inicio)
+            yield respostas_list[0]
+            return
+        resposta = (await asyncio.to_thread(self.response_cache.get_many, [pergunta], filtros))[0]
+        if resposta is not None:
+            self._sync_cache_metrics()
+            stream_time_to_first_token.observe(time.perf_counter() - inicio)
+            yield resposta
+            return
+        cancel_event = threading.Event()
+        # Geração no executor de inferência; se ela falhar, o stream termina e relança o erro.
+        # timeout: limite de espera por trecho (ex.: executor ocupado)
+        trechos = self.runnable.agent.generate_stream(pergunta, cancel_event=cancel_event, filters=filtros,
+                                                      executor=self.inference_executor, timeout=REQUEST_TIMEOUT)
+        loop = asyncio.get_running_loop()
+        partes, anterior = [], None
+        try:
+            while True:
+                # A leitura bloqueante do streamer vai para o executor padrão; o event loop segue livre
+                trecho = await loop.run_in_executor(None, next, trechos, None)
+                if trecho is None:
+                    break
+                if not trecho:
+                    continue
+                agora = time.perf_counter()
+                if anterior is None:
+                    stream_time_to_first_token.observe(agora - inicio)
+                else:
+                    stream_inter_token_latency.observe(agora - anterior)
+                anterior = agora
+                partes.append(trecho)
+                yield trecho
+        finally:
+            # Cliente desconectou (ou erro): interrompe a geração no próximo token. Um next em andamento
+            # termina sozinho com o fim do streamer; um gerador parado num trecho é fechado fora do loop
+            cancel_event.set()
+            if inspect.getgeneratorstate(trechos) == inspect.GEN_SUSPENDED:
+                loop.run_in_executor(None, trechos.close)
+        # Resposta completa: entra no cache como a do inserir_pergunta
+        await asyncio.to_thread(self.response_cache.put_many, [pergunta], [''.join(partes)], filtros)
+        self._sync_cache_metrics()
+
     @bentoml.api(input_spec=None, route="/info" )
-    def info(self) -> Dict:
+    async def info(self) -> Dict:
         """
         Endpoint que retorna os metadados sobre o modelo em produção.
         """
@@ -0,0 +1,306 @@
+# cache.py
+# Caches do caminho de consulta: LRU em memória (limitado por tamanho e TTL) para os
+# embeddings das perguntas, prefixos de prompt já processados pelo LLM (KV cache) e cache de
+# respostas em duas camadas (memória + SQLite).
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import closing
+
+
+def normalize_query(text):
+    """Chave canônica de uma pergunta: Unicode NFC, minúsculas e espaços colapsados."""
+    text = unicodedata.normalize('NFC', str(text))
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+class LRUCache:
+    """Dicionário LRU thread-safe com no máximo maxsize entradas, cada uma válida por ttl segundos.
+
+    Conta acertos e faltas em hits/misses; uma entrada expirada conta como falta e é descartada.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if self.ttl is None or expires > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            expires = None if self.ttl is None else self.clock() + self.ttl
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getstate__(self):
+        # O RAGRunnable é serializado pelo MLflow: o lock não é picklable e as entradas não são
+        # levadas junto (o cache começa vazio em cada processo que carrega o modelo)
+        state = self.__dict__.copy()
+        state['_data'] = OrderedDict()
+        state['hits'] = state['misses'] = 0
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def cache_layers(past_key_values):
+    """(keys, values) por camada, [lote, cabeças, tokens, dim], do cache devolvido pelo modelo."""
+    if hasattr(past_key_values, 'layers'):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, 'key_cache'):
+        return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+    return [tuple(layer[:2]) for layer in past_key_values]
+
+
+def build_cache(layers, legacy=False):
+    """Inverso de cache_layers: monta o past_key_values a passar para o próximo forward."""
+    if legacy:
+        return tuple(layers)
+    from transformers import DynamicCache
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def _crop(past_key_values, length):
+    # Comprimento negativo = tokens a descartar do fim (forma aceita por todas as versões do DynamicCache)
+    excess = past_key_values.get_seq_length() - length
+    if excess > 0:
+        past_key_values.crop(-excess)
+    return past_key_values
+
+
+class PrefixKVCache:
+    """Past key/values do LLM para prompts vistos recentemente, limitado pelo total de tokens guardados.
+
+    lookup() devolve uma cópia das posições do maior prefixo em comum entre um prompt guardado e o
+    novo prompt; o generate só processa os tokens restantes. Prefixos menores que min_prefix não
+    compensam a cópia e o forward separado (o cabeçalho do template sozinho não basta).
+    Memória por token: 2 * camadas * dim do modelo * 4 bytes (~37 KB no distilgpt2).
+    """
+
+    def __init__(self, max_tokens=4096, min_prefix=64):
+        self.max_tokens = max_tokens
+        self.min_prefix = min_prefix
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self._data = OrderedDict()
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _common_prefix(a, b):
+        n = min(len(a), len(b))
+        for i in range(n):
+            if a[i] != b[i]:
+                return i
+        return n
+
+    def lookup(self, token_ids):
+        token_ids = tuple(int(t) for t in token_ids)
+        with self._lock:
+            best, best_len = None, 0
+            for key in self._data:
+                length = self._common_prefix(key, token_ids)
+                if length > best_len:
+                    best, best_len = key, length
+            # Ao menos um token precisa passar pelo modelo para gerar os logits do próximo
+            best_len = min(best_len, len(token_ids) - 1)
+            if best is None or best_len < self.min_prefix:
+                self.misses += 1
+                return None
+            self._data.move_to_end(best)
+            self.hits += 1
+            self.reused_tokens += best_len
+            stored = self._data[best]
+            # Copia só as posições do prefixo, não o K/V inteiro do prompt guardado
+            return build_cache([tuple(x[:, :, :best_len].clone() for x in layer) for layer in cache_layers(stored)],
+                               isinstance(stored, tuple))
+
+    def store(self, token_ids, past_key_values):
+        """Guarda past_key_values (pode conter tokens gerados; é cortado no tamanho do prompt)."""
+        token_ids = tuple(int(t) for t in token_ids)
+        if not self.max_tokens or len(token_ids) > self.max_tokens:
+            return
+        past_key_values = _crop(past_key_values, len(token_ids))
+        with self._lock:
+            if token_ids in self._data:
+                self._data.move_to_end(token_ids)
+                return
+            self._data[token_ids] = past_key_values
+            self._tokens += len(token_ids)
+            while self._tokens > self.max_tokens:
+                key, _ = self._data.popitem(last=False)
+                self._tokens -= len(key)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getstate__(self):
+        # Tensores do LLM não vão junto para o MLflow: o cache começa vazio em cada processo
+        state = self.__dict__.copy()
+        state['_data'] = OrderedDict()
+        state['_tokens'] = 0
+        state['hits'] = state['misses'] = state['reused_tokens'] = 0
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+# Camada em disco compartilhada entre os workers do BentoML (e limpa pelo register.py).
+# Caminho absoluto (data/processed na raiz do projeto), igual para o serviço e o register.py
+# independentemente do diretório de trabalho; RAG_RESPONSE_CACHE_DB o substitui
+RESPONSE_CACHE_DB = os.environ.get('RAG_RESPONSE_CACHE_DB', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'processed', 'response_cache.sqlite'))
+_RESPONSES_SCHEMA = ('CREATE TABLE IF NOT EXISTS responses ('
+                     'key TEXT PRIMARY KEY, model_tag TEXT NOT NULL, '
+                     'response TEXT NOT NULL, created REAL NOT NULL)')
+
+
+def response_key(question, model_tag, config):
+    """Chave de uma resposta: pergunta normalizada + versão do modelo + configuração do retriever."""
+    payload = json.dumps([normalize_query(question), str(model_tag), config or {}],
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Cache de respostas geradas em duas camadas: LRU em memória do processo e,
+    opcionalmente, uma tabela SQLite compartilhada pelos workers.
+
+    A geração é gulosa, então a mesma pergunta com o mesmo modelo e a mesma configuração
+    de retrieval produz a mesma resposta. Um modelo novo muda a chave (model_tag) e
+    invalidate() remove do disco as respostas de outras versões.
+    """
+
+    def __init__(self, model_tag, config=None, maxsize=4096, ttl=None, db_path=None):
+        self.model_tag = str(model_tag)
+        self.config = config or {}
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.db_path = db_path
+        # Contagem por camada: {'memory': n, 'disk': n}; faltas contam quando nenhuma camada tem a chave
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                conn.execute(_RESPONSES_SCHEMA)
+
+    def _connect(self):
+        # Uma conexão por operação: seguro entre threads e processos; WAL permite leitores concorrentes
+        conn = sqlite3.connect(self.db_path, timeout=5.0)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _config(self, filters):
+        # Filtros de metadados mudam os contextos recuperados, então entram na chave
+        return {**self.config, 'filters': filters} if filters else self.config
+
+    def get_many(self, questions, filters=None):
+        """Respostas em cache na ordem das perguntas (None onde não há)."""
+        keys = [response_key(q, self.model_tag, self._config(filters)) for q in questions]
+        found = {}
+        for key in dict.fromkeys(keys):
+            value = self.memory.get(key)
+            if value is not None:
+                found[key] = value
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        disk = {}
+        if missing and self.db_path:
+            disk = self._read_disk(missing)
+            for key, value in disk.items():
+                self.memory.put(key, value)
+            found.update(disk)
+        with self._lock:
+            for key in keys:
+                if key not in found:
+                    self.misses += 1
+                else:
+                    self.hits['disk' if key in disk else 'memory'] += 1
+        return [found.get(key) for key in keys]
+
+    def _read_disk(self, keys):
+        query = f"SELECT key, response, created FROM responses WHERE key IN ({','.join('?' * len(keys))})"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, keys).fetchall()
+        agora = time.time()
+        return {key: response for key, response, created in rows
+                if self.ttl is None or created + self.ttl > agora}
+
+    def put_many(self, questions, responses, filters=None):
+        rows = []
+        for question, response in zip(questions, responses):
+            key = response_key(question, self.model_tag, self._config(filters))
+            self.memory.put(key, response)
+            rows.append((key, self.model_tag, str(response), time.time()))
+        if rows and self.db_path:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)', rows)
+
+    def invalidate(self):
+        """Remove as respostas de outras versões do modelo e esvazia a camada em memória."""
+        self.memory.clear()
+        if self.db_path:
+            invalidate_response_cache(self.db_path, keep_model_tag=self.model_tag)
+
+
+def invalidate_response_cache(db_path=RESPONSE_CACHE_DB, keep_model_tag=None):
+    """Apaga do cache em disco as respostas de modelos diferentes de keep_model_tag (ou todas).
+
+    Retorna o número de respostas removidas.
+    """
+    if not os.path.exists(db_path):
+        return 0
+    with closing(sqlite3.connect(db_path, timeout=5.0)) as conn, conn:
+        conn.execute(_RESPONSES_SCHEMA)
+        if keep_model_tag is None:
+            cur = conn.execute('DELETE FROM responses')
+        else:
+            cur = conn.execute('DELETE FROM responses WHERE model_tag != ?', (str(keep_model_tag),))
+        return cur.rowcount
@@ -0,0 +1,88 @@
+# chunking.py
+# Divisão dos contextos em passagens curtas para o retriever: o all-MiniLM-L6-v2 só enxerga os
+# primeiros ~256 word pieces de cada texto, então um CV inteiro embedado como um vetor só é
+# representado pelo começo. Cada passagem guarda a linha do CV de origem (passagens.cv), a busca
+# roda sobre as passagens e os resultados são agregados por CV.
+import re
+import numpy as np
+
+# Tamanho das passagens em palavras (~1,5 word piece por palavra em português cabe em 256) e
+# quantas palavras do fim de uma passagem são repetidas no começo da seguinte
+CHUNK_WORDS = 128
+CHUNK_OVERLAP = 32
+
+# Parágrafos (linha em branco) são as seções do texto; dentro deles, quebras de linha, fim de
+# frase e marcadores de lista separam as frases
+_PARAGRAPH = re.compile(r'\n\s*\n')
+_SENTENCE = re.compile(r'(?<=[.!?;])\s+|\s*\n\s*|\s+(?=[•▪●◦·]\s*)')
+
+
+def _units(text, max_words, overlap):
+    """Blocos de palavras a empacotar: parágrafos inteiros quando cabem, senão suas frases; frases
+    maiores que max_words viram janelas de palavras com sobreposição."""
+    units = []
+    for paragraph in _PARAGRAPH.split(text):
+        words = paragraph.split()
+        if len(words) <= max_words:
+            if words:
+                units.append(words)
+            continue
+        for sentence in _SENTENCE.split(paragraph):
+            words = sentence.split()
+            step = max_words - overlap
+            for i in range(0, max(len(words) - overlap, 1), step):
+                if words[i:i + max_words]:
+                    units.append(words[i:i + max_words])
+    return units
+
+
+def chunk_text(text, max_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Passagens de até max_words palavras, sem cortar parágrafos ou frases que caibam inteiros.
+
+    Cada passagem nova começa com as últimas frases da anterior (até overlap palavras), para que
+    um trecho na fronteira entre duas passagens apareça inteiro em ao menos uma delas.
+    """
+    if not 0 <= overlap < max_words:
+        raise ValueError(f"overlap deve estar entre 0 e max_words - 1; recebido {overlap}")
+    chunks, current = [], []
+    for unit in _units('' if text is None else str(text), max_words, overlap):
+        if current and sum(map(len, current)) + len(unit) > max_words:
+            chunks.append(current)
+            carry = []
+            for previous in reversed(current):
+                if sum(map(len, carry)) + len(previous) > overlap:
+                    break
+                carry.insert(0, previous)
+            current = carry if sum(map(len, carry)) + len(unit) <= max_words else []
+        current.append(unit)
+    if current:
+        chunks.append(current)
+    return [' '.join(word for unit in chunk for word in unit) for chunk in chunks]
+
+
+def aggregate_passages(scores, ids, passage_cv, top_k, per_cv=1):
+    """Agrega por CV os resultados de uma busca sobre passagens (scores/ids em ordem decrescente).
+
+    O score de um CV é o da sua melhor passagem. Retorna (scores, ids) [consultas, top_k * per_cv]
+    com até per_cv passagens de cada um dos top_k melhores CVs, CV a CV, e ids == -1 nas sobras.
+    """
+    out_scores = np.full((len(ids), top_k * per_cv), -np.inf, dtype=np.float32)
+    out_ids = np.full((len(ids), top_k * per_cv), -1, dtype=np.int64)
+    for row, (row_scores, row_ids) in enumerate(zip(scores, ids)):
+        by_cv = {}
+        for score, i in zip(row_scores, row_ids):
+            if i < 0:
+                continue
+            cv = int(passage_cv[i])
+            if cv not in by_cv:
+                if len(by_cv) == top_k:
+                    continue
+                by_cv[cv] = []
+            if len(by_cv[cv]) < per_cv:
+                by_cv[cv].append((score, i))
+        col = 0
+        for passages in by_cv.values():
+            for score, i in passages:
+                out_scores[row, col], out_ids[row, col] = score, i
+                col += 1
+    return out_scores, out_ids
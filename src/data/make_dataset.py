@@ -3,17 +3,52 @@ import click
 import logging
 from pathlib import Path
 from dotenv import find_dotenv, load_dotenv
+from src.chunking import CHUNK_OVERLAP, CHUNK_WORDS
+from src.ingestion import EMBEDDER_NAME, QUANTIZATION_DTYPES, run_streaming_ingestion
 
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
-@click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
+@click.argument('output_filepath', type=click.Path(file_okay=False))
+@click.option('--format', 'source_format', type=click.Choice(['csv', 'json']), default=None,
+              help='Formato da fonte; por padrão deduzido pela extensão.')
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Linhas/registros lidos da fonte por bloco.')
+@click.option('--encode-batch-size', default=64, show_default=True,
+              help='Tamanho do lote passado ao SentenceTransformer.encode.')
+@click.option('--model-name', default=EMBEDDER_NAME, show_default=True)
+@click.option('--workers', default=1, show_default=True,
+              help='Processos de encoding em paralelo (CPU); 1 usa o processo atual.')
+@click.option('--index', 'index_kind', type=click.Choice(['exact', 'ivf']), default='exact',
+              show_default=True)
+@click.option('--chunk-words', default=CHUNK_WORDS, show_default=True,
+              help='Palavras por passagem do retriever (não confundir com --chunk-size); 0 desativa.')
+@click.option('--chunk-overlap', default=CHUNK_OVERLAP, show_default=True,
+              help='Palavras repetidas entre passagens consecutivas.')
+@click.option('--resume/--no-resume', default=True, show_default=True,
+              help='Retoma do último checkpoint confirmado em OUTPUT_FILEPATH.')
+@click.option('--quantization', multiple=True, type=click.Choice(list(QUANTIZATION_DTYPES)),
+              help='Cópias quantizadas adicionais dos embeddings (repetível).')
+def main(input_filepath, output_filepath, source_format, chunk_size, encode_batch_size,
+         model_name, workers, index_kind, chunk_words, chunk_overlap, resume, quantization):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
+
+        Lê INPUT_FILEPATH (CSV como cv_atividades_competencias.csv ou JSON como
+        applicants.json) em blocos e grava em OUTPUT_FILEPATH os artefatos do retriever
+        (embeddings.bin, contextos.bin, manifest.json e index.npz, mais as passagens passagens_*)
+        sem carregar a fonte inteira.
     """
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
+    Path(output_filepath).mkdir(parents=True, exist_ok=True)
+    checkpoint = run_streaming_ingestion(
+        input_filepath, output_filepath, source_format=source_format, chunk_size=chunk_size,
+        encode_batch_size=encode_batch_size, model_name=model_name, resume=resume,
+        index_kind=index_kind, workers=workers,
+        chunking=(chunk_words, chunk_overlap) if chunk_words else None, quantization=quantization)
+    logger.info('%d registros lidos, %d contextos gravados em %s',
+                checkpoint['rows_done'], checkpoint['stored'], output_filepath)
 
 
 if __name__ == '__main__':
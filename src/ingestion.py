@@ -1,26 +1,687 @@
 # 02_ingestion.py
 # Ingestão, pré-processamento e indexação dos dados do CSV para o retriever RAG
+import os
+import sys
+if __package__ in (None, ''):
+    # Executado como script de dentro de src/ (python ingestion.py): a raiz do projeto entra no
+    # sys.path para os imports do pacote src
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import pandas as pd
 import numpy as np
 from sentence_transformers import SentenceTransformer
-import os
+from transformers import AutoTokenizer
+from src.chunking import CHUNK_OVERLAP, CHUNK_WORDS, chunk_text
+from src.lexical import load_lexical_index, save_lexical_index, write_lexical_index
+from src.metadata import METADATA_COLUMNS, MetadataIndex, load_metadata_index, save_metadata_index
+from src.runtime import configure_threads, thread_layout
+from src.store import (append_contexts, append_embeddings, append_passage_map, append_token_counts,
+                       append_tokens, corpus_files, open_context_store, open_embedding_store, open_passage_map,
+                       open_token_counts,
+                       token_dtype, truncate_store, write_context_store, write_embedding_store,
+                       write_passage_map, write_quantized_store, write_token_counts, write_token_store)
+from src.vector_index import ExactIndex, build_index, load_index, recall_at_k, save_index
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+
+EMBEDDER_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+# Tokenizador do LLM gerador: os contextos são gravados já tokenizados (contextos.tok) e com a
+# contagem de tokens (contextos.ntok), usada no empacotamento do prompt
+GENERATOR_NAME = 'distilgpt2'
+QUANTIZATION_DTYPES = ('float16', 'int8')
+CONTEXT_COLUMNS = ['cv_pt', 'perfil_vaga.principais_atividades',
+                   'perfil_vaga.competencia_tecnicas_e_comportamentais']
+
+def prepare_contexts(df):
+    # Concatenar campos relevantes para contexto (colunas ausentes contam como vazias)
+    partes = [df[col].fillna('').astype(str) if col in df.columns else pd.Series('', index=df.index)
+              for col in CONTEXT_COLUMNS]
+    df['contexto'] = partes[0] + ' ' + partes[1] + ' ' + partes[2]
+    return df
 
 def load_and_prepare_data(csv_path):
     df = pd.read_csv(csv_path)
-    # Concatenar campos relevantes para contexto
-    df['contexto'] = df['cv_pt'].fillna('') + ' ' + \
-        df['perfil_vaga.principais_atividades'].fillna('') + ' ' + \
-        df['perfil_vaga.competencia_tecnicas_e_comportamentais'].fillna('')
-    return df
+    return prepare_contexts(df)
 
-def embed_contexts(df, model_name='sentence-transformers/all-MiniLM-L6-v2'):
+def embed_contexts(df, model_name=EMBEDDER_NAME, workers=1, batch_size=32):
+    return embed_texts(df['contexto'].tolist(), model_name=model_name, workers=workers, batch_size=batch_size)
+
+def embed_texts(textos, model_name=EMBEDDER_NAME, workers=1, batch_size=32):
+    if workers > 1:
+        with ParallelEncoder(model_name, workers=workers, batch_size=batch_size) as encoder:
+            return encoder.encode(textos)
     model = SentenceTransformer(model_name)
-    embeddings = model.encode(df['contexto'].tolist(), show_progress_bar=True)
+    embeddings = model.encode(textos, show_progress_bar=True)
     return embeddings
 
+def chunk_frame(df, max_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Passagens dos contextos de df e a posição (em df) do CV de origem de cada uma.
+
+    Com as colunas de CONTEXT_COLUMNS presentes, cada uma é uma seção: nenhuma passagem mistura
+    o CV com as atividades ou competências da vaga. Sem elas, divide a coluna 'contexto'.
+    """
+    colunas = CONTEXT_COLUMNS if all(col in df.columns for col in CONTEXT_COLUMNS) else ['contexto']
+    passagens, linhas = [], []
+    for pos, secoes in enumerate(zip(*(df[col].fillna('').astype(str) for col in colunas))):
+        for secao in secoes:
+            for passagem in chunk_text(secao, max_words, overlap):
+                passagens.append(passagem)
+                linhas.append(pos)
+    return passagens, np.asarray(linhas, dtype=np.int64)
+
+def tokenize_contexts(textos, tokenizer, batch_size=256):
+    """Token ids de cada texto no tokenizador do gerador (sem tokens especiais)."""
+    ids = []
+    for i in range(0, len(textos), batch_size):
+        lote = [str(t) for t in textos[i:i + batch_size]]
+        ids.extend(tokenizer(lote, add_special_tokens=False, verbose=False)['input_ids'])
+    return ids
+
+def create_token_stores(processed_dir, generator_name=GENERATOR_NAME, passages=False):
+    """Cria contextos.tok e contextos.ntok (ou passagens.tok/.ntok) vazios para o tokenizador
+    do gerador e retorna o tokenizador."""
+    files = corpus_files(processed_dir, passages)
+    tokenizer = AutoTokenizer.from_pretrained(generator_name)
+    write_token_store(files['tokens'], [], generator_name, dtype=token_dtype(len(tokenizer)))
+    write_token_counts(files['token_counts'], [], generator_name)
+    return tokenizer
+
+def open_generator_tokenizer(processed_dir, passages=False):
+    """Tokenizador com que os stores de tokens existentes foram gravados, ou None se não houver."""
+    files = corpus_files(processed_dir, passages)
+    if not (os.path.exists(files['tokens']) and os.path.exists(files['token_counts'])):
+        return None
+    return AutoTokenizer.from_pretrained(open_token_counts(files['token_counts']).tokenizer)
+
+def append_context_tokens(processed_dir, textos, tokenizer, passages=False):
+    files = corpus_files(processed_dir, passages)
+    ids = tokenize_contexts(textos, tokenizer)
+    append_tokens(files['tokens'], ids)
+    append_token_counts(files['token_counts'], [len(seq) for seq in ids])
+
+def remove_passage_stores(processed_dir):
+    files = corpus_files(processed_dir, passages=True)
+    paths = [files[key] for key in ('embeddings', 'contexts', 'tokens', 'token_counts', 'index', 'lexical', 'map')]
+    paths += list(files['quantized'].values())
+    for path in paths + [files['contexts'] + '.idx', files['tokens'] + '.idx']:
+        if os.path.exists(path):
+            os.remove(path)
+
+def create_passage_stores(processed_dir, max_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP,
+                          generator_name=GENERATOR_NAME):
+    """Recria vazios os stores de passagens (textos, CV de origem e tokens) e retorna o tokenizador
+    do gerador (None sem generator_name); os embeddings são criados no primeiro append_passages."""
+    remove_passage_stores(processed_dir)
+    files = corpus_files(processed_dir, passages=True)
+    write_context_store(files['contexts'], [])
+    write_passage_map(files['map'], [], max_words, overlap)
+    if generator_name:
+        return create_token_stores(processed_dir, generator_name, passages=True)
+    return None
+
+def append_passages(processed_dir, df, first_row, encode, model_name=EMBEDDER_NAME,
+                    tokenizer=None, quantization=()):
+    """Divide os contextos de df em passagens e as acrescenta aos stores de passagens.
+
+    first_row é a linha do primeiro CV de df no contextos.bin; encode(textos) devolve os
+    embeddings. Cópias quantizadas existentes recebem as linhas novas; as de `quantization`
+    que ainda não existem são criadas. O passagens.cv é gravado por último.
+    """
+    files = corpus_files(processed_dir, passages=True)
+    passage_map = open_passage_map(files['map'])
+    textos, linhas = chunk_frame(df, passage_map.max_words, passage_map.overlap)
+    if not textos:
+        return 0
+    embeddings = encode(textos)
+    for dtype, path in [('float32', files['embeddings'])] + list(files['quantized'].items()):
+        if os.path.exists(path):
+            append_embeddings(path, embeddings)
+        elif dtype == 'float32' or dtype in quantization:
+            write_embedding_store(path, embeddings, model_name, dtype=dtype)
+    append_contexts(files['contexts'], textos)
+    if tokenizer is not None:
+        append_context_tokens(processed_dir, textos, tokenizer, passages=True)
+    append_passage_map(files['map'], linhas + first_row)
+    return len(textos)
+
+def build_passage_index(processed_dir, index_kind='exact', index_params=None):
+    """Índice vetorial e índice BM25 das passagens gravadas."""
+    files = corpus_files(processed_dir, passages=True)
+    if not os.path.exists(files['embeddings']):
+        return None
+    vectors = open_embedding_store(files['embeddings']).vectors
+    index = build_index(index_kind, vectors, normalized=True, **(index_params or {}))
+    save_index(index, files['index'])
+    build_lexical_index(processed_dir, open_context_store(files['contexts']), passages=True)
+    return index
+
+def build_lexical_index(processed_dir, textos, passages=False, chunk_size=1000):
+    """Índice invertido BM25 (lexico.npz ou passagens_lexico.npz) dos textos, na ordem do corpus.
+
+    Os textos (lista ou store mapeado) são lidos em blocos de chunk_size e os postings montados em
+    disco (write_lexical_index), então a memória não cresce com o corpus, como na ingestão em streaming.
+    """
+    textos = iter(textos)
+    blocos = iter(lambda: list(itertools.islice(textos, chunk_size)), [])
+    return write_lexical_index(blocos, corpus_files(processed_dir, passages)['lexical'])
+
+def add_to_lexical_index(processed_dir, textos, passages=False):
+    """Indexa no BM25 existente os textos acrescentados ao fim do corpus (ingestão incremental)."""
+    path = corpus_files(processed_dir, passages)['lexical']
+    if not os.path.exists(path):
+        return None
+    index = load_lexical_index(path)
+    index.add_documents(textos)
+    save_lexical_index(index, path)
+    return index
+
+def build_metadata_index(processed_dir, df):
+    """Metadados estruturados (metadados.npz) das linhas de df, na ordem do corpus de CVs."""
+    index = MetadataIndex.build(df)
+    save_metadata_index(index, corpus_files(processed_dir)['metadata'])
+    return index
+
+def add_to_metadata_index(processed_dir, df):
+    """Acrescenta ao metadados.npz existente os metadados das linhas novas do corpus."""
+    path = corpus_files(processed_dir)['metadata']
+    if not os.path.exists(path):
+        return None
+    index = load_metadata_index(path)
+    index.add_rows(df)
+    save_metadata_index(index, path)
+    return index
+
+# Modelo carregado uma vez em cada processo do pool de encoding
+_worker_model = None
+
+def _init_encoder_worker(model_factory, model_name, threads):
+    global _worker_model
+    # Divide os núcleos entre os workers para não haver oversubscription de threads do torch
+    configure_threads(threads)
+    _worker_model = model_factory(model_name)
+
+def _encode_bucket(args):
+    bucket_id, textos, batch_size = args
+    embeddings = _worker_model.encode(textos, batch_size=batch_size, show_progress_bar=False)
+    return bucket_id, np.asarray(embeddings, dtype=np.float32)
+
+def length_buckets(textos, batch_size):
+    """Agrupa os índices dos textos em lotes de tamanhos parecidos (menos padding por lote),
+    do mais longo para o mais curto, para os lotes mais caros serem despachados primeiro."""
+    order = np.argsort([-len(t) for t in textos], kind='stable')
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+class ParallelEncoder:
+    """Pool de processos, cada um com seu SentenceTransformer, para embedar em CPU com todos os núcleos.
+
+    A saída preserva a ordem dos textos de entrada independentemente de qual worker terminou primeiro.
+    """
+    def __init__(self, model_name=EMBEDDER_NAME, workers=None, batch_size=32,
+                 model_factory=SentenceTransformer):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        threads = thread_layout(os.cpu_count() or 1, workers=self.workers)['intra_op_threads']
+        # spawn: fork de um processo com torch já inicializado pode travar
+        ctx = multiprocessing.get_context('spawn')
+        self.pool = ctx.Pool(self.workers, initializer=_init_encoder_worker,
+                             initargs=(model_factory, model_name, threads))
+
+    def encode(self, textos):
+        textos = [str(t) for t in textos]
+        buckets = length_buckets(textos, self.batch_size)
+        tarefas = [(i, [textos[j] for j in bucket], self.batch_size) for i, bucket in enumerate(buckets)]
+        embeddings = None
+        for bucket_id, bloco in self.pool.imap_unordered(_encode_bucket, tarefas):
+            if embeddings is None:
+                embeddings = np.empty((len(textos), bloco.shape[1]), dtype=np.float32)
+            embeddings[buckets[bucket_id]] = bloco
+        return embeddings if embeddings is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def build_retriever_index(embeddings, kind='exact', n_queries=200, k=3, seed=0, **params):
+    """Constrói o índice do retriever e mede o recall@k contra a busca exata.
+
+    As consultas de avaliação são uma amostra dos próprios embeddings do corpus.
+    """
+    index = build_index(kind, embeddings, **params)
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(len(embeddings), min(n_queries, len(embeddings)), replace=False)]
+    recall = recall_at_k(index, ExactIndex(embeddings), queries, k=k)
+    return index, recall
+
+def content_hash(text):
+    return hashlib.sha1(str(text).encode('utf-8')).hexdigest()
+
+def metadata_hashes(df):
+    """Hash das colunas de metadados (METADATA_COLUMNS presentes) de cada linha de df; vai para o
+    manifesto ao lado do hash do contexto para detectar mudanças só de metadados."""
+    columns = [col for col in METADATA_COLUMNS if col in df.columns]
+    if not columns:
+        return [content_hash('')] * len(df)
+    return [content_hash('\x1f'.join(f'{col}={value}' for col, value in zip(columns, values)))
+            for values in df[columns].itertuples(index=False, name=None)]
+
+def load_manifest(processed_dir):
+    path = os.path.join(processed_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(processed_dir, manifest):
+    # Escrita atômica: o manifesto só muda depois que stores e índice foram atualizados
+    path = os.path.join(processed_dir, 'manifest.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+def build_processed_data(df, processed_dir, model_name=EMBEDDER_NAME, index_kind='exact',
+                         index_params=None, quantization=(), workers=1, generator_name=GENERATOR_NAME,
+                         chunking=None):
+    """Ingestão completa: embeda todos os contextos e reescreve stores, índice e manifesto.
+
+    Com chunking=(max_words, overlap) também grava as passagens dos contextos, com seus embeddings
+    e índice (passagens_*); com None remove as passagens de uma ingestão anterior.
+    """
+    embeddings = embed_contexts(df, model_name=model_name, workers=workers)
+    np.save(os.path.join(processed_dir, 'embeddings.npy'), embeddings)
+    # Versão L2-normalizada e mapeável em memória, usada pelo serviço
+    write_embedding_store(os.path.join(processed_dir, 'embeddings.bin'), embeddings, model_name)
+    for dtype in QUANTIZATION_DTYPES:
+        path = os.path.join(processed_dir, f'embeddings.{dtype}.bin')
+        if dtype in quantization:
+            write_embedding_store(path, embeddings, model_name, dtype=dtype)
+        elif os.path.exists(path):
+            # Remove cópias de uma ingestão anterior para não ficarem desalinhadas
+            os.remove(path)
+    df.to_csv(os.path.join(processed_dir, 'contextos_completos.csv'), index=False)
+    write_context_store(os.path.join(processed_dir, 'contextos.bin'), df['contexto'])
+    if generator_name:
+        tokenizer = create_token_stores(processed_dir, generator_name)
+        append_context_tokens(processed_dir, df['contexto'].tolist(), tokenizer)
+    if chunking:
+        tokenizer = create_passage_stores(processed_dir, *chunking, generator_name=generator_name)
+        append_passages(processed_dir, df, 0, lambda textos: embed_texts(textos, model_name, workers),
+                        model_name=model_name, tokenizer=tokenizer, quantization=quantization)
+        build_passage_index(processed_dir, index_kind, index_params)
+    else:
+        remove_passage_stores(processed_dir)
+    build_lexical_index(processed_dir, df['contexto'])
+    build_metadata_index(processed_dir, df)
+    index, recall = build_retriever_index(embeddings, kind=index_kind, **(index_params or {}))
+    save_index(index, os.path.join(processed_dir, 'index.npz'))
+    save_manifest(processed_dir, {
+        'model_name': model_name,
+        'rows': [content_hash(c) for c in df['contexto']],
+        'metadata': metadata_hashes(df),
+        'deleted': [],
+    })
+    return index, recall
+
+def plan_incremental_update(manifest, contextos):
+    """Compara os hashes atuais com o manifesto.
+
+    Retorna (posições em contextos a embedar, linhas do store a remover). Contextos
+    repetidos são embedados uma vez; um CV alterado vira uma remoção mais uma inclusão.
+    """
+    deleted = set(manifest['deleted'])
+    live = {h: row for row, h in enumerate(manifest['rows']) if row not in deleted}
+    hashes = [content_hash(c) for c in contextos]
+    novos, vistos = [], set(live)
+    for pos, h in enumerate(hashes):
+        if h not in vistos:
+            novos.append(pos)
+            vistos.add(h)
+    atuais = set(hashes)
+    removidos = sorted(row for h, row in live.items() if h not in atuais)
+    return novos, removidos
+
+def plan_metadata_update(manifest, df):
+    """Linhas do store cujo contexto não mudou mas os metadados sim: {linha: posição em df}.
+
+    Como no plano de embeddings, vale a primeira linha de df com cada contexto. Manifestos sem
+    hashes de metadados (ingestões anteriores) regravam os metadados de todas as linhas mantidas.
+    """
+    deleted = set(manifest['deleted'])
+    live = {h: row for row, h in enumerate(manifest['rows']) if row not in deleted}
+    conhecidos = manifest.get('metadata') or []
+    atualizados, vistos = {}, set()
+    for pos, (h, m) in enumerate(zip((content_hash(c) for c in df['contexto']), metadata_hashes(df))):
+        row = live.get(h)
+        if row is None or row in vistos:
+            continue
+        vistos.add(row)
+        if row >= len(conhecidos) or conhecidos[row] != m:
+            atualizados[row] = pos
+    return atualizados
+
+def incremental_update(df, processed_dir, workers=1):
+    """Embeda só os contextos novos/alterados, acrescenta-os aos stores e ao índice
+    e marca os removidos no manifesto, sem reconstrução completa.
+
+    embeddings.npy e contextos_completos.csv não são tocados: refletem a última ingestão completa.
+    """
+    manifest = load_manifest(processed_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"manifest.json não encontrado em {processed_dir}; rode a ingestão completa")
+    store_path = os.path.join(processed_dir, 'embeddings.bin')
+    if len(open_embedding_store(store_path)) != len(manifest['rows']):
+        raise ValueError("embeddings.bin e manifest.json divergem; rode a ingestão completa")
+    novos, removidos = plan_incremental_update(manifest, df['contexto'])
+    atualizados = plan_metadata_update(manifest, df)
+    hashes = metadata_hashes(df)
+    conhecidos = manifest.get('metadata') or []
+    # Manifestos anteriores aos hashes de metadados: linhas sem hash até serem regravadas
+    manifest['metadata'] = conhecidos + [None] * (len(manifest['rows']) - len(conhecidos))
+    if atualizados:
+        # Mesmo texto com outra situação/vaga/data: só o metadados.npz muda, nada é re-embedado
+        metadata_path = corpus_files(processed_dir)['metadata']
+        if os.path.exists(metadata_path):
+            metadata = load_metadata_index(metadata_path)
+            metadata.update_rows(list(atualizados), df.iloc[list(atualizados.values())])
+            save_metadata_index(metadata, metadata_path)
+        for row, pos in atualizados.items():
+            manifest['metadata'][row] = hashes[pos]
+    if novos:
+        df_novos = df.iloc[novos]
+        embeddings = embed_contexts(df_novos, model_name=manifest['model_name'], workers=workers)
+        inicio = len(manifest['rows'])
+        append_embeddings(store_path, embeddings)
+        for dtype in QUANTIZATION_DTYPES:
+            path = os.path.join(processed_dir, f'embeddings.{dtype}.bin')
+            if os.path.exists(path):
+                append_embeddings(path, embeddings)
+        append_contexts(os.path.join(processed_dir, 'contextos.bin'), df_novos['contexto'])
+        tokenizer = open_generator_tokenizer(processed_dir)
+        if tokenizer is not None:
+            append_context_tokens(processed_dir, df_novos['contexto'].tolist(), tokenizer)
+        index_path = os.path.join(processed_dir, 'index.npz')
+        if os.path.exists(index_path):
+            # Reabre o store (agora com as linhas novas) e indexa apenas elas
+            index = load_index(index_path, open_embedding_store(store_path).vectors, normalized=True)
+            index.add(np.arange(inicio, inicio + len(novos)))
+            save_index(index, index_path)
+        add_to_lexical_index(processed_dir, df_novos['contexto'])
+        add_to_metadata_index(processed_dir, df_novos)
+        passage_files = corpus_files(processed_dir, passages=True)
+        if os.path.exists(passage_files['map']):
+            # Passagens dos CVs novos, apontando para as linhas que eles acabaram de ganhar
+            inicio_passagens = len(open_passage_map(passage_files['map']))
+            n = append_passages(processed_dir, df_novos, inicio,
+                                lambda textos: embed_texts(textos, manifest['model_name'], workers),
+                                model_name=manifest['model_name'],
+                                tokenizer=open_generator_tokenizer(processed_dir, passages=True))
+            if n and os.path.exists(passage_files['index']):
+                index = load_index(passage_files['index'], open_embedding_store(passage_files['embeddings']).vectors,
+                                   normalized=True)
+                index.add(np.arange(inicio_passagens, inicio_passagens + n))
+                save_index(index, passage_files['index'])
+                passagens = open_context_store(passage_files['contexts'])
+                add_to_lexical_index(processed_dir, [passagens[i] for i in range(inicio_passagens, inicio_passagens + n)],
+                                     passages=True)
+            elif n:
+                build_passage_index(processed_dir)
+        manifest['rows'].extend(content_hash(c) for c in df_novos['contexto'])
+        manifest['metadata'].extend(hashes[pos] for pos in novos)
+    manifest['deleted'] = sorted(set(manifest['deleted']) | set(removidos))
+    save_manifest(processed_dir, manifest)
+    return {'novos': len(novos), 'removidos': len(removidos), 'metadados_atualizados': len(atualizados),
+            'ativos': len(manifest['rows']) - len(manifest['deleted'])}
+
+def iter_csv_chunks(csv_path, chunk_size=1000, skip_rows=0):
+    """Lê o CSV em blocos de chunk_size linhas, já com a coluna 'contexto'."""
+    skip = range(1, skip_rows + 1) if skip_rows else None
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size, skiprows=skip):
+        yield prepare_contexts(chunk)
+
+def iter_json_object(json_path, buffer_chars=1 << 20):
+    """Itera (chave, valor) do objeto JSON de nível superior (ex.: applicants.json, id -> registro)
+    sem carregar o arquivo inteiro: decodifica um par por vez de um buffer que é reabastecido.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path, encoding='utf-8') as f:
+        buf, pos, eof = '', 0, False
+
+        def refill():
+            nonlocal buf, pos, eof
+            data = f.read(buffer_chars)
+            eof = not data
+            buf, pos = buf[pos:] + data, 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                refill()
+
+        def expect(chars):
+            nonlocal pos
+            skip_ws()
+            if pos >= len(buf) or buf[pos] not in chars:
+                raise ValueError(f"JSON inválido em {json_path}: esperado um de {chars!r}")
+            pos += 1
+            return buf[pos - 1]
+
+        def decode():
+            nonlocal pos
+            skip_ws()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # Um valor que termina no fim do buffer pode estar incompleto (ex.: número)
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                refill()
+
+        refill()
+        expect('{')
+        skip_ws()
+        if pos < len(buf) and buf[pos] == '}':
+            return
+        while True:
+            key = decode()
+            expect(':')
+            yield key, decode()
+            if expect(',}') == '}':
+                return
+
+def iter_json_chunks(json_path, chunk_size=1000, skip_rows=0):
+    """Agrupa os registros do JSON em DataFrames normalizados de chunk_size linhas."""
+    records = []
+    for i, (id_, info) in enumerate(iter_json_object(json_path)):
+        if i < skip_rows:
+            continue
+        records.append({'id': id_, **info} if isinstance(info, dict) else {'id': id_, 'valor': info})
+        if len(records) == chunk_size:
+            yield prepare_contexts(pd.json_normalize(records))
+            records = []
+    if records:
+        yield prepare_contexts(pd.json_normalize(records))
+
+def run_streaming_ingestion(source, processed_dir, source_format=None, chunk_size=1000,
+                            encode_batch_size=64, model_name=EMBEDDER_NAME, resume=True,
+                            index_kind='exact', index_params=None, workers=1, generator_name=GENERATOR_NAME,
+                            chunking=None, quantization=()):
+    """Pipeline de ingestão com memória limitada: leitor em blocos (CSV ou JSON) -> contextos ->
+    encoder em lotes -> escrita só de acréscimo em embeddings.bin, contextos.bin e manifest.json.
+
+    Após cada bloco um checkpoint registra as linhas consumidas; com resume=True uma execução
+    interrompida continua do último bloco confirmado. O checkpoint guarda o tamanho e a data de
+    modificação da fonte: um arquivo alterado no mesmo caminho é ingerido do zero, e não dado como
+    pronto. O índice é construído ao final sobre o store.
+    Com chunking=(max_words, overlap) cada bloco também é dividido em passagens (passagens_*).
+    As cópias float16/int8 pedidas em quantization, e as que já existiam, são regravadas ao final
+    a partir do store float32 completo.
+    """
+    source_format = source_format or ('json' if source.endswith('.json') else 'csv')
+    store_path = os.path.join(processed_dir, 'embeddings.bin')
+    context_path = os.path.join(processed_dir, 'contextos.bin')
+    token_paths = [os.path.join(processed_dir, name) for name in ('contextos.tok', 'contextos.ntok')]
+    metadata_path = corpus_files(processed_dir)['metadata']
+    passage_files = corpus_files(processed_dir, passages=True)
+    checkpoint_path = os.path.join(processed_dir, 'ingestion_checkpoint.json')
+    checkpoint = None
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if {k: checkpoint.get(k) for k in ('source', 'size', 'mtime_ns')} != _source_signature(source):
+            checkpoint = None
+    if checkpoint and checkpoint.get('done'):
+        return checkpoint
+    if checkpoint:
+        # Descarta o que foi escrito depois do último checkpoint confirmado
+        manifest = load_manifest(processed_dir)
+        manifest['rows'] = manifest['rows'][:checkpoint['stored']]
+        manifest['metadata'] = manifest.get('metadata', [])[:checkpoint['stored']]
+        if os.path.exists(store_path):
+            truncate_store(store_path, checkpoint['stored'])
+        truncate_store(context_path, checkpoint['stored'])
+        for path in token_paths:
+            if os.path.exists(path):
+                truncate_store(path, checkpoint['stored'])
+        if os.path.exists(metadata_path):
+            metadata = load_metadata_index(metadata_path)
+            metadata.truncate(checkpoint['stored'])
+            save_metadata_index(metadata, metadata_path)
+        if os.path.exists(passage_files['map']):
+            # Passagens dos CVs após o checkpoint: as do fim do passagens.cv, gravado por último
+            n = int(np.searchsorted(open_passage_map(passage_files['map']).cv, checkpoint['stored']))
+            for key in ('map', 'contexts', 'embeddings', 'tokens', 'token_counts'):
+                if os.path.exists(passage_files[key]):
+                    truncate_store(passage_files[key], n)
+    else:
+        checkpoint = {**_source_signature(source), 'rows_done': 0, 'stored': 0, 'done': False,
+                      'quantization': [d for d in QUANTIZATION_DTYPES
+                                       if d in quantization or os.path.exists(corpus_files(processed_dir)['quantized'][d])]}
+        manifest = {'model_name': model_name, 'rows': [], 'metadata': [], 'deleted': []}
+        for path in [store_path] + [os.path.join(processed_dir, f'embeddings.{d}.bin') for d in QUANTIZATION_DTYPES]:
+            if os.path.exists(path):
+                os.remove(path)
+        write_context_store(context_path, [])
+        save_metadata_index(MetadataIndex(), metadata_path)
+        for path in token_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        if generator_name:
+            create_token_stores(processed_dir, generator_name)
+        if chunking:
+            create_passage_stores(processed_dir, *chunking, generator_name=generator_name)
+        else:
+            remove_passage_stores(processed_dir)
+
+    if workers > 1:
+        encoder = ParallelEncoder(model_name, workers=workers, batch_size=encode_batch_size)
+        encode = encoder.encode
+    else:
+        encoder = None
+        model = SentenceTransformer(model_name)
+        encode = lambda textos: model.encode(textos, batch_size=encode_batch_size, show_progress_bar=False)
+    tokenizer = open_generator_tokenizer(processed_dir)
+    passage_tokenizer = open_generator_tokenizer(processed_dir, passages=True)
+    iter_chunks = iter_json_chunks if source_format == 'json' else iter_csv_chunks
+    try:
+        for chunk in iter_chunks(source, chunk_size=chunk_size, skip_rows=checkpoint['rows_done']):
+            textos = chunk['contexto'].tolist()
+            embeddings = encode(textos)
+            if os.path.exists(store_path):
+                append_embeddings(store_path, embeddings)
+            else:
+                write_embedding_store(store_path, embeddings, model_name)
+            append_contexts(context_path, textos)
+            if tokenizer is not None:
+                append_context_tokens(processed_dir, textos, tokenizer)
+            add_to_metadata_index(processed_dir, chunk)
+            if os.path.exists(passage_files['map']):
+                append_passages(processed_dir, chunk, checkpoint['stored'], encode, model_name=model_name,
+                                tokenizer=passage_tokenizer)
+            manifest['rows'].extend(content_hash(c) for c in textos)
+            manifest['metadata'].extend(metadata_hashes(chunk))
+            save_manifest(processed_dir, manifest)
+            checkpoint['rows_done'] += len(chunk)
+            checkpoint['stored'] += len(textos)
+            _save_checkpoint(checkpoint_path, checkpoint)
+    finally:
+        if encoder is not None:
+            encoder.close()
+
+    if not os.path.exists(store_path):
+        raise ValueError(f"Nenhum registro encontrado em {source}")
+    vectors = open_embedding_store(store_path).vectors
+    index = build_index(index_kind, vectors, normalized=True, **(index_params or {}))
+    save_index(index, os.path.join(processed_dir, 'index.npz'))
+    build_lexical_index(processed_dir, open_context_store(context_path), chunk_size=chunk_size)
+    if os.path.exists(passage_files['map']):
+        build_passage_index(processed_dir, index_kind, index_params)
+    for dtype in QUANTIZATION_DTYPES:
+        if dtype in quantization or dtype in checkpoint.get('quantization', ()):
+            # Removidas no início da ingestão: regravadas em blocos a partir dos stores float32
+            for files in (corpus_files(processed_dir), passage_files):
+                if os.path.exists(files['embeddings']):
+                    write_quantized_store(files['quantized'][dtype], files['embeddings'], dtype)
+    checkpoint['done'] = True
+    _save_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint
+
+def _source_signature(source):
+    # Identifica a versão da fonte no checkpoint: mesmo caminho com outro conteúdo não retoma
+    stat = os.stat(source)
+    return {'source': os.path.abspath(source), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _save_checkpoint(path, checkpoint):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
 if __name__ == "__main__":
-    csv_path = os.path.join('..', 'data', 'processed', 'cv_atividades_competencias.csv')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true',
+                        help='Embeda só contextos novos/alterados usando o manifest.json existente')
+    # HNSW é experimental (build em Python puro): disponível só por build_index('hnsw')
+    parser.add_argument('--index', choices=['exact', 'ivf'], default='exact')
+    parser.add_argument('--nlist', type=int, default=None, help='Número de listas do IVF')
+    parser.add_argument('--nprobe', type=int, default=8, help='Listas visitadas por consulta no IVF')
+    parser.add_argument('--quantization', nargs='*', choices=list(QUANTIZATION_DTYPES), default=[],
+                        help='Cópias quantizadas adicionais do embeddings.bin')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processos de encoding em paralelo (CPU); 1 usa o processo atual')
+    parser.add_argument('--chunk-words', type=int, default=CHUNK_WORDS,
+                        help='Palavras por passagem do retriever; 0 desativa o chunking')
+    parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP,
+                        help='Palavras repetidas entre passagens consecutivas')
+    args = parser.parse_args()
+
+    processed_dir = os.path.join('..', 'data', 'processed')
+    csv_path = os.path.join(processed_dir, 'cv_atividades_competencias.csv')
     df = load_and_prepare_data(csv_path)
-    embeddings = embed_contexts(df)
-    np.save(os.path.join('..', 'data', 'processed', 'embeddings.npy'), embeddings)
-    df.to_csv(os.path.join('..', 'data', 'processed', 'contextos_completos.csv'), index=False)
+
+    if args.incremental:
+        stats = incremental_update(df, processed_dir, workers=args.workers)
+        print(f"Incremental: {stats['novos']} novos, {stats['removidos']} removidos, {stats['ativos']} ativos")
+    else:
+        index_params = {
+            'exact': {},
+            'ivf': {'nlist': args.nlist, 'nprobe': args.nprobe},
+        }[args.index]
+        index, recall = build_processed_data(df, processed_dir, index_kind=args.index,
+                                             index_params=index_params, quantization=args.quantization,
+                                             workers=args.workers,
+                                             chunking=(args.chunk_words, args.chunk_overlap) if args.chunk_words else None)
+        print(f"Índice '{args.index}' salvo com {len(index)} vetores; recall@3 vs exato = {recall:.3f}")
@@ -0,0 +1,249 @@
+# lexical.py
+# Índice invertido BM25 do retriever. Perguntas de recrutadores citam tecnologias pelo nome
+# ("vaga Python", "Java", "SAP"), e aí o casamento exato de termos acerta onde o embedding do
+# MiniLM aproxima demais. Os termos passam por minúsculas e remoção de acentos, e as listas de
+# postings ficam em arrays contíguos (CSR): offsets por termo, documentos em uint32 e
+# frequências em uint16. search(textos, top_k) -> (scores, ids) segue o contrato dos índices
+# vetoriais, e fuse_rankings combina os dois rankings na busca híbrida.
+import os
+import re
+import tempfile
+import unicodedata
+import numpy as np
+
+# Palavras funcionais do português (já sem acento), ignoradas na indexação e nas consultas
+STOPWORDS = frozenset('''
+a ao aos as ate com como da das de do dos e ela elas ele eles em entre era essa esse esta este eu foi
+ha isso ja la lhe mais mas me meu minha na nao nas no nos o os ou para pela pelas pelo pelos por que
+quem se sem ser seu seus sob sobre sua suas sao tambem tem um uma umas uns voce
+'''.split())
+
+# Termos alfanuméricos, mantendo sufixos de nomes de tecnologia: c++, c#, node.js, asp.net
+_TERM = re.compile(r'[a-z0-9]+(?:[+#]+|(?:\.[a-z0-9]+)+)?')
+
+
+def fold(text):
+    """Minúsculas e sem acentos: 'Gestão' e 'gestao' viram o mesmo termo."""
+    decomposed = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [term for term in _TERM.findall(fold(text)) if term not in STOPWORDS]
+
+
+def _postings(texts, vocabulary, first_doc=0):
+    """(termo, documento, frequência) de cada par termo/documento dos textos, acrescentando termos
+    novos ao vocabulário, e o comprimento (em termos) de cada documento."""
+    terms, docs, tfs, lengths = [], [], [], []
+    for doc, text in enumerate(texts, start=first_doc):
+        counts = {}
+        for term in tokenize('' if text is None else text):
+            counts[term] = counts.get(term, 0) + 1
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            terms.append(vocabulary.setdefault(term, len(vocabulary)))
+            docs.append(doc)
+            tfs.append(tf)
+    return (np.asarray(terms, dtype=np.int64), np.asarray(docs, dtype=np.uint32),
+            np.minimum(np.asarray(tfs, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16),
+            np.asarray(lengths, dtype=np.uint32))
+
+
+class BM25Index:
+    """Índice invertido com score BM25 (k1, b) sobre os textos do retriever (CVs ou passagens).
+
+    Os ids dos documentos são as linhas do corpus, as mesmas do índice vetorial; add_documents
+    acrescenta linhas ao fim (ingestão incremental) e remove(ids) exclui linhas dos resultados.
+    """
+    kind = 'bm25'
+
+    def __init__(self, vocabulary, offsets, doc_ids, tfs, doc_lengths, k1=1.2, b=0.75):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.deleted = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def build(cls, texts, k1=1.2, b=0.75):
+        vocabulary = {}
+        terms, docs, tfs, lengths = _postings(texts, vocabulary)
+        index = cls(vocabulary, np.zeros(1, dtype=np.uint64), np.zeros(0, dtype=np.uint32),
+                    np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.uint32), k1=k1, b=b)
+        index._merge(terms, docs, tfs, lengths)
+        return index
+
+    def __len__(self):
+        return len(self.doc_lengths) - len(self.deleted)
+
+    def _merge(self, terms, docs, tfs, lengths):
+        # Junta os postings novos aos existentes e reordena por (termo, documento)
+        old_terms = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets).astype(np.int64))
+        terms = np.concatenate([old_terms, terms])
+        docs = np.concatenate([self.doc_ids, docs])
+        order = np.lexsort((docs, terms))
+        self.doc_ids = docs[order]
+        self.tfs = np.concatenate([self.tfs, tfs])[order]
+        counts = np.bincount(terms, minlength=len(self.vocabulary))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64)
+        self.doc_lengths = np.concatenate([self.doc_lengths, lengths])
+
+    def add_documents(self, texts):
+        """Indexa textos novos como as próximas linhas do corpus, sem re-tokenizar os existentes."""
+        self._merge(*_postings(texts, self.vocabulary, first_doc=len(self.doc_lengths)))
+
+    def remove(self, ids):
+        self.deleted = np.union1d(self.deleted, np.asarray(ids, dtype=np.int64))
+
+    def score(self, query, ids=None):
+        """(documentos, scores) dos documentos com ao menos um termo da consulta; com ids
+        (ordenados), só os documentos dessa lista."""
+        n_docs = len(self.doc_lengths)
+        avg_length = max(float(self.doc_lengths.mean()), 1e-9) if n_docs else 1.0
+        docs, weights = [], []
+        for term in dict.fromkeys(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            postings = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            idf = np.log1p((n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            if ids is not None:
+                # Postings e ids estão ordenados: a interseção não pontua documentos fora do filtro
+                keep = np.isin(postings, ids, assume_unique=True)
+                postings, tf = postings[keep], tf[keep]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[postings] / avg_length)
+            docs.append(postings)
+            weights.append(idf * tf * (self.k1 + 1) / (tf + norm))
+        if not docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        # Soma as contribuições dos termos só sobre os documentos tocados
+        unique, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights)).astype(np.float32)
+        if len(self.deleted):
+            keep = ~np.isin(unique, self.deleted)
+            unique, scores = unique[keep], scores[keep]
+        return unique.astype(np.int64), scores
+
+    def search(self, queries, top_k, ids=None):
+        top_k = max(1, top_k)
+        out_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        for row, query in enumerate(queries):
+            docs, scores = self.score(query, ids)
+            k = min(top_k, len(docs))
+            if k == 0:
+                continue
+            part = np.argpartition(-scores, k - 1)[:k]
+            order = part[np.argsort(-scores[part], kind='stable')]
+            out_scores[row, :k], out_ids[row, :k] = scores[order], docs[order]
+        return out_scores, out_ids
+
+    def state(self):
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        return {
+            'terms': np.frombuffer('\n'.join(terms).encode('utf-8'), dtype=np.uint8),
+            'offsets': self.offsets, 'doc_ids': self.doc_ids, 'tfs': self.tfs,
+            'doc_lengths': self.doc_lengths, 'params': np.array([self.k1, self.b]),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        text = state['terms'].tobytes().decode('utf-8')
+        terms = text.split('\n') if text else []
+        k1, b = (float(x) for x in state['params'])
+        return cls({term: i for i, term in enumerate(terms)}, state['offsets'], state['doc_ids'],
+                   state['tfs'], state['doc_lengths'], k1=k1, b=b)
+
+
+# Registro de um posting no arquivo temporário de write_lexical_index
+_POSTING = np.dtype([('term', '<u4'), ('doc', '<u4'), ('tf', '<u2')])
+
+
+def write_lexical_index(text_chunks, path, k1=1.2, b=0.75, slice_size=1 << 20):
+    """Grava em path o BM25Index dos textos, dados em blocos, sem montar os postings em memória.
+
+    Cada bloco vira postings (termo, documento, frequência) acrescentados a um arquivo temporário
+    ao lado de path; as listas por termo são montadas lendo esse arquivo em fatias de slice_size
+    postings (contagem por termo e depois cópia para a posição de cada um) em arrays mapeados em
+    disco. Em memória ficam só o vocabulário, os comprimentos dos documentos e um bloco.
+    """
+    vocabulary, lengths, n_docs, n_postings = {}, [], 0, 0
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp:
+        runs_path = os.path.join(tmp, 'postings.bin')
+        with open(runs_path, 'wb') as f:
+            for texts in text_chunks:
+                terms, docs, tfs, chunk_lengths = _postings(texts, vocabulary, first_doc=n_docs)
+                run = np.empty(len(terms), dtype=_POSTING)
+                run['term'], run['doc'], run['tf'] = terms, docs, tfs
+                run.tofile(f)
+                n_postings += len(run)
+                n_docs += len(chunk_lengths)
+                lengths.append(chunk_lengths)
+        n_terms = len(vocabulary)
+        if n_postings:
+            runs = np.memmap(runs_path, dtype=_POSTING, mode='r')
+            counts = np.zeros(n_terms, dtype=np.int64)
+            for start in range(0, n_postings, slice_size):
+                counts += np.bincount(runs['term'][start:start + slice_size], minlength=n_terms)
+            offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64)
+            doc_ids = np.lib.format.open_memmap(os.path.join(tmp, 'doc_ids.npy'), mode='w+', dtype=np.uint32,
+                                                shape=(n_postings,))
+            tfs = np.lib.format.open_memmap(os.path.join(tmp, 'tfs.npy'), mode='w+', dtype=np.uint16,
+                                            shape=(n_postings,))
+            # Próxima posição livre da lista de cada termo; o arquivo está em ordem de documento,
+            # então cada lista sai ordenada por documento
+            cursor = offsets[:-1].astype(np.int64)
+            for start in range(0, n_postings, slice_size):
+                part = runs[start:start + slice_size]
+                terms = part['term'].astype(np.int64)
+                order = np.argsort(terms, kind='stable')
+                sorted_terms = terms[order]
+                rank = np.arange(len(order)) - np.searchsorted(sorted_terms, sorted_terms, side='left')
+                positions = cursor[sorted_terms] + rank
+                doc_ids[positions] = part['doc'][order]
+                tfs[positions] = part['tf'][order]
+                cursor += np.bincount(terms, minlength=n_terms)
+            del runs
+        else:
+            offsets = np.zeros(n_terms + 1, dtype=np.uint64)
+            doc_ids, tfs = np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint16)
+        doc_lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.uint32)
+        # np.savez copia os arrays mapeados em fatias para o .npz
+        save_lexical_index(BM25Index(vocabulary, offsets, doc_ids, tfs, doc_lengths, k1=k1, b=b), path)
+        # Fecha os mapas antes de apagar o diretório temporário
+        del doc_ids, tfs
+    return n_postings
+
+
+def save_lexical_index(index, path):
+    np.savez(path, **index.state())
+
+
+def load_lexical_index(path):
+    with np.load(path) as data:
+        return BM25Index.from_state({key: data[key] for key in data.files})
+
+
+def fuse_rankings(rankings, weights, top_k, k=60):
+    """Reciprocal rank fusion: cada documento soma weight / (k + posição) em cada ranking (ids por
+    consulta, -1 nas sobras). Usa só posições, então scores de escalas diferentes (cosseno x BM25)
+    não precisam ser calibrados. Retorna (scores, ids) [consultas, top_k]."""
+    n_queries = len(rankings[0])
+    out_scores = np.full((n_queries, top_k), -np.inf, dtype=np.float32)
+    out_ids = np.full((n_queries, top_k), -1, dtype=np.int64)
+    for row in range(n_queries):
+        fused = {}
+        for ids, weight in zip(rankings, weights):
+            for rank, i in enumerate(ids[row]):
+                if i >= 0:
+                    fused[int(i)] = fused.get(int(i), 0.0) + weight / (k + rank + 1)
+        best = sorted(fused.items(), key=lambda item: -item[1])[:top_k]
+        for col, (i, score) in enumerate(best):
+            out_scores[row, col], out_ids[row, col] = score, i
+    return out_scores, out_ids
@@ -0,0 +1,272 @@
+# metadata.py
+# Metadados estruturados de cada CV do corpus (vaga, modalidade, situação do candidato, níveis de
+# idioma, datas), gravados com o índice em metadados.npz. Os filtros viram um conjunto de linhas
+# antes da busca: cada valor de campo categórico tem sua lista de ids pré-calculada (CSR: offsets
+# por valor e ids em uint32) e cada campo de data a ordem das linhas por data, então select(filtros)
+# é união/interseção de listas ordenadas, e a busca varre só as linhas selecionadas.
+import numpy as np
+import pandas as pd
+from src.lexical import fold
+
+# Campo do filtro -> colunas de origem aceitas (a primeira presente no DataFrame), nomes de
+# prospects.json/applicants.json como no notebooks/01_dataprep.ipynb
+CATEGORICAL_FIELDS = {
+    'vaga': ('vaga_id',),
+    'titulo': ('titulo', 'informacoes_basicas.titulo_vaga'),
+    'modalidade': ('modalidade',),
+    'situacao': ('situacao_candidado', 'situacao_candidato'),
+    'codigo': ('codigo', 'infos_basicas.codigo_profissional'),
+    'recrutador': ('recrutador',),
+    'nivel_ingles': ('formacao_e_idiomas.nivel_ingles', 'nivel_ingles'),
+    'nivel_espanhol': ('formacao_e_idiomas.nivel_espanhol', 'nivel_espanhol'),
+    'nivel_academico': ('formacao_e_idiomas.nivel_academico', 'nivel_academico'),
+    'nivel_profissional': ('informacoes_profissionais.nivel_profissional', 'nivel_profissional'),
+}
+DATE_FIELDS = {
+    'data_candidatura': ('data_candidatura',),
+    'ultima_atualizacao': ('ultima_atualizacao',),
+}
+# Situações que contam como candidato aprovado (campo derivado 'aprovado')
+APPROVED_STATUSES = ('Contratado pela Decision', 'Aprovado', 'Contratado como Hunting', 'Proposta Aceita')
+METADATA_COLUMNS = sorted({col for cols in {**CATEGORICAL_FIELDS, **DATE_FIELDS}.values() for col in cols})
+
+# Dias desde 1970-01-01; linhas sem data ficam com MISSING_DATE e fora de qualquer intervalo
+MISSING_DATE = np.iinfo(np.int32).min
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT \
+        or (isinstance(value, str) and not value.strip())
+
+
+def _text(value):
+    # Texto gravado em values: booleanos como 'true'/'false', 31000.0 como '31000', sem quebras de linha
+    if isinstance(value, (bool, np.bool_)):
+        return 'true' if value else 'false'
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return ' '.join(str(value).split())
+
+
+def value_key(value):
+    """Forma canônica de um valor no filtro: 'Aprovado' e 'aprovado ' casam, 31000.0 e '31000' também."""
+    return fold(_text(value))
+
+
+def parse_dates(values):
+    """Dias desde a época de cada valor: 'dd-mm-aaaa' (JSON de origem) ou 'aaaa-mm-dd' (CSV exportado)."""
+    raw = pd.Series(list(values), dtype=object)
+    dates = pd.to_datetime(raw, format='%d-%m-%Y', errors='coerce')
+    missing = dates.isna()
+    if missing.any():
+        dates[missing] = pd.to_datetime(raw[missing], format='%Y-%m-%d', errors='coerce')
+    days = np.full(len(raw), MISSING_DATE, dtype=np.int32)
+    valid = dates.notna().to_numpy()
+    days[valid] = (dates[valid].to_numpy().astype('datetime64[D]') - np.datetime64(0, 'D')).astype(np.int32)
+    return days
+
+
+def frame_metadata(df):
+    """Colunas de metadados de df: {campo: valores brutos} e {campo: dias}, só dos campos presentes."""
+    categorical, dates = {}, {}
+    for field, columns in CATEGORICAL_FIELDS.items():
+        column = next((col for col in columns if col in df.columns), None)
+        if column is not None:
+            categorical[field] = df[column].tolist()
+    if 'situacao' in categorical:
+        aprovados = {value_key(s) for s in APPROVED_STATUSES}
+        categorical['aprovado'] = [None if _missing(s) else value_key(s) in aprovados
+                                   for s in categorical['situacao']]
+    for field, columns in DATE_FIELDS.items():
+        column = next((col for col in columns if col in df.columns), None)
+        if column is not None:
+            dates[field] = parse_dates(df[column])
+    return categorical, dates
+
+
+def _id_lists(codes, n_values):
+    # Linhas de cada valor em ordem crescente: argsort estável dos códigos (sem as linhas sem valor)
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    counts = np.bincount(codes[codes >= 0], minlength=n_values)
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64), order.astype(np.uint32)
+
+
+class MetadataIndex:
+    """Metadados por linha do corpus de CVs e as listas de ids de cada valor.
+
+    Campos categóricos guardam um dicionário de valores e o código de cada linha (-1 sem valor);
+    campos de data guardam os dias de cada linha e as linhas ordenadas por data. add_rows acrescenta
+    linhas ao fim (ingestão incremental e em blocos) e remove(ids) exclui linhas das seleções.
+    """
+
+    def __init__(self, n_rows=0, values=None, codes=None, days=None, lists=None, date_order=None):
+        self.n_rows = n_rows
+        self.values = values or {}
+        self.codes = codes or {}
+        self.days = days or {}
+        self.deleted = np.zeros(0, dtype=np.int64)
+        if lists is None or date_order is None:
+            self._build_lists()
+        else:
+            # Listas lidas do metadados.npz: nada a recalcular ao subir o serviço
+            self.lists, self.date_order = lists, date_order
+            self._lookup = {field: {value_key(v): code for code, v in enumerate(values)}
+                            for field, values in self.values.items()}
+
+    @classmethod
+    def build(cls, df):
+        index = cls()
+        index.add_rows(df)
+        return index
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def fields(self):
+        return sorted(list(self.values) + list(self.days))
+
+    def _build_lists(self):
+        self._lookup = {field: {value_key(v): code for code, v in enumerate(values)}
+                        for field, values in self.values.items()}
+        self.lists = {field: _id_lists(codes, len(self.values[field])) for field, codes in self.codes.items()}
+        self.date_order = {}
+        for field, days in self.days.items():
+            order = np.argsort(days, kind='stable')
+            self.date_order[field] = order[days[order] != MISSING_DATE].astype(np.uint32)
+
+    def add_rows(self, df):
+        categorical, dates = frame_metadata(df)
+        n = len(df)
+        # Um campo que só aparece agora começa sem valor nas linhas anteriores
+        for field in set(categorical) - set(self.codes):
+            self.values[field] = []
+            self.codes[field] = np.full(self.n_rows, -1, dtype=np.int32)
+        for field in set(dates) - set(self.days):
+            self.days[field] = np.full(self.n_rows, MISSING_DATE, dtype=np.int32)
+        for field, codes in self.codes.items():
+            new = np.full(n, -1, dtype=np.int32)
+            if field in categorical:
+                known = {value_key(v): code for code, v in enumerate(self.values[field])}
+                for row, value in enumerate(categorical[field]):
+                    if _missing(value):
+                        continue
+                    key = value_key(value)
+                    if key not in known:
+                        known[key] = len(self.values[field])
+                        self.values[field].append(_text(value))
+                    new[row] = known[key]
+            self.codes[field] = np.concatenate([codes, new])
+        for field, days in self.days.items():
+            new = dates.get(field, np.full(n, MISSING_DATE, dtype=np.int32))
+            self.days[field] = np.concatenate([days, new])
+        self.n_rows += n
+        self._build_lists()
+
+    def update_rows(self, rows, df):
+        """Troca os metadados das linhas rows pelos das linhas de df, na mesma ordem (CVs cujo texto
+        não mudou, mas a situação, a vaga ou as datas sim)."""
+        n_rows = self.n_rows
+        # Codifica df como linhas novas no fim, copia-as sobre rows e descarta o fim
+        self.add_rows(df)
+        for columns in (self.codes, self.days):
+            for field, values in columns.items():
+                values[np.asarray(rows, dtype=np.int64)] = values[n_rows:]
+        self.truncate(n_rows)
+
+    def truncate(self, n_rows):
+        """Descarta as linhas após n_rows (retomada de checkpoint da ingestão em blocos)."""
+        self.n_rows = n_rows
+        self.codes = {field: codes[:n_rows] for field, codes in self.codes.items()}
+        self.days = {field: days[:n_rows] for field, days in self.days.items()}
+        self._build_lists()
+
+    def remove(self, ids):
+        self.deleted = np.union1d(self.deleted, np.asarray(ids, dtype=np.int64))
+
+    def _value_ids(self, field, wanted):
+        offsets, ids = self.lists[field]
+        codes = [self._lookup[field][key] for key in dict.fromkeys(value_key(v) for v in wanted)
+                 if key in self._lookup[field]]
+        parts = [ids[int(offsets[c]):int(offsets[c + 1])] for c in codes]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return parts[0].astype(np.int64) if len(parts) == 1 else np.unique(np.concatenate(parts)).astype(np.int64)
+
+    def _date_ids(self, field, interval):
+        days, order = self.days[field], self.date_order[field]
+        start = parse_dates([interval['de']])[0] if interval.get('de') else None
+        end = parse_dates([interval['ate']])[0] if interval.get('ate') else None
+        for bound, text in ((start, interval.get('de')), (end, interval.get('ate'))):
+            if bound == MISSING_DATE:
+                raise ValueError(f"Data inválida no filtro '{field}': {text}")
+        ordered = days[order]
+        lo = 0 if start is None else int(np.searchsorted(ordered, start, side='left'))
+        hi = len(order) if end is None else int(np.searchsorted(ordered, end, side='right'))
+        return np.sort(order[lo:hi]).astype(np.int64)
+
+    def select(self, filters):
+        """Linhas (ordenadas) que atendem a todos os filtros, ou None sem filtros.
+
+        filtros: {campo: valor | [valores] | {'de': data, 'ate': data}}; uma lista aceita qualquer
+        dos valores, o intervalo de datas é fechado e campos diferentes se combinam com E.
+        """
+        if not filters:
+            return None
+        selections = []
+        for field, condition in filters.items():
+            if field in self.days:
+                if not isinstance(condition, dict):
+                    raise ValueError(f"Filtro de data '{field}' espera {{'de': ..., 'ate': ...}}")
+                selections.append(self._date_ids(field, condition))
+            elif field in self.lists:
+                wanted = condition if isinstance(condition, (list, tuple, set)) else [condition]
+                selections.append(self._value_ids(field, wanted))
+            else:
+                raise ValueError(f"Campo de filtro desconhecido: {field}. Disponíveis: {self.fields}")
+        # Interseção começando pela menor lista: o custo segue o filtro mais seletivo
+        selections.sort(key=len)
+        rows = selections[0]
+        for other in selections[1:]:
+            if not len(rows):
+                break
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        if len(self.deleted):
+            rows = rows[~np.isin(rows, self.deleted)]
+        return rows
+
+    def state(self):
+        state = {'n_rows': np.array(self.n_rows)}
+        for field, values in self.values.items():
+            state[f'{field}.values'] = np.frombuffer('\n'.join(values).encode('utf-8'), dtype=np.uint8)
+            state[f'{field}.codes'] = self.codes[field]
+            state[f'{field}.offsets'], state[f'{field}.ids'] = self.lists[field]
+        for field, days in self.days.items():
+            state[f'{field}.days'] = days
+            state[f'{field}.order'] = self.date_order[field]
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        values, codes, days, lists, date_order = {}, {}, {}, {}, {}
+        for key in state:
+            field, _, part = key.rpartition('.')
+            if part == 'values':
+                text = state[key].tobytes().decode('utf-8')
+                values[field] = text.split('\n') if text else []
+                codes[field] = state[f'{field}.codes']
+                lists[field] = (state[f'{field}.offsets'], state[f'{field}.ids'])
+            elif part == 'days':
+                days[field] = state[key]
+                date_order[field] = state[f'{field}.order']
+        return cls(int(state['n_rows']), values, codes, days, lists, date_order)
+
+
+def save_metadata_index(index, path):
+    np.savez(path, **index.state())
+
+
+def load_metadata_index(path):
+    with np.load(path) as data:
+        return MetadataIndex.from_state({key: data[key] for key in data.files})
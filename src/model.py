@@ -1,62 +1,654 @@
 # 01_model.py
 # Módulo do agente RAG com HuggingFace para Recrutamento
 
-from transformers import pipeline, AutoModelForCausalLM, AutoTokenizer
-from sentence_transformers import util
+from transformers import (AutoModelForCausalLM, AutoTokenizer, LogitsProcessor,
+                          LogitsProcessorList, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer)
+from transformers.pytorch_utils import Conv1D
+from sentence_transformers import SentenceTransformer
+from src.cache import LRUCache, PrefixKVCache, normalize_query
+from src.chunking import aggregate_passages
+from src.lexical import fuse_rankings, load_lexical_index
+from src.metadata import load_metadata_index
+from src.store import (corpus_files, open_context_store, open_embedding_store, open_passage_map,
+                       open_token_counts, open_token_store)
+from src.vector_index import ExactIndex, QuantizedIndex, load_index, normalize, search_subset
 import numpy as np
 import mlflow.pyfunc
 import pandas as pd
+import threading
 import torch
+import hashlib
+import json
 import os
 
 device = 0 if torch.cuda.is_available() else -1
 
+EMBEDDER_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+# Para distilgpt2: max_length total (entrada+saida) = 1024
+MAX_MODEL_LENGTH = 1024
+
+# Encoders de consulta já carregados neste processo (um por nome de modelo).
+# Cada worker do BentoML carrega o seu uma única vez, na inicialização.
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+# Backends de inferência do LLM: 'pytorch' (float32, padrão) ou 'int8' (quantização dinâmica, só CPU)
+LLM_BACKENDS = ('pytorch', 'int8')
+
+
+def conv1d_to_linear(module):
+    """Troca, no lugar, os Conv1D do GPT-2 (peso [entrada, saída]) por nn.Linear equivalentes,
+    já que a quantização dinâmica do torch só atua sobre nn.Linear."""
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            linear = torch.nn.Linear(child.weight.shape[0], child.weight.shape[1])
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+    return module
+
+
+def load_llm(llm_name, backend='pytorch'):
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f"Backend desconhecido: {backend}. Opções: {LLM_BACKENDS}")
+    model = AutoModelForCausalLM.from_pretrained(llm_name)
+    if backend == 'int8':
+        if device == 0:
+            raise ValueError("O backend 'int8' (quantização dinâmica) só roda em CPU")
+        # Pesos das camadas lineares em int8; ativações quantizadas em tempo de execução
+        model = torch.ao.quantization.quantize_dynamic(conv1d_to_linear(model), {torch.nn.Linear},
+                                                       dtype=torch.qint8)
+    elif device == 0:
+        model = model.to('cuda')
+    return model
+
+
+def get_embedder(model_name=EMBEDDER_NAME):
+    """Retorna o SentenceTransformer compartilhado do processo, carregando-o só na primeira chamada."""
+    with _embedders_lock:
+        if model_name not in _embedders:
+            _embedders[model_name] = SentenceTransformer(model_name)
+        return _embedders[model_name]
+
+
+# Política de geração do RAGAgent. O distilgpt2 tende a repetir a mesma linha até esgotar
+# max_new_tokens; parar no primeiro trecho repetido corta esses tokens desperdiçados. O bloqueio de
+# n-gramas fica desligado por padrão: com ele nenhum bloco de n ou mais tokens se repete, o detector
+# de trechos repetidos não dispara e o modelo segue gerando variações até max_new_tokens.
+DEFAULT_GENERATION_POLICY = {
+    'max_new_tokens': 256,
+    # n-gramas que não podem se repetir dentro da resposta (copiar do contexto continua valendo); 0 desativa.
+    # Combinado com repeated_span, o mínimo do bloco precisa ser menor que n
+    'no_repeat_ngram_size': 0,
+    # Textos que encerram a resposta (são removidos do resultado)
+    'stop_sequences': (),
+    # (mínimo, máximo) de tokens de um bloco que, repetido em seguida, encerra a geração; None desativa
+    'repeated_span': (4, 32),
+}
+
+
+def repeated_tail(seq, min_span, max_span):
+    """Tamanho k do menor bloco final que repete o bloco imediatamente anterior
+    (seq[-2k:-k] == seq[-k:], min_span <= k <= max_span), ou 0 se não houver."""
+    n = len(seq)
+    for k in range(min_span, min(max_span, n // 2) + 1):
+        if seq[n - k:] == seq[n - 2 * k:n - k]:
+            return k
+    return 0
+
+
+class CancelCriteria(StoppingCriteria):
+    """Interrompe o generate no próximo token quando o evento é sinalizado
+    (cliente desconectou ou a requisição estourou o timeout)."""
+
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancel_event.is_set(),
+                          dtype=torch.bool, device=input_ids.device)
+
+
+class RepeatedSpanCriteria(StoppingCriteria):
+    """Encerra cada sequência cuja parte gerada terminou em um bloco repetido."""
+
+    def __init__(self, prompt_length, min_span, max_span):
+        self.prompt_length = prompt_length
+        self.min_span = min_span
+        self.max_span = max_span
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = [repeated_tail(row[self.prompt_length:].tolist(), self.min_span, self.max_span) > 0
+                for row in input_ids]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """Encerra cada sequência cuja parte gerada contém uma das stop sequences."""
+
+    def __init__(self, tokenizer, stop_sequences, prompt_length):
+        self.tokenizer = tokenizer
+        self.stop_sequences = list(stop_sequences)
+        self.prompt_length = prompt_length
+        # Todo token tem ao menos um caractere: basta decodificar essa janela do fim
+        self.window = max(len(stop) for stop in self.stop_sequences) + 1
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for row in input_ids:
+            tail = self.tokenizer.decode(row[self.prompt_length:][-self.window:], skip_special_tokens=True)
+            done.append(any(stop in tail for stop in self.stop_sequences))
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class GeneratedNoRepeatNGram(LogitsProcessor):
+    """no_repeat_ngram_size aplicado só aos tokens gerados: trechos do prompt/contexto podem ser copiados,
+    mas a resposta não repete um n-grama dela mesma."""
+
+    def __init__(self, ngram_size, prompt_length):
+        self.ngram_size = ngram_size
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores):
+        n = self.ngram_size
+        for row in range(input_ids.shape[0]):
+            gen = input_ids[row, self.prompt_length:].tolist()
+            if len(gen) < n:
+                continue
+            prefix = gen[len(gen) - (n - 1):]
+            banned = [gen[i + n - 1] for i in range(len(gen) - n + 1) if gen[i:i + n - 1] == prefix]
+            if banned:
+                scores[row, banned] = -float('inf')
+        return scores
+
+
 class RAGAgent:
-    def __init__(self, llm_name, retriever_embeddings, retriever_contexts):
+    def __init__(self, llm_name, retriever_embeddings, retriever_contexts,
+                 embedder=None, embedder_name=EMBEDDER_NAME, index=None, query_cache=None,
+                 generation_policy=None, prefix_cache=None, backend='pytorch', context_token_counts=None,
+                 context_tokens=None, passage_cv=None, passages_per_cv=1, passage_fetch=10,
+                 lexical_index=None, lexical_weight=1.0, hybrid_fetch=4, metadata=None):
         self.tokenizer = AutoTokenizer.from_pretrained(llm_name)
-        self.model = AutoModelForCausalLM.from_pretrained(llm_name)
-        if device == 0:
-            self.model = self.model.to('cuda')
+        # distilgpt2 não define pad_token; necessário para tokenizar lotes com padding
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = 'left'
+        self.model = load_llm(llm_name, backend=backend)
         self.retriever_embeddings = retriever_embeddings
         self.retriever_contexts = retriever_contexts
+        # Índice vetorial do retriever; sem índice pré-construído usa a busca exata
+        self.index = index if index is not None else ExactIndex(retriever_embeddings)
+        # O encoder de consultas é carregado uma vez e reutilizado em todo retrieve()
+        self.embedder = embedder if embedder is not None else get_embedder(embedder_name)
+        # Perguntas repetidas dos recrutadores reaproveitam o embedding já calculado
+        self.query_cache = query_cache if query_cache is not None else LRUCache(maxsize=1024, ttl=3600)
+        # Chaves ausentes seguem DEFAULT_GENERATION_POLICY
+        self.generation_policy = {**DEFAULT_GENERATION_POLICY, **(generation_policy or {})}
+        ngram, span = self.generation_policy['no_repeat_ngram_size'], self.generation_policy['repeated_span']
+        if ngram and span and span[0] >= ngram:
+            raise ValueError(f"repeated_span={tuple(span)} nunca dispara com no_repeat_ngram_size={ngram}: "
+                             f"o mínimo do bloco precisa ser menor que {ngram}")
+        # KV cache de prompts recentes (PrefixKVCache); None desativa
+        self.prefix_cache = prefix_cache
+        # Tokens de cada contexto no tokenizador do LLM (contextos.ntok); None mantém o truncamento do prompt
+        self.context_token_counts = context_token_counts
+        # Token ids de cada contexto (contextos.tok); com eles o prompt é montado sem re-tokenizar os CVs
+        self.context_tokens = context_tokens
+        # Com passage_cv (passagens.cv) os contextos do retriever são passagens: a busca traz
+        # passage_fetch * top_k passagens e devolve as passages_per_cv melhores dos top_k melhores CVs
+        self.passage_cv = passage_cv
+        self.passages_per_cv = passages_per_cv
+        self.passage_fetch = passage_fetch
+        # Índice BM25 (lexico.npz) com as mesmas linhas do índice vetorial; None mantém a busca só densa.
+        # Na busca híbrida cada lado traz hybrid_fetch * k candidatos, fundidos por posição (RRF)
+        self.lexical_index = lexical_index
+        self.lexical_weight = lexical_weight
+        self.hybrid_fetch = hybrid_fetch
+        # Metadados por CV (metadados.npz, MetadataIndex): com filtros a busca varre só as linhas selecionadas
+        self.metadata = metadata
+
+    def retrieve(self, query, top_k=3, filters=None):
+        return self.retrieve_batch([query], top_k=top_k, filters=filters)[0]
+
+    def embed_queries(self, queries):
+        """Embeddings das perguntas, consultando o cache antes e encodando só as faltas (num único encode)."""
+        keys = [normalize_query(q) for q in queries]
+        # Primeira forma original de cada chave: é ela que vai para o encoder
+        originals = dict(zip(reversed(keys), reversed(queries)))
+        found = {}
+        for key in dict.fromkeys(keys):
+            emb = self.query_cache.get(key)
+            if emb is not None:
+                found[key] = emb
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            embs = np.asarray(self.embedder.encode([originals[key] for key in missing]))
+            for key, emb in zip(missing, embs):
+                self.query_cache.put(key, emb)
+                found[key] = emb
+        return np.stack([found[key] for key in keys])
+
+    def candidate_ids(self, filters):
+        """Linhas do corpus do retriever que atendem aos filtros de metadados (None sem filtros).
+        Com passagens, todas as passagens dos CVs selecionados: passage_cv é crescente, então as
+        de cada CV são um intervalo contíguo."""
+        if not filters:
+            return None
+        if self.metadata is None:
+            raise ValueError("Filtros indisponíveis: o corpus não tem metadados (metadados.npz)")
+        rows = self.metadata.select(filters)
+        if self.passage_cv is None:
+            return rows
+        starts = np.searchsorted(self.passage_cv, rows, side='left')
+        counts = np.searchsorted(self.passage_cv, rows, side='right') - starts
+        return np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+
+    def _dense_search(self, embeddings, k, candidates):
+        if candidates is None:
+            return self.index.search(embeddings, k)
+        if isinstance(self.index, QuantizedIndex):
+            # Só os códigos float16/int8 das linhas filtradas, com o mesmo re-rank float32 do índice
+            return self.index.search(embeddings, k, ids=candidates)
+        return search_subset(self.retriever_embeddings, embeddings, k, candidates)
 
-    def retrieve(self, query, top_k=3):
-        from sentence_transformers import SentenceTransformer
-        embedder = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-        query_emb = embedder.encode([query])[0]
-        hits = util.semantic_search(query_emb, self.retriever_embeddings, top_k=top_k)[0]
-        return [self.retriever_contexts[hit['corpus_id']] for hit in hits]
-
-    def generate(self, query):
-        retrieved = self.retrieve(query)
-        prompt = query + '\nContexto:\n' + '\n'.join(retrieved)
-        # Para distilgpt2: max_length total (entrada+saida) = 1024
-        max_new_tokens = 256
-        max_model_length = 1024
-        max_input_length = max_model_length - max_new_tokens
-        inputs = self.tokenizer(prompt, return_tensors='pt', truncation=True, max_length=max_input_length)
+    def search(self, queries, top_k=3, filters=None):
+        # Um único encode e uma única busca no índice para todas as perguntas do lote
+        queries = list(queries)
+        embeddings = self.embed_queries(queries)
+        k = top_k if self.passage_cv is None else top_k * self.passages_per_cv * self.passage_fetch
+        # Filtros restringem os candidatos antes da busca, não os resultados depois dela
+        candidates = self.candidate_ids(filters)
+        if self.lexical_index is None:
+            scores, ids = self._dense_search(embeddings, k, candidates)
+        else:
+            # Híbrida: o score devolvido é o da fusão (RRF), não o cosseno
+            _, dense_ids = self._dense_search(embeddings, k * self.hybrid_fetch, candidates)
+            _, lexical_ids = self.lexical_index.search(queries, k * self.hybrid_fetch, ids=candidates)
+            scores, ids = fuse_rankings([dense_ids, lexical_ids], [1.0, self.lexical_weight], k)
+        if self.passage_cv is None:
+            return scores, ids
+        return aggregate_passages(scores, ids, self.passage_cv, top_k, self.passages_per_cv)
+
+    def retrieve_batch(self, queries, top_k=3, filters=None):
+        _, ids = self.search(queries, top_k, filters=filters)
+        return [[self.retriever_contexts[i] for i in row if i >= 0] for row in ids]
+
+    def retrieved_contexts(self, queries, top_k=3, filters=None):
+        """Contextos recuperados como dados estruturados (linha no store + score), sem o texto do CV.
+        Com passagens, 'id' é a passagem e 'cv' a linha do CV de origem no contextos.bin."""
+        scores, ids = self.search(queries, top_k, filters=filters)
+        return [[self._context_record(i, score) for i, score in zip(row_ids, row_scores) if i >= 0]
+                for row_ids, row_scores in zip(ids, scores)]
+
+    def _context_record(self, i, score):
+        record = {'id': int(i), 'score': float(score)}
+        if self.passage_cv is not None:
+            record['cv'] = int(self.passage_cv[i])
+        return record
+
+    def build_prompt(self, query, retrieved):
+        return query + '\nContexto:\n' + '\n'.join(retrieved)
+
+    def input_budget(self):
+        return MAX_MODEL_LENGTH - self.generation_policy['max_new_tokens']
+
+    def _token_ids(self, text):
+        return [int(t) for t in self.tokenizer([text])['input_ids'][0]]
+
+    def _select_contexts(self, ids, budget, separator, length):
+        """(id, tokens mantidos) dos contextos recuperados, em ordem de score, que cabem inteiros no
+        orçamento. Só quando nem o primeiro cabe ele entra cortado no espaço disponível."""
+        ids = [int(i) for i in ids if i >= 0]
+        kept = []
+        for i in ids:
+            cost = length(i) + (separator if kept else 0)
+            if cost <= budget:
+                kept.append((i, length(i)))
+                budget -= cost
+        if not kept and ids and budget > 0:
+            kept.append((ids[0], budget))
+        return kept
+
+    def pack_contexts(self, query, ids):
+        """Textos dos contextos que cabem no orçamento de entrada, escolhidos pelas contagens de tokens
+        da ingestão: os contextos descartados não são tokenizados."""
+        budget = self.input_budget() - len(self._token_ids(self.build_prompt(query, [])))
+        length = lambda i: int(self.context_token_counts[i])
+        kept = []
+        for i, n in self._select_contexts(ids, budget, len(self._token_ids('\n')), length):
+            text = self.retriever_contexts[i]
+            kept.append(text if n == length(i) else self._trim_context(text, length(i), n))
+        return kept
+
+    def _trim_context(self, text, n_tokens, budget):
+        # Tokeniza só um prefixo proporcional ao orçamento (com folga), não o CV inteiro
+        chars = min(len(text), int(len(text) * budget / max(n_tokens, 1) * 1.5) + 32)
+        ids = self.tokenizer([text[:chars]])['input_ids'][0][:budget]
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def pack_context_ids(self, query, ids):
+        """input_ids do prompt montados com os tokens gravados na ingestão (contextos.tok):
+        na requisição só a pergunta é tokenizada."""
+        prompt = self._token_ids(self.build_prompt(query, []))[:self.input_budget()]
+        separator = self._token_ids('\n')
+        length = lambda i: len(self.context_tokens[i])
+        kept = self._select_contexts(ids, self.input_budget() - len(prompt), len(separator), length)
+        for n, (i, keep) in enumerate(kept):
+            if n:
+                prompt.extend(separator)
+            prompt.extend(int(t) for t in self.context_tokens[i][:keep])
+        return prompt
+
+    def build_prompts(self, queries, filters=None):
+        queries = list(queries)
+        if self.context_token_counts is None:
+            retrieved = self.retrieve_batch(queries, filters=filters)
+        else:
+            _, ids = self.search(queries, filters=filters)
+            retrieved = [self.pack_contexts(q, row) for q, row in zip(queries, ids)]
+        return [self.build_prompt(q, r) for q, r in zip(queries, retrieved)]
+
+    def prompt_inputs(self, queries, filters=None):
+        """input_ids/attention_mask dos prompts das perguntas, com padding à esquerda."""
+        queries = list(queries)
+        if self.context_tokens is None:
+            return self.tokenize_prompts(self.build_prompts(queries, filters=filters))
+        _, ids = self.search(queries, filters=filters)
+        return self.pad_prompt_ids([self.pack_context_ids(q, row) for q, row in zip(queries, ids)])
+
+    def pad_prompt_ids(self, prompts):
+        n = max(len(p) for p in prompts)
+        pad = self.tokenizer.pad_token_id
+        inputs = {
+            'input_ids': torch.tensor([[pad] * (n - len(p)) + p for p in prompts], dtype=torch.long),
+            'attention_mask': torch.tensor([[0] * (n - len(p)) + [1] * len(p) for p in prompts], dtype=torch.long),
+        }
         if device == 0:
             inputs = {k: v.to('cuda') for k, v in inputs.items()}
-        output = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
-        return self.tokenizer.decode(output[0], skip_special_tokens=True)
+        return inputs
+
+    def generate(self, query, streamer=None, cancel_event=None, filters=None):
+        return self._generate_inputs(self.prompt_inputs([query], filters=filters),
+                                     cancel_event=cancel_event, streamer=streamer)[0]
+
+    def generate_batch(self, queries, cancel_event=None, filters=None):
+        queries = list(queries)
+        if not queries:
+            return []
+        return self._generate_inputs(self.prompt_inputs(queries, filters=filters), cancel_event=cancel_event)
+
+    def new_streamer(self, timeout=None):
+        """Streamer que recebe os tokens do generate e os entrega como texto, sem repetir o prompt."""
+        return TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+
+    def generate_stream(self, query, cancel_event=None, filters=None, executor=None, timeout=None):
+        """Gera a resposta em outra thread (ou no executor) e devolve os trechos de texto à medida que saem.
+
+        Se o consumidor abandonar o gerador (cliente desconectou), a geração é cancelada. Se a geração
+        falhar, o streamer recebe o fim do texto e a exceção é relançada para o consumidor, em vez de
+        ele esperar por trechos que não vêm; timeout limita a espera por cada trecho (queue.Empty).
+        """
+        cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        streamer = self.new_streamer(timeout=timeout)
+        erros = []
+
+        def gerar():
+            try:
+                self.generate(query, streamer=streamer, cancel_event=cancel_event, filters=filters)
+            except BaseException as e:
+                erros.append(e)
+                streamer.end()
+
+        if executor is not None:
+            wait = executor.submit(gerar).result
+        else:
+            thread = threading.Thread(target=gerar, daemon=True)
+            thread.start()
+            wait = thread.join
+        try:
+            yield from streamer
+        finally:
+            cancel_event.set()
+            wait()
+        if erros:
+            raise erros[0]
+
+    def tokenize_prompts(self, prompts):
+        # Padding à esquerda: modelos decoder-only continuam a partir do último token.
+        # A truncagem só atua sem empacotamento de contextos (ou como salvaguarda)
+        inputs = self.tokenizer(prompts, return_tensors='pt', padding=True,
+                                truncation=True, max_length=self.input_budget())
+        if device == 0:
+            inputs = {k: v.to('cuda') for k, v in inputs.items()}
+        return inputs
+
+    def _generate_inputs(self, inputs, cancel_event=None, streamer=None):
+        policy = self.generation_policy
+        max_new_tokens = policy['max_new_tokens']
+        prompt_length = inputs['input_ids'].shape[1]
+        stopping = StoppingCriteriaList()
+        if cancel_event is not None:
+            stopping.append(CancelCriteria(cancel_event))
+        if policy['repeated_span']:
+            stopping.append(RepeatedSpanCriteria(prompt_length, *policy['repeated_span']))
+        if policy['stop_sequences']:
+            stopping.append(StopSequenceCriteria(self.tokenizer, policy['stop_sequences'], prompt_length))
+        processors = LogitsProcessorList()
+        if policy['no_repeat_ngram_size']:
+            processors.append(GeneratedNoRepeatNGram(policy['no_repeat_ngram_size'], prompt_length))
+        # Prefix cache só com um prompt: com padding à esquerda os prefixos do lote não se alinham
+        use_prefix_cache = self.prefix_cache is not None and inputs['input_ids'].shape[0] == 1
+        cache_kwargs = {}
+        if use_prefix_cache:
+            past_key_values = self.prefix_cache.lookup(inputs['input_ids'][0])
+            if past_key_values is not None:
+                # O generate processa só os tokens após o prefixo já em cache
+                cache_kwargs['past_key_values'] = past_key_values
+        output = self.model.generate(**inputs, max_new_tokens=max_new_tokens,
+                                     pad_token_id=self.tokenizer.pad_token_id,
+                                     stopping_criteria=stopping, logits_processor=processors,
+                                     streamer=streamer, return_dict_in_generate=use_prefix_cache,
+                                     **cache_kwargs)
+        if use_prefix_cache:
+            self.prefix_cache.store(inputs['input_ids'][0], output.past_key_values)
+            output = output.sequences
+        # Decodifica só a continuação: com padding à esquerda todo prompt ocupa as primeiras posições
+        return [self._postprocess(seq[prompt_length:]) for seq in output]
+
+    def _postprocess(self, generated):
+        """Remove a repetição final que disparou a parada e corta o texto na primeira stop sequence."""
+        policy = self.generation_policy
+        if policy['repeated_span']:
+            tokens = [int(t) for t in generated]
+            # Sequências encerradas antes das outras são completadas com pad no fim
+            while tokens and tokens[-1] == self.tokenizer.pad_token_id:
+                tokens.pop()
+            k = repeated_tail(tokens, *policy['repeated_span'])
+            generated = generated[:len(tokens) - k]
+        text = self.tokenizer.decode(generated, skip_special_tokens=True)
+        for stop in policy['stop_sequences']:
+            pos = text.find(stop)
+            if pos >= 0:
+                text = text[:pos]
+        return text
+
+
+def corpus_fingerprint(processed_dir, paths=()):
+    """Identifica o conteúdo do corpus para a chave do cache de respostas: hash do manifest.json
+    (hash de contexto e de metadados de cada linha e linhas removidas), reescrito por toda ingestão.
+    Sem manifesto, usa tamanho e data de modificação dos arquivos em paths."""
+    manifest_path = os.path.join(processed_dir, 'manifest.json')
+    try:
+        with open(manifest_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        pass
+    partes = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        partes.append(f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}')
+    return hashlib.sha1('|'.join(partes).encode('utf-8')).hexdigest()
 
 
 class RAGRunnable(mlflow.pyfunc.PythonModel):
-    def __init__(self):
+    def __init__(self, index_params=None, quantization=None, generation_policy=None,
+                 prefix_cache_tokens=0, backend='pytorch', passages=True, passages_per_cv=1,
+                 hybrid=True, lexical_weight=1.0, processed_dir=None):
+        # Argumentos guardados para reabrir os artefatos em load_context, no processo que serve o modelo
+        self.options = dict(index_params=index_params, quantization=quantization,
+                            generation_policy=generation_policy, prefix_cache_tokens=prefix_cache_tokens,
+                            backend=backend, passages=passages, passages_per_cv=passages_per_cv,
+                            hybrid=hybrid, lexical_weight=lexical_weight)
+        # Caminho absoluto fixado na criação; RAG_PROCESSED_DIR o substitui ao carregar o modelo servido
+        self.processed_dir = os.path.abspath(processed_dir or os.path.join('..', 'data', 'processed'))
         # Inicializa o agente ao instanciar a classe (para uso direto)
-        embeddings_path = os.path.join('..', 'data', 'processed', 'embeddings.npy')
-        contextos_path = os.path.join('..', 'data', 'processed', 'contextos_completos.csv')
-        embeddings = np.load(embeddings_path)
-        df = pd.read_csv(contextos_path)
+        self._load(self.processed_dir, **self.options)
+
+    def __getstate__(self):
+        # O MLflow serializa o modelo com cloudpickle, e um np.memmap serializado vira um array comum:
+        # cada worker carregaria na RAM embeddings, contextos e tokens inteiros (e o LLM ia junto).
+        # Sem o agente, load_context reabre os stores via mmap, compartilhados pelo page cache
+        state = self.__dict__.copy()
+        state.pop('agent', None)
+        return state
+
+    def _load(self, processed_dir, index_params=None, quantization=None, generation_policy=None,
+              prefix_cache_tokens=0, backend='pytorch', passages=True, passages_per_cv=1,
+              hybrid=True, lexical_weight=1.0):
+        files = corpus_files(processed_dir)
+        passage_files = corpus_files(processed_dir, passages=True)
+        passage_map = None
+        if passages and os.path.exists(passage_files['map']) and os.path.exists(passage_files['embeddings']):
+            # Passagens gravadas pelo chunking da ingestão: a busca roda sobre elas e agrega por CV
+            passage_map = open_passage_map(passage_files['map'])
+            if len(passage_map) == len(open_embedding_store(passage_files['embeddings'])):
+                files = passage_files
+            else:
+                passage_map = None
+        store_path = files['embeddings']
+        embeddings_path = os.path.join(processed_dir, 'embeddings.npy')
+        contextos_path = os.path.join(processed_dir, 'contextos_completos.csv')
+        context_store_path = files['contexts']
+        index_path = files['index']
+        manifest_path = os.path.join(processed_dir, 'manifest.json')
+        token_counts_path = files['token_counts']
+        tokens_path = files['tokens']
+        index_params = dict(index_params or {})
+        embedder_name = EMBEDDER_NAME
+        if os.path.exists(store_path):
+            # Embeddings pré-normalizados via mmap: compartilhados entre workers pelo page cache
+            store = open_embedding_store(store_path)
+            embeddings = store.vectors
+            embedder_name = store.model_name
+            index_params['normalized'] = store.normalized
+        else:
+            embeddings = np.load(embeddings_path)
+        if os.path.exists(context_store_path):
+            # Blob UTF-8 + offsets via mmap: nada de um str por CV carregado pelo pandas
+            contexts = open_context_store(context_store_path)
+        else:
+            contexts = pd.read_csv(contextos_path)['contexto'].tolist()
+        # Índice construído pelo ingestion.py (ivf/hnsw); index_params permite ajustar nprobe/ef_search
+        if quantization:
+            # Varre a cópia float16/int8 e re-ranqueia os candidatos com os embeddings float32
+            quantized = open_embedding_store(files['quantized'][quantization])
+            index = QuantizedIndex(quantized.vectors, quantized.scale, quantized.minimo,
+                                   rerank_vectors=embeddings if index_params.get('normalized') else normalize(embeddings),
+                                   rerank_factor=index_params.pop('rerank_factor', 4))
+        elif os.path.exists(index_path):
+            index = load_index(index_path, embeddings, **index_params)
+        else:
+            index = ExactIndex(embeddings, normalized=index_params.get('normalized', False))
+        token_counts = None
+        if os.path.exists(token_counts_path):
+            # Só vale se foi contado com o tokenizador do gerador e cobre todos os contextos
+            counts = open_token_counts(token_counts_path)
+            if counts.tokenizer == 'distilgpt2' and len(counts) == len(contexts):
+                token_counts = counts.counts
+        context_tokens = None
+        if os.path.exists(tokens_path):
+            tokens = open_token_store(tokens_path)
+            if tokens.tokenizer == 'distilgpt2' and len(tokens) == len(contexts):
+                context_tokens = tokens
+        lexical_index = None
+        if hybrid and os.path.exists(files['lexical']):
+            # BM25 do mesmo corpus (CVs ou passagens); só vale se cobre todas as linhas do índice vetorial
+            lexical_index = load_lexical_index(files['lexical'])
+            if len(lexical_index.doc_lengths) != len(embeddings):
+                lexical_index = None
+        metadata = None
+        cv_files = corpus_files(processed_dir)
+        if os.path.exists(cv_files['metadata']):
+            # Metadados por CV; só valem se cobrem todas as linhas do corpus de CVs
+            metadata = load_metadata_index(cv_files['metadata'])
+            cv_rows = len(open_context_store(cv_files['contexts'])) if os.path.exists(cv_files['contexts']) \
+                else len(contexts)
+            if len(metadata) != cv_rows:
+                metadata = None
+        deleted = []
+        if os.path.exists(manifest_path):
+            # Linhas removidas pela ingestão incremental continuam no store, mas saem da busca
+            with open(manifest_path, encoding='utf-8') as f:
+                deleted = json.load(f).get('deleted', [])
+            if deleted:
+                # Com passagens, saem da busca todas as passagens dos CVs removidos
+                removed = deleted if passage_map is None else np.flatnonzero(np.isin(passage_map.cv, deleted))
+                index.remove(removed)
+                if lexical_index is not None:
+                    lexical_index.remove(removed)
+                if metadata is not None:
+                    metadata.remove(deleted)
         self.agent = RAGAgent(
             llm_name='distilgpt2',
             retriever_embeddings=embeddings,
-            retriever_contexts=df['contexto'].tolist()
+            retriever_contexts=contexts,
+            embedder_name=embedder_name,
+            index=index,
+            generation_policy=generation_policy,
+            # Até prefix_cache_tokens tokens de prompts recentes com K/V prontos; desligado por padrão
+            # (0) até um benchmark mostrar ganho com os prompts reais
+            prefix_cache=PrefixKVCache(max_tokens=prefix_cache_tokens) if prefix_cache_tokens else None,
+            backend=backend,
+            context_token_counts=token_counts,
+            context_tokens=context_tokens,
+            passage_cv=passage_map.cv if passage_map is not None else None,
+            passages_per_cv=passages_per_cv,
+            lexical_index=lexical_index,
+            lexical_weight=lexical_weight,
+            metadata=metadata
         )
+        # Tudo que muda a resposta para uma mesma pergunta; entra na chave do cache de respostas
+        self.retrieval_config = {
+            'llm_name': 'distilgpt2',
+            'backend': backend,
+            'embedder_name': embedder_name,
+            'index': index.kind,
+            'index_params': index_params,
+            'quantization': quantization,
+            'corpus_rows': len(embeddings),
+            # Muda a cada ingestão que altera textos ou metadados, mesmo com o mesmo número de linhas
+            'corpus': corpus_fingerprint(processed_dir, [store_path, embeddings_path, context_store_path,
+                                                         contextos_path, cv_files['metadata']]),
+            'deleted': len(deleted),
+            'generation_policy': self.agent.generation_policy,
+            'context_packing': token_counts is not None or context_tokens is not None,
+            'pretokenized_contexts': context_tokens is not None,
+            'hybrid': None if lexical_index is None else {'lexical_weight': lexical_weight},
+            'metadata': None if metadata is None else metadata.fields,
+            'passages': None if passage_map is None else {
+                'max_words': passage_map.max_words, 'overlap': passage_map.overlap, 'per_cv': passages_per_cv},
+        }
 
     def load_context(self, context):
-        # Mantém para compatibilidade com MLflow
-        pass
+        # Modelo carregado do MLflow/BentoML: o agente não vem no pickle (ver __getstate__)
+        if getattr(self, 'agent', None) is None:
+            self._load(os.environ.get('RAG_PROCESSED_DIR', self.processed_dir), **self.options)
 
     def predict(self, context, model_input):
         # model_input pode ser um DataFrame com coluna 'pergunta', lista ou string
@@ -66,4 +658,4 @@ class RAGRunnable(mlflow.pyfunc.PythonModel):
             perguntas = model_input
         else:
             perguntas = [str(model_input)]
-        return [self.agent.generate(q) for q in perguntas]
+        return self.agent.generate_batch(perguntas)
@@ -0,0 +1,138 @@
+# prediction_logger.py
+# Registro assíncrono e em lote das predições do serviço no MLflow: as requisições só
+# enfileiram um registro; uma thread em segundo plano grava um run por lote.
+import json
+import queue
+import threading
+import time
+import uuid
+
+import mlflow
+
+DROP_POLICIES = ('drop_newest', 'drop_oldest', 'block')
+
+
+def mlflow_batch_writer(batch, run_name='log_prediction_batch'):
+    """Grava um lote como um único run: parâmetros agregados e um artefato JSONL consolidado."""
+    with mlflow.start_run(run_name=run_name):
+        mlflow.log_param('num_registros', len(batch))
+        mlflow.log_metric('num_perguntas', sum(len(r.get('perguntas', [])) for r in batch))
+        mlflow.log_text('\n'.join(json.dumps(r, ensure_ascii=False) for r in batch),
+                        'predicoes/predicoes.jsonl')
+
+
+class PredictionLogger:
+    """Fila limitada + escritor em segundo plano.
+
+    O lote é descarregado ao atingir batch_size registros ou a cada flush_interval segundos.
+    Com a fila cheia, drop_policy decide: descartar o registro novo (drop_newest), o mais
+    antigo (drop_oldest) ou esperar até block_timeout segundos (block) antes de descartar.
+    on_flush(n_registros, segundos, ok) é chamado após cada descarga e on_queue_change(profundidade)
+    quando registros entram ou saem da fila (ex.: métricas).
+    """
+
+    def __init__(self, writer=mlflow_batch_writer, max_queue=10000, batch_size=100,
+                 flush_interval=30.0, drop_policy='drop_newest', block_timeout=0.1, on_flush=None,
+                 on_queue_change=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy inválida: {drop_policy}. Opções: {DROP_POLICIES}")
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.on_flush = on_flush
+        self.on_queue_change = on_queue_change
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.enqueued = self.dropped = self.flushed = self.failed = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='prediction-logger', daemon=True)
+        self._thread.start()
+
+    def log(self, record):
+        """Enfileira um registro sem bloquear a requisição. Retorna o id do registro ou None se descartado."""
+        record = {'id': uuid.uuid4().hex, 'timestamp': time.time(), **record}
+        try:
+            if self.drop_policy == 'block':
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            if self.drop_policy != 'drop_oldest':
+                self._count('dropped')
+                return None
+            try:
+                self.queue.get_nowait()
+                self._count('dropped')
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self._count('dropped')
+                return None
+        self._count('enqueued')
+        self._queue_changed()
+        return record['id']
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def _queue_changed(self):
+        if self.on_queue_change is not None:
+            self.on_queue_change(self.qsize())
+
+    def _collect(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if self._stop.is_set():
+                # Encerrando: esvazia o que já está na fila sem esperar
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                # Espera em fatias curtas para perceber o close() sem aguardar o intervalo inteiro
+                batch.append(self.queue.get(timeout=min(timeout, 0.5)))
+            except queue.Empty:
+                continue
+        if batch:
+            self._queue_changed()
+        return batch
+
+    def _run(self):
+        while True:
+            stopping = self._stop.is_set()
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+            elif stopping:
+                return
+
+    def _flush(self, batch):
+        inicio = time.perf_counter()
+        ok = True
+        try:
+            self.writer(batch)
+            self._count('flushed', len(batch))
+        except Exception:
+            # Falha ao gravar não derruba o serviço; o lote é contado como perdido
+            ok = False
+            self._count('failed', len(batch))
+        if self.on_flush is not None:
+            self.on_flush(len(batch), time.perf_counter() - inicio, ok)
+
+    def close(self, timeout=None):
+        """Descarrega o que resta na fila e encerra a thread escritora."""
+        self._stop.set()
+        self._thread.join(timeout)
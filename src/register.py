@@ -1,7 +1,36 @@
+import os
+import shutil
+import sys
+import tempfile
+if __package__ in (None, ''):
+    # Executado como script de dentro de src/ (python register.py): a raiz do projeto entra no
+    # sys.path para os imports do pacote src funcionarem como em python -m src.register
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import mlflow
 import bentoml 
 import pandas as pd
-from model import RAGRunnable
+from rouge_score import rouge_scorer
+from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
+from src.model import RAGRunnable
+from src.cache import invalidate_response_cache
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+# Módulos do pacote src de que o RAGRunnable depende; vão com o modelo logado no MLflow
+MODEL_CODE_MODULES = ['__init__.py', 'model.py', 'cache.py', 'chunking.py', 'lexical.py', 'metadata.py',
+                      'store.py', 'vector_index.py']
+
+
+def stage_model_code(destino):
+    """Copia os módulos de MODEL_CODE_MODULES para destino/src e retorna esse diretório (code_paths).
+
+    O MLflow põe cada entrada de code_paths no sys.path pelo diretório pai, então o pacote src
+    (e os imports src.X do model.py) ficam disponíveis ao carregar o modelo em outro processo.
+    """
+    pacote = os.path.join(destino, 'src')
+    os.makedirs(pacote, exist_ok=True)
+    for nome in MODEL_CODE_MODULES:
+        shutil.copy2(os.path.join(SRC_DIR, nome), os.path.join(pacote, nome))
+    return pacote
 
 class Register:
     """Classe para registro de modelos no MLflow e BentoML."""
@@ -9,9 +38,6 @@ class Register:
         self.title = title
 
     def log_rag_model(self):
-        import numpy as np
-        from rouge_score import rouge_scorer
-        from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
         input_example = pd.DataFrame({'pergunta': ['Quais competências técnicas são mais valorizadas para a vaga de Python?']})
         mlflow.set_experiment(self.title)
         pergunta = input_example['pergunta'][0]
@@ -22,19 +48,20 @@ class Register:
                 resposta = RAGRunnable().predict(input_example)[0]
             except Exception:
                 resposta = "Resposta de exemplo gerada pelo modelo."
-            model_info = mlflow.pyfunc.log_model(
-                artifact_path='rag_agent',
-                python_model=RAGRunnable(),
-                code_paths=['model.py'],
-                pip_requirements=[
-                    'transformers==4.46.3',
-                    'torch==2.7.1',
-                    'sentence-transformers==2.7.0',
-                    'pandas',
-                    'numpy'
-                ],
-                input_example=input_example
-            )
+            with tempfile.TemporaryDirectory() as code_dir:
+                model_info = mlflow.pyfunc.log_model(
+                    artifact_path='rag_agent',
+                    python_model=RAGRunnable(),
+                    code_paths=[stage_model_code(code_dir)],
+                    pip_requirements=[
+                        'transformers==4.46.3',
+                        'torch==2.7.1',
+                        'sentence-transformers==2.7.0',
+                        'pandas',
+                        'numpy'
+                    ],
+                    input_example=input_example
+                )
             run_id = run.info.run_id
             # Loga pergunta e resposta
             mlflow.log_param('pergunta', pergunta)
@@ -71,7 +98,9 @@ class Register:
             name=self.title,
             tags={"status": "demo", "owner": "Sergio"}
         )
-        bentoml.mlflow.import_model(self.title, model_uri)
+        bento_model = bentoml.mlflow.import_model(self.title, model_uri)
+        # Respostas geradas por versões anteriores deixam de valer para o modelo novo
+        invalidate_response_cache(keep_model_tag=str(bento_model.tag))
         return result
 
 if __name__ == "__main__":
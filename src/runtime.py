@@ -0,0 +1,50 @@
+# runtime.py
+# Paralelismo do processo: divide o orçamento de CPU declarado entre os workers do BentoML
+# e, dentro de cada worker, entre as gerações simultâneas, e aplica o resultado ao torch,
+# às bibliotecas OpenMP/MKL e aos tokenizers, evitando oversubscription de threads.
+import os
+import torch
+
+
+def thread_layout(cpu_budget, workers=1, concurrency=1):
+    """Layout de threads para cpu_budget núcleos.
+
+    Cada worker recebe cpu_budget // workers núcleos, repartidos entre as `concurrency`
+    gerações que ele roda ao mesmo tempo (threads intra-op do torch por geração).
+    """
+    por_worker = max(1, cpu_budget // max(1, workers))
+    return {
+        'workers': workers,
+        'concurrency': concurrency,
+        'intra_op_threads': max(1, por_worker // max(1, concurrency)),
+        'inter_op_threads': 1,
+    }
+
+
+def layout_from_env(cpu_budget):
+    """thread_layout ajustável por variáveis de ambiente: RAG_WORKERS, RAG_INFERENCE_CONCURRENCY
+    e, para fixar as threads do torch diretamente, RAG_TORCH_THREADS / RAG_INTEROP_THREADS."""
+    layout = thread_layout(cpu_budget,
+                           workers=int(os.environ.get('RAG_WORKERS', 1)),
+                           concurrency=int(os.environ.get('RAG_INFERENCE_CONCURRENCY', 1)))
+    if 'RAG_TORCH_THREADS' in os.environ:
+        layout['intra_op_threads'] = int(os.environ['RAG_TORCH_THREADS'])
+    if 'RAG_INTEROP_THREADS' in os.environ:
+        layout['inter_op_threads'] = int(os.environ['RAG_INTEROP_THREADS'])
+    return layout
+
+
+def configure_threads(intra_op_threads, inter_op_threads=1, tokenizers_parallelism=False):
+    """Aplica o layout ao processo atual e retorna as contagens efetivas do torch."""
+    # Bibliotecas que leem o ambiente só ao inicializar (OpenMP/MKL de dependências carregadas depois)
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    os.environ['MKL_NUM_THREADS'] = str(intra_op_threads)
+    # O pool de threads dos tokenizers (Rust) competiria com o torch pelos mesmos núcleos
+    os.environ['TOKENIZERS_PARALLELISM'] = 'true' if tokenizers_parallelism else 'false'
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError:
+        # Só pode ser definido uma vez por processo, antes de qualquer trabalho inter-op
+        pass
+    return {'intra_op_threads': torch.get_num_threads(), 'inter_op_threads': torch.get_num_interop_threads()}
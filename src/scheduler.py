@@ -0,0 +1,306 @@
+# scheduler.py
+# Batching contínuo (por iteração) da geração do RAGAgent: um laço em segundo plano roda um
+# passo de decodificação por vez para todas as sequências em andamento, admite requisições novas
+# entre um token e outro e devolve cada resposta assim que ela termina, sem esperar o lote todo.
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+from transformers import LogitsProcessorList, StoppingCriteriaList
+from src.cache import build_cache, cache_layers
+from src.model import GeneratedNoRepeatNGram, RepeatedSpanCriteria, StopSequenceCriteria, device
+
+
+class _Sequence:
+    def __init__(self, prompt_ids, future, cancel_event):
+        self.prompt_ids = prompt_ids
+        self.future = future
+        self.cancel_event = cancel_event
+        self.tokens = []
+        self.done = False
+
+
+class ContinuousBatchScheduler:
+    """Fila de gerações atendida por um único laço de decodificação com KV cache em lote.
+
+    Com o laço ocioso, a primeira requisição espera até max_wait segundos por outras para começar
+    com um lote maior. Com sequências em andamento, quem está na fila entra no próximo passo (até
+    max_batch_size sequências) sem atrasar as demais, e cada sequência sai do lote ao terminar.
+    A saída é a mesma do RAGAgent.generate (decodificação gulosa, mesma política de geração).
+    O prefix cache do agente é compartilhado com o generate: um prompt com prefixo em cache passa
+    pelo modelo só com os tokens restantes, e o K/V de todo prompt processado vai para o cache.
+    on_change(tamanho_do_lote, fila) é chamado quando o lote ou a fila mudam (ex.: métricas).
+    """
+
+    def __init__(self, agent, max_batch_size=8, max_wait=0.01, on_change=None):
+        self.agent = agent
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.on_change = on_change
+        policy = agent.generation_policy
+        self.max_new_tokens = policy['max_new_tokens']
+        # Política aplicada por sequência, só aos tokens gerados (prompt_length=0)
+        self.processors = LogitsProcessorList()
+        if policy['no_repeat_ngram_size']:
+            self.processors.append(GeneratedNoRepeatNGram(policy['no_repeat_ngram_size'], 0))
+        self.criteria = StoppingCriteriaList()
+        if policy['repeated_span']:
+            self.criteria.append(RepeatedSpanCriteria(0, *policy['repeated_span']))
+        if policy['stop_sequences']:
+            self.criteria.append(StopSequenceCriteria(agent.tokenizer, policy['stop_sequences'], 0))
+        eos = agent.model.generation_config.eos_token_id
+        self.eos_token_ids = {t for t in (eos if isinstance(eos, (list, tuple)) else [eos]) if t is not None}
+        self.queue = queue.Queue()
+        self.admitted = self.completed = self.steps = 0
+        # Estado do lote em andamento: sequências, past_key_values e máscara de atenção [lote, tokens]
+        self._active = []
+        self._cache = None
+        self._mask = None
+        self._legacy_cache = False
+        self._reported = None
+        self._report_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='generation-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, query, cancel_event=None):
+        return self.submit_many([query], cancel_event=cancel_event)[0]
+
+    def submit_many(self, queries, cancel_event=None, filters=None):
+        """Recupera os contextos (com os filtros de metadados, se houver) e monta os prompts na
+        thread de quem chama, enfileira as gerações e retorna um Future (concurrent.futures)
+        com a resposta de cada pergunta."""
+        queries = list(queries)
+        if not queries:
+            return []
+        inputs = self.agent.prompt_inputs(queries, filters=filters)
+        futures = []
+        for ids, mask in zip(inputs['input_ids'], inputs['attention_mask']):
+            # Sem o padding à esquerda: cada sequência é alinhada de novo ao entrar no lote
+            prompt_ids = ids[mask.bool()]
+            future = Future()
+            self.queue.put(_Sequence(prompt_ids, future, cancel_event))
+            futures.append(future)
+        self._report()
+        return futures
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def batch_size(self):
+        return len(self._active)
+
+    def _report(self):
+        # Chamado pelo laço e por quem enfileira; on_change só recebe estados novos
+        if self.on_change is None:
+            return
+        with self._report_lock:
+            state = (self.batch_size(), self.qsize())
+            if state == self._reported:
+                return
+            self._reported = state
+            self.on_change(*state)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                novas = self._admit()
+                if novas:
+                    try:
+                        self._prefill(novas)
+                    except Exception as exc:
+                        # Erro no prefill derruba só as sequências novas; o lote em andamento segue
+                        for seq in novas:
+                            seq.future.set_exception(exc)
+                    else:
+                        self._retire()
+                if self._active:
+                    self._step()
+                    self._retire()
+            except Exception as exc:
+                # Erro no forward derruba só as sequências em andamento, não o laço
+                for seq in self._active:
+                    seq.future.set_exception(exc)
+                self._reset()
+            self._report()
+
+    def _admit(self):
+        livres = self.max_batch_size - len(self._active)
+        if livres <= 0:
+            return []
+        novas = []
+        if self._active:
+            # Lote em andamento: entra só quem já está na fila, sem atrasar os demais
+            deadline = None
+        else:
+            # Ocioso: bloqueia pela primeira requisição (acordando para perceber o close())
+            try:
+                novas.append(self.queue.get(timeout=0.5))
+            except queue.Empty:
+                return []
+            deadline = time.monotonic() + self.max_wait
+        while len(novas) < livres:
+            timeout = 0 if deadline is None else deadline - time.monotonic()
+            try:
+                novas.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        admitidas = []
+        for seq in novas:
+            # Future cancelado por quem pediu: descarta; depois disto ele não pode mais ser cancelado
+            if not seq.future.set_running_or_notify_cancel():
+                continue
+            if seq.cancel_event is not None and seq.cancel_event.is_set():
+                seq.future.set_result('')
+                continue
+            admitidas.append(seq)
+        self.admitted += len(admitidas)
+        return admitidas
+
+    def _prefill(self, novas):
+        """Processa os prompts das sequências novas e escolhe o primeiro token de cada uma. Prompts
+        com prefixo no prefix cache passam juntos pelo modelo, só com os tokens após o prefixo; os
+        demais, juntos com padding à esquerda. O K/V só entra no lote em andamento depois de todos os
+        forwards: uma falha aqui não deixa o lote pela metade."""
+        prefix_cache = self.agent.prefix_cache
+        com_cache, prefixos, sem_cache = [], [], []
+        for seq in novas:
+            past_key_values = prefix_cache.lookup(seq.prompt_ids) if prefix_cache is not None else None
+            if past_key_values is None:
+                sem_cache.append(seq)
+            else:
+                com_cache.append(seq)
+                prefixos.append(past_key_values)
+        grupos = []
+        if com_cache:
+            grupos.append(self._forward(com_cache, prefixos))
+        if sem_cache:
+            grupos.append(self._forward(sem_cache))
+        for seqs, past_key_values, mask in grupos:
+            self._merge(seqs, past_key_values, mask)
+
+    @torch.no_grad()
+    def _forward(self, seqs, prefixes=None):
+        """Forward dos prompts de seqs após os past_key_values do prefixo de cada um (prefixes, um por
+        sequência). Prefixos e restos dos prompts são alinhados à direita separadamente, com padding
+        mascarado antes de cada parte; guarda o K/V de cada prompt no prefix cache do agente."""
+        lengths = [0] * len(seqs) if prefixes is None else [p.get_seq_length() for p in prefixes]
+        p = max(lengths)
+        n = p + max(len(seq.prompt_ids) - length for seq, length in zip(seqs, lengths))
+        ids = torch.full((len(seqs), n), self.agent.tokenizer.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(seqs), n), dtype=torch.long)
+        for i, (seq, length) in enumerate(zip(seqs, lengths)):
+            rest = seq.prompt_ids[length:]
+            mask[i, p - length:p] = 1
+            ids[i, n - len(rest):] = rest.cpu()
+            mask[i, n - len(rest):] = 1
+        if device == 0:
+            ids, mask = ids.to('cuda'), mask.to('cuda')
+        past_key_values = None
+        if prefixes is not None:
+            # K/V dos prefixos com padding à esquerda até o maior deles, concatenados no eixo do lote
+            past_key_values = build_cache([tuple(torch.cat([F.pad(x, (0, 0, p - length, 0))
+                                                            for x, length in zip(xs, lengths)]) for xs in zip(*layer))
+                                           for layer in zip(*(cache_layers(prefix) for prefix in prefixes))],
+                                          isinstance(prefixes[0], tuple))
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+        output = self.agent.model(input_ids=ids[:, p:], attention_mask=mask,
+                                  position_ids=position_ids[:, p:], past_key_values=past_key_values,
+                                  use_cache=True)
+        self._legacy_cache = isinstance(output.past_key_values, tuple)
+        self._choose(seqs, output.logits[:, -1, :])
+        if self.agent.prefix_cache is not None and not self._legacy_cache:
+            layers = cache_layers(output.past_key_values)
+            for i, seq in enumerate(seqs):
+                # Cópia só das posições do prompt desta sequência, sem o padding do grupo
+                keep = mask[i].bool()
+                self.agent.prefix_cache.store(seq.prompt_ids, build_cache(
+                    [tuple(x[i:i + 1][:, :, keep] for x in layer) for layer in layers]))
+        return seqs, output.past_key_values, mask
+
+    def _merge(self, novas, past_key_values, mask):
+        if not self._active:
+            self._cache, self._mask = past_key_values, mask
+        else:
+            # Alinha à direita (padding à esquerda no K/V e na máscara) e concatena no eixo do lote
+            t = max(self._mask.shape[1], mask.shape[1])
+            layers = [tuple(torch.cat([F.pad(old, (0, 0, t - old.shape[2], 0)),
+                                       F.pad(new, (0, 0, t - new.shape[2], 0))])
+                            for old, new in zip(old_layer, new_layer))
+                      for old_layer, new_layer in zip(cache_layers(self._cache), cache_layers(past_key_values))]
+            self._cache = build_cache(layers, self._legacy_cache)
+            self._mask = torch.cat([F.pad(self._mask, (t - self._mask.shape[1], 0)),
+                                    F.pad(mask, (t - mask.shape[1], 0))])
+        self._active.extend(novas)
+
+    @torch.no_grad()
+    def _step(self):
+        """Um passo de decodificação para todo o lote: o último token de cada sequência entra no modelo."""
+        tokens = torch.tensor([[seq.tokens[-1]] for seq in self._active], device=self._mask.device)
+        mask = F.pad(self._mask, (0, 1), value=1)
+        position_ids = mask.sum(-1, keepdim=True) - 1
+        output = self.agent.model(input_ids=tokens, attention_mask=mask, position_ids=position_ids,
+                                  past_key_values=self._cache, use_cache=True)
+        # O cache só é remontado quando o lote muda (_merge/_retire); aqui o modelo apenas acrescenta o token
+        self._cache = output.past_key_values
+        self._mask = mask
+        self._choose(self._active, output.logits[:, -1, :])
+        self.steps += 1
+
+    def _choose(self, seqs, logits):
+        # Decodificação gulosa com a política de geração do agente, sequência por sequência
+        for seq, scores in zip(seqs, logits.float()):
+            generated = torch.tensor([seq.tokens], dtype=torch.long)
+            scores = self.processors(generated, scores.unsqueeze(0).clone())
+            seq.tokens.append(int(scores.argmax(-1)))
+            seq.done = self._finished(seq)
+
+    def _finished(self, seq):
+        if seq.cancel_event is not None and seq.cancel_event.is_set():
+            return True
+        if len(seq.tokens) >= self.max_new_tokens or seq.tokens[-1] in self.eos_token_ids:
+            return True
+        generated = torch.tensor([seq.tokens], dtype=torch.long)
+        return any(bool(criteria(generated, None)[0]) for criteria in self.criteria)
+
+    def _retire(self):
+        """Entrega as respostas das sequências encerradas e as remove do lote."""
+        keep = [i for i, seq in enumerate(self._active) if not seq.done]
+        if len(keep) == len(self._active):
+            return
+        for seq in self._active:
+            if seq.done:
+                seq.future.set_result(self.agent._postprocess(seq.tokens))
+                self.completed += 1
+        if not keep:
+            self._reset()
+            return
+        idx = torch.tensor(keep, device=self._mask.device)
+        mask = self._mask[idx]
+        # Descarta as colunas à esquerda que só tinham tokens das sequências que saíram
+        start = int(mask.any(0).int().argmax())
+        self._mask = mask[:, start:]
+        self._cache = build_cache([tuple(x[idx][:, :, start:] for x in layer) for layer in cache_layers(self._cache)],
+                                  self._legacy_cache)
+        self._active = [self._active[i] for i in keep]
+
+    def _reset(self):
+        self._active, self._cache, self._mask = [], None, None
+
+    def close(self, timeout=None):
+        """Encerra o laço; gerações em andamento ou na fila terminam com erro."""
+        self._stop.set()
+        self._thread.join(timeout)
+        pendentes = list(self._active)
+        while True:
+            try:
+                pendentes.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for seq in pendentes:
+            if not seq.future.done():
+                seq.future.set_exception(RuntimeError('Scheduler de geração encerrado'))
+        self._reset()
@@ -0,0 +1,484 @@
+# store.py
+# Armazenamento em disco dos artefatos do retriever (embeddings e textos dos contextos) em
+# layouts mapeáveis em memória (mmap), para que todos os workers do BentoML compartilhem
+# o page cache em vez de manter cópias privadas.
+import json
+import os
+import numpy as np
+
+EMBEDDING_MAGIC = b'RAGEMB01'
+# Cabeçalho de tamanho fixo (uma página): os dados começam alinhados e o
+# cabeçalho pode ser reescrito no lugar quando a contagem muda
+HEADER_SIZE = 4096
+
+
+def _write_header(f, magic, header):
+    payload = json.dumps(header).encode('utf-8')
+    if len(magic) + 4 + len(payload) > HEADER_SIZE:
+        raise ValueError(f"Cabeçalho excede {HEADER_SIZE} bytes")
+    f.seek(0)
+    f.write(magic)
+    f.write(np.uint32(len(payload)).tobytes())
+    f.write(payload)
+    f.write(b'\0' * (HEADER_SIZE - len(magic) - 4 - len(payload)))
+
+
+def _read_header(path, magic):
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if raw[:len(magic)] != magic:
+        raise ValueError(f"{path} não é um arquivo {magic.decode()} válido")
+    size = int(np.frombuffer(raw[len(magic):len(magic) + 4], dtype=np.uint32)[0])
+    return json.loads(raw[len(magic) + 4:len(magic) + 4 + size].decode('utf-8'))
+
+
+EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+
+
+def quantize_int8(embeddings):
+    """Quantização escalar por dimensão: x ~= (code + 128) * scale + minimo."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    minimo = embeddings.min(axis=0)
+    scale = np.maximum(embeddings.max(axis=0) - minimo, 1e-12) / 255.0
+    codes = np.clip(np.rint((embeddings - minimo) / scale) - 128, -128, 127).astype(np.int8)
+    return codes, scale.astype(np.float32), minimo.astype(np.float32)
+
+
+def dequantize_int8(codes, scale, minimo):
+    return (np.asarray(codes, dtype=np.float32) + 128.0) * scale + minimo
+
+
+class _MappedStore:
+    """Base dos stores via mmap: serializados só pelo caminho e reabertos ao desserializar.
+    Um np.memmap serializado (pickle/cloudpickle) viraria uma cópia comum em memória."""
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+class EmbeddingStore(_MappedStore):
+    """Matriz de embeddings L2-normalizados aberta via np.memmap (somente leitura).
+
+    Em int8, os parâmetros de quantização (scale e mínimo por dimensão, float32)
+    ficam logo após o cabeçalho e os códigos em seguida.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = _read_header(path, EMBEDDING_MAGIC)
+        self.dim = self.header['dim']
+        self.count = self.header['count']
+        self.dtype = self.header['dtype']
+        self.model_name = self.header['model_name']
+        self.normalized = self.header.get('normalized', False)
+        self.scale = self.minimo = None
+        data_offset = HEADER_SIZE
+        if self.dtype == 'int8':
+            params = np.fromfile(path, dtype=np.float32, count=2 * self.dim, offset=HEADER_SIZE)
+            self.scale, self.minimo = params[:self.dim], params[self.dim:]
+            data_offset += params.nbytes
+        if self.count:
+            self.vectors = np.memmap(path, dtype=self.dtype, mode='r',
+                                     offset=data_offset, shape=(self.count, self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=self.dtype)
+
+    def __len__(self):
+        return self.count
+
+    def dequantize(self, ids=None):
+        """Retorna as linhas pedidas (ou todas) em float32."""
+        rows = self.vectors if ids is None else self.vectors[ids]
+        if self.dtype == 'int8':
+            return dequantize_int8(rows, self.scale, self.minimo)
+        return np.asarray(rows, dtype=np.float32)
+
+
+def write_embedding_store(path, embeddings, model_name, normalize_vectors=True, dtype='float32'):
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"dtype não suportado: {dtype}. Opções: {EMBEDDING_DTYPES}")
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if normalize_vectors:
+        # Normaliza uma vez na ingestão: no serviço o score vira um produto escalar simples
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+    header = {
+        'dim': int(embeddings.shape[1]),
+        'count': int(embeddings.shape[0]),
+        'dtype': dtype,
+        'model_name': model_name,
+        'normalized': bool(normalize_vectors),
+    }
+    with open(path, 'wb') as f:
+        _write_header(f, EMBEDDING_MAGIC, header)
+        if dtype == 'int8':
+            codes, scale, minimo = quantize_int8(embeddings)
+            f.write(scale.tobytes())
+            f.write(minimo.tobytes())
+            f.write(codes.tobytes())
+        else:
+            f.write(embeddings.astype(dtype).tobytes())
+    return header
+
+
+def append_embeddings(path, embeddings):
+    """Acrescenta linhas ao final de um embeddings.bin existente e atualiza a contagem no cabeçalho.
+
+    Segue o layout do arquivo: normaliza se ele for normalizado e, em int8, reutiliza
+    os parâmetros de quantização gravados (valores fora da faixa são saturados).
+    """
+    header = _read_header(path, EMBEDDING_MAGIC)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, header['dim'])
+    if header.get('normalized', False):
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+    data_offset = HEADER_SIZE
+    if header['dtype'] == 'int8':
+        store = EmbeddingStore(path)
+        data = np.clip(np.rint((embeddings - store.minimo) / store.scale) - 128, -128, 127).astype(np.int8)
+        data_offset += 2 * header['dim'] * 4
+    else:
+        data = embeddings.astype(header['dtype'])
+    with open(path, 'r+b') as f:
+        # Escreve logo após a última linha válida, descartando restos de uma escrita interrompida
+        f.seek(data_offset + header['count'] * header['dim'] * data.itemsize)
+        f.write(data.tobytes())
+        f.truncate()
+        header['count'] += len(data)
+        _write_header(f, EMBEDDING_MAGIC, header)
+    return header
+
+
+def write_quantized_store(path, source_path, dtype, block_size=65536):
+    """Grava a cópia float16/int8 de um embeddings.bin float32 lendo-o em blocos de block_size
+    linhas, sem carregar a matriz inteira; em int8 uma primeira passada acha o mínimo e o máximo
+    de cada dimensão (os mesmos parâmetros de quantize_int8 sobre a matriz toda)."""
+    if dtype not in EMBEDDING_DTYPES[1:]:
+        raise ValueError(f"dtype não suportado: {dtype}. Opções: {EMBEDDING_DTYPES[1:]}")
+    source = EmbeddingStore(source_path)
+    header = {
+        'dim': source.dim,
+        'count': source.count,
+        'dtype': dtype,
+        'model_name': source.model_name,
+        'normalized': source.normalized,
+    }
+    blocos = range(0, source.count, block_size)
+    with open(path, 'wb') as f:
+        _write_header(f, EMBEDDING_MAGIC, header)
+        if dtype == 'int8':
+            minimo = np.zeros(source.dim, dtype=np.float32)
+            maximo = np.zeros(source.dim, dtype=np.float32)
+            for i, start in enumerate(blocos):
+                bloco = source.dequantize(slice(start, start + block_size))
+                minimo = bloco.min(axis=0) if i == 0 else np.minimum(minimo, bloco.min(axis=0))
+                maximo = bloco.max(axis=0) if i == 0 else np.maximum(maximo, bloco.max(axis=0))
+            scale = (np.maximum(maximo - minimo, 1e-12) / 255.0).astype(np.float32)
+            f.write(scale.tobytes())
+            f.write(minimo.tobytes())
+        for start in blocos:
+            bloco = source.dequantize(slice(start, start + block_size))
+            if dtype == 'int8':
+                bloco = np.clip(np.rint((bloco - minimo) / scale) - 128, -128, 127)
+            f.write(bloco.astype(dtype).tobytes())
+    return header
+
+
+def open_embedding_store(path):
+    return EmbeddingStore(path)
+
+
+CONTEXT_MAGIC = b'RAGCTX01'
+
+
+class ContextStore(_MappedStore):
+    """Textos dos contextos como um blob UTF-8 contíguo + array de offsets, ambos via mmap.
+
+    Indexável como uma lista (store[i] -> str), sem criar um objeto str por contexto na carga.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = _read_header(path, CONTEXT_MAGIC)
+        self.count = self.header['count']
+        self.offsets = np.memmap(path + '.idx', dtype=np.uint64, mode='r', shape=(self.count + 1,))
+        size = int(self.offsets[-1])
+        self.blob = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_SIZE, shape=(size,)) \
+            if size else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        i = int(i)
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+
+def write_context_store(path, texts):
+    """Grava os contextos em path (cabeçalho + blob) e os offsets em path + '.idx'."""
+    offsets = [0]
+    with open(path, 'wb') as f:
+        _write_header(f, CONTEXT_MAGIC, {'count': 0, 'encoding': 'utf-8'})
+        count = 0
+        for text in texts:
+            data = ('' if text is None else str(text)).encode('utf-8')
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+            count += 1
+        _write_header(f, CONTEXT_MAGIC, {'count': count, 'encoding': 'utf-8'})
+    np.asarray(offsets, dtype=np.uint64).tofile(path + '.idx')
+    return count
+
+
+def append_contexts(path, texts):
+    """Acrescenta contextos ao blob e seus offsets ao .idx de um contextos.bin existente."""
+    header = _read_header(path, CONTEXT_MAGIC)
+    offsets = np.fromfile(path + '.idx', dtype=np.uint64, count=header['count'] + 1)
+    novos = []
+    fim = int(offsets[-1])
+    with open(path, 'r+b') as f:
+        f.seek(HEADER_SIZE + fim)
+        for text in texts:
+            data = ('' if text is None else str(text)).encode('utf-8')
+            f.write(data)
+            fim += len(data)
+            novos.append(fim)
+        f.truncate()
+    # Offsets antes do cabeçalho: a contagem só cresce depois que os dados estão no disco
+    with open(path + '.idx', 'r+b') as f:
+        f.seek(offsets.nbytes)
+        f.write(np.asarray(novos, dtype=np.uint64).tobytes())
+        f.truncate()
+    with open(path, 'r+b') as f:
+        header['count'] += len(novos)
+        _write_header(f, CONTEXT_MAGIC, header)
+    return header['count']
+
+
+TOKEN_COUNT_MAGIC = b'RAGNTK01'
+
+
+class TokenCountStore(_MappedStore):
+    """Número de tokens de cada contexto no tokenizador do gerador (uint32 via mmap), na ordem do contextos.bin."""
+
+    def __init__(self, path):
+        self.path = path
+        self.header = _read_header(path, TOKEN_COUNT_MAGIC)
+        self.count = self.header['count']
+        self.tokenizer = self.header['tokenizer']
+        self.counts = np.memmap(path, dtype=np.uint32, mode='r', offset=HEADER_SIZE, shape=(self.count,)) \
+            if self.count else np.zeros(0, dtype=np.uint32)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return int(self.counts[i])
+
+
+def write_token_counts(path, counts, tokenizer_name):
+    counts = np.asarray(counts, dtype=np.uint32)
+    with open(path, 'wb') as f:
+        _write_header(f, TOKEN_COUNT_MAGIC, {'count': int(len(counts)), 'tokenizer': tokenizer_name})
+        f.write(counts.tobytes())
+    return len(counts)
+
+
+def append_token_counts(path, counts):
+    header = _read_header(path, TOKEN_COUNT_MAGIC)
+    counts = np.asarray(counts, dtype=np.uint32)
+    with open(path, 'r+b') as f:
+        f.seek(HEADER_SIZE + header['count'] * 4)
+        f.write(counts.tobytes())
+        f.truncate()
+        header['count'] += len(counts)
+        _write_header(f, TOKEN_COUNT_MAGIC, header)
+    return header['count']
+
+
+def open_token_counts(path):
+    return TokenCountStore(path)
+
+
+TOKEN_MAGIC = b'RAGTOK01'
+
+
+class TokenStore(_MappedStore):
+    """Token ids de cada contexto (uint16, ou int32 para vocabulários maiores) num array contíguo
+    + offsets, ambos via mmap. store[i] devolve os ids do contexto i sem copiar nem tokenizar."""
+
+    def __init__(self, path):
+        self.path = path
+        self.header = _read_header(path, TOKEN_MAGIC)
+        self.count = self.header['count']
+        self.tokenizer = self.header['tokenizer']
+        self.offsets = np.memmap(path + '.idx', dtype=np.uint64, mode='r', shape=(self.count + 1,))
+        size = int(self.offsets[-1])
+        self.ids = np.memmap(path, dtype=self.header['dtype'], mode='r', offset=HEADER_SIZE, shape=(size,)) \
+            if size else np.zeros(0, dtype=self.header['dtype'])
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        i = int(i)
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.ids[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+
+def token_dtype(vocab_size):
+    return 'uint16' if vocab_size <= np.iinfo(np.uint16).max + 1 else 'int32'
+
+
+def write_token_store(path, sequences, tokenizer_name, dtype='uint16'):
+    """Grava os ids em path (cabeçalho + array contíguo) e os offsets em path + '.idx'."""
+    with open(path, 'wb') as f:
+        _write_header(f, TOKEN_MAGIC, {'count': 0, 'tokenizer': tokenizer_name, 'dtype': dtype})
+    np.zeros(1, dtype=np.uint64).tofile(path + '.idx')
+    return append_tokens(path, sequences)
+
+
+def append_tokens(path, sequences):
+    """Acrescenta as sequências de ids ao final de um contextos.tok existente."""
+    header = _read_header(path, TOKEN_MAGIC)
+    offsets = np.fromfile(path + '.idx', dtype=np.uint64, count=header['count'] + 1)
+    dtype = np.dtype(header['dtype'])
+    novos = []
+    fim = int(offsets[-1])
+    with open(path, 'r+b') as f:
+        f.seek(HEADER_SIZE + fim * dtype.itemsize)
+        for seq in sequences:
+            data = np.asarray(seq, dtype=dtype)
+            f.write(data.tobytes())
+            fim += len(data)
+            novos.append(fim)
+        f.truncate()
+    # Mesma ordem do contextos.bin: offsets antes do cabeçalho
+    with open(path + '.idx', 'r+b') as f:
+        f.seek(offsets.nbytes)
+        f.write(np.asarray(novos, dtype=np.uint64).tobytes())
+        f.truncate()
+    with open(path, 'r+b') as f:
+        header['count'] += len(novos)
+        _write_header(f, TOKEN_MAGIC, header)
+    return header['count']
+
+
+def open_token_store(path):
+    return TokenStore(path)
+
+
+PASSAGE_MAGIC = b'RAGPSG01'
+
+
+class PassageMap(_MappedStore):
+    """Linha no contextos.bin do CV de origem de cada passagem (uint32 via mmap), na ordem do
+    passagens.bin. O cabeçalho guarda os parâmetros do chunking (max_words, overlap)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.header = _read_header(path, PASSAGE_MAGIC)
+        self.count = self.header['count']
+        self.max_words = self.header['max_words']
+        self.overlap = self.header['overlap']
+        self.cv = np.memmap(path, dtype=np.uint32, mode='r', offset=HEADER_SIZE, shape=(self.count,)) \
+            if self.count else np.zeros(0, dtype=np.uint32)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return int(self.cv[i])
+
+
+def write_passage_map(path, cv, max_words, overlap):
+    cv = np.asarray(cv, dtype=np.uint32)
+    with open(path, 'wb') as f:
+        _write_header(f, PASSAGE_MAGIC, {'count': int(len(cv)), 'max_words': int(max_words),
+                                         'overlap': int(overlap)})
+        f.write(cv.tobytes())
+    return len(cv)
+
+
+def append_passage_map(path, cv):
+    header = _read_header(path, PASSAGE_MAGIC)
+    cv = np.asarray(cv, dtype=np.uint32)
+    with open(path, 'r+b') as f:
+        f.seek(HEADER_SIZE + header['count'] * 4)
+        f.write(cv.tobytes())
+        f.truncate()
+        header['count'] += len(cv)
+        _write_header(f, PASSAGE_MAGIC, header)
+    return header['count']
+
+
+def open_passage_map(path):
+    return PassageMap(path)
+
+
+def corpus_files(processed_dir, passages=False):
+    """Caminhos dos artefatos de um corpus do retriever: os CVs inteiros (embeddings.bin,
+    contextos.bin, lexico.npz, metadados.npz, ...) ou as passagens do chunking (passagens_embeddings.bin,
+    passagens.bin, passagens_lexico.npz, ...)."""
+    embeddings, texts, index, lexical = ('passagens_embeddings', 'passagens', 'passagens_index', 'passagens_lexico') \
+        if passages else ('embeddings', 'contextos', 'index', 'lexico')
+    files = {
+        'embeddings': f'{embeddings}.bin',
+        'contexts': f'{texts}.bin',
+        'tokens': f'{texts}.tok',
+        'token_counts': f'{texts}.ntok',
+        'index': f'{index}.npz',
+        'lexical': f'{lexical}.npz',
+    }
+    if passages:
+        files['map'] = 'passagens.cv'
+    else:
+        # Metadados são por CV; as passagens herdam os do CV de origem via passagens.cv
+        files['metadata'] = 'metadados.npz'
+    files = {key: os.path.join(processed_dir, name) for key, name in files.items()}
+    files['quantized'] = {dtype: os.path.join(processed_dir, f'{embeddings}.{dtype}.bin')
+                          for dtype in EMBEDDING_DTYPES[1:]}
+    return files
+
+
+def truncate_store(path, count):
+    """Descarta as linhas após `count` de um embeddings.bin, contextos.bin, contextos.ntok,
+    contextos.tok ou passagens.cv (retomada de checkpoint)."""
+    with open(path, 'rb') as f:
+        magic = f.read(8)
+    header = _read_header(path, magic)
+    if count > header['count']:
+        raise ValueError(f"{path} tem {header['count']} linhas; não é possível truncar para {count}")
+    if magic == EMBEDDING_MAGIC:
+        data_offset = HEADER_SIZE + (2 * header['dim'] * 4 if header['dtype'] == 'int8' else 0)
+        size = data_offset + count * header['dim'] * np.dtype(header['dtype']).itemsize
+    elif magic in (TOKEN_COUNT_MAGIC, PASSAGE_MAGIC):
+        size = HEADER_SIZE + count * 4
+    else:
+        offsets = np.fromfile(path + '.idx', dtype=np.uint64, count=count + 1)
+        with open(path + '.idx', 'r+b') as f:
+            f.truncate(offsets.nbytes)
+        itemsize = np.dtype(header['dtype']).itemsize if magic == TOKEN_MAGIC else 1
+        size = HEADER_SIZE + int(offsets[-1]) * itemsize
+    with open(path, 'r+b') as f:
+        header['count'] = count
+        _write_header(f, magic, header)
+        f.truncate(size)
+
+
+def open_context_store(path):
+    return ContextStore(path)
@@ -0,0 +1,492 @@
+# vector_index.py
+# Índices vetoriais do retriever RAG: busca exata vetorizada (NumPy), IVF e HNSW.
+# Todos os índices trabalham com similaridade de cosseno sobre vetores L2-normalizados
+# e expõem search(queries, top_k) -> (scores, ids), com ids == -1 quando não há candidatos.
+# add(ids) indexa linhas novas já presentes na matriz de embeddings (store reaberto após um
+# append) e remove(ids) exclui linhas dos resultados, para a ingestão incremental.
+import heapq
+import inspect
+import numpy as np
+import torch
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, ids, top_k):
+    # Seleciona os top_k maiores scores de um vetor 1D, preenchendo com -1 se faltarem candidatos
+    out_scores = np.full(top_k, -np.inf, dtype=np.float32)
+    out_ids = np.full(top_k, -1, dtype=np.int64)
+    if len(scores) == 0:
+        return out_scores, out_ids
+    k = min(top_k, len(scores))
+    part = np.argpartition(-scores, k - 1)[:k]
+    order = part[np.argsort(-scores[part], kind='stable')]
+    out_scores[:k] = scores[order]
+    out_ids[:k] = ids[order]
+    return out_scores, out_ids
+
+
+def search_subset(embeddings, queries, top_k, ids, normalized=False):
+    """Busca exata restrita às linhas ids (ordenadas) da matriz de embeddings: só elas são lidas
+    do store e pontuadas. É a busca dos filtros de metadados, para qualquer tipo de índice."""
+    queries = normalize(queries)
+    top_k = max(1, top_k)
+    ids = np.asarray(ids, dtype=np.int64)
+    vectors = np.asarray(embeddings[ids], dtype=np.float32)
+    scores = queries @ (vectors if normalized else normalize(vectors)).T
+    out_scores = np.empty((len(queries), top_k), dtype=np.float32)
+    out_ids = np.empty((len(queries), top_k), dtype=np.int64)
+    for i in range(len(queries)):
+        out_scores[i], out_ids[i] = _top_k(scores[i], ids, top_k)
+    return out_scores, out_ids
+
+
+class ExactIndex:
+    """Busca exata: um produto matricial entre as consultas e todo o corpus."""
+    kind = 'exact'
+
+    def __init__(self, embeddings, normalized=False):
+        # A normalização do corpus é feita uma vez aqui, não a cada consulta
+        self.embeddings = embeddings if normalized else normalize(embeddings)
+        self.deleted = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.embeddings) - len(self.deleted)
+
+    def add(self, ids):
+        # Busca exata varre a matriz inteira: linhas novas já entram na próxima consulta
+        pass
+
+    def remove(self, ids):
+        self.deleted = np.union1d(self.deleted, np.asarray(ids, dtype=np.int64))
+
+    def search(self, queries, top_k):
+        queries = normalize(queries)
+        scores = queries @ np.asarray(self.embeddings).T
+        if len(self.deleted):
+            scores[:, self.deleted] = -np.inf
+        top_k = max(1, top_k)
+        out_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        k = min(top_k, scores.shape[1])
+        if k == 0:
+            return out_scores, out_ids
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        part_scores = np.take_along_axis(scores, part, axis=1)
+        order = np.argsort(-part_scores, axis=1, kind='stable')
+        out_ids[:, :k] = np.take_along_axis(part, order, axis=1)
+        out_scores[:, :k] = np.take_along_axis(part_scores, order, axis=1)
+        out_ids[np.isneginf(out_scores)] = -1
+        return out_scores, out_ids
+
+    def state(self):
+        return {}
+
+    @classmethod
+    def from_state(cls, embeddings, state, normalized=False):
+        return cls(embeddings, normalized=normalized)
+
+
+class IVFIndex:
+    """Índice invertido: k-means esférico particiona o corpus e a busca visita só nprobe listas."""
+    kind = 'ivf'
+
+    def __init__(self, embeddings, centroids, list_offsets, list_ids, nprobe=8, normalized=False):
+        self.embeddings = embeddings if normalized else normalize(embeddings)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return len(self.list_ids)
+
+    @classmethod
+    def build(cls, embeddings, nlist=None, nprobe=8, n_iter=20, seed=0, normalized=False):
+        vectors = embeddings if normalized else normalize(embeddings)
+        n = len(vectors)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(seed)
+        # Treina os centróides numa amostra para manter o build barato em corpus grandes
+        sample_size = min(n, 256 * nlist)
+        sample = np.asarray(vectors[np.sort(rng.choice(n, sample_size, replace=False))])
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            vazios = counts == 0
+            # Centróides sem pontos são reiniciados em pontos aleatórios da amostra
+            sums[vazios] = sample[rng.choice(sample_size, int(vazios.sum()))]
+            centroids = normalize(sums)
+        index = cls(vectors, centroids, np.zeros(nlist + 1, dtype=np.int64),
+                    np.zeros(0, dtype=np.int64), nprobe=nprobe, normalized=True)
+        index._assign_lists(np.arange(n))
+        return index
+
+    def _nearest_list(self, ids):
+        assign = np.empty(len(ids), dtype=np.int64)
+        for start in range(0, len(ids), 65536):
+            bloco = np.asarray(self.embeddings[ids[start:start + 65536]])
+            assign[start:start + 65536] = np.argmax(bloco @ self.centroids.T, axis=1)
+        return assign
+
+    def _set_lists(self, ids, assign):
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=len(self.centroids))
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.list_ids = np.asarray(ids, dtype=np.int64)[order]
+
+    def _current_assign(self):
+        return np.repeat(np.arange(len(self.centroids)), np.diff(self.list_offsets))
+
+    def _assign_lists(self, ids):
+        self._set_lists(ids, self._nearest_list(ids))
+
+    def add(self, ids):
+        # Linhas novas vão para a lista do centróide mais próximo, sem re-treinar o k-means
+        ids = np.asarray(ids, dtype=np.int64)
+        self._set_lists(np.concatenate([self.list_ids, ids]),
+                        np.concatenate([self._current_assign(), self._nearest_list(ids)]))
+
+    def remove(self, ids):
+        keep = ~np.isin(self.list_ids, np.asarray(ids, dtype=np.int64))
+        self._set_lists(self.list_ids[keep], self._current_assign()[keep])
+
+    def search(self, queries, top_k, nprobe=None):
+        queries = normalize(queries)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        top_k = max(1, top_k)
+        out_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        for i, q in enumerate(queries):
+            candidates = np.concatenate([
+                self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probes[i]
+            ])
+            scores = np.asarray(self.embeddings[candidates]) @ q if len(candidates) else np.zeros(0)
+            out_scores[i], out_ids[i] = _top_k(scores, candidates, top_k)
+        return out_scores, out_ids
+
+    def state(self):
+        return {
+            'centroids': self.centroids,
+            'list_offsets': self.list_offsets,
+            'list_ids': self.list_ids,
+            'nprobe': np.array(self.nprobe),
+        }
+
+    @classmethod
+    def from_state(cls, embeddings, state, normalized=False, nprobe=None):
+        return cls(embeddings, state['centroids'], state['list_offsets'], state['list_ids'],
+                   nprobe=nprobe or int(state['nprobe']), normalized=normalized)
+
+
+class HNSWIndex:
+    """Grafo HNSW (Malkov & Yashunin): busca gulosa do topo para a base do grafo hierárquico.
+
+    Experimental: a construção e a busca no grafo rodam em Python (~4 s por 1000 vetores de
+    dim 384 no build), por isso fica fora das opções das CLIs de ingestão; use build_index('hnsw')
+    ou o benchmarks/bench_index.py para avaliar.
+    """
+    kind = 'hnsw'
+
+    def __init__(self, embeddings, layers, node_levels, entry_point, max_level,
+                 M=16, ef_search=50, normalized=False):
+        self.embeddings = embeddings if normalized else normalize(embeddings)
+        # layers[l] mapeia nó -> lista de vizinhos na camada l
+        self.layers = layers
+        self.node_levels = node_levels
+        self.entry_point = entry_point
+        self.max_level = max_level
+        self.M = M
+        self.ef_search = ef_search
+        # Nós removidos continuam no grafo para navegação, mas não aparecem nos resultados
+        self.deleted = set()
+
+    def __len__(self):
+        return len(self.node_levels) - len(self.deleted)
+
+    def add(self, ids, ef_construction=100, seed=None):
+        ids = np.asarray(ids, dtype=np.int64)
+        rng = np.random.default_rng(len(self.node_levels) if seed is None else seed)
+        levels = np.floor(-np.log(1.0 - rng.random(len(ids))) / np.log(self.M)).astype(np.int64)
+        tamanho = max(len(self.node_levels), int(ids.max()) + 1) if len(ids) else len(self.node_levels)
+        self.node_levels = np.concatenate([
+            self.node_levels, np.zeros(tamanho - len(self.node_levels), dtype=np.int64)])
+        for node, level in zip(ids, levels):
+            self._insert(int(node), int(level), ef_construction)
+
+    def remove(self, ids):
+        self.deleted.update(int(i) for i in ids)
+
+    @classmethod
+    def build(cls, embeddings, M=16, ef_construction=100, ef_search=50, seed=0, normalized=False):
+        vectors = embeddings if normalized else normalize(embeddings)
+        n = len(vectors)
+        index = cls(vectors, [], np.zeros(n, dtype=np.int64), -1, -1,
+                    M=M, ef_search=ef_search, normalized=True)
+        rng = np.random.default_rng(seed)
+        levels = np.floor(-np.log(1.0 - rng.random(n)) / np.log(M)).astype(np.int64)
+        for node in range(n):
+            index._insert(node, int(levels[node]), ef_construction)
+        return index
+
+    def _search_layer(self, q, entry_points, ef, layer):
+        graph = self.layers[layer]
+        visited = set(entry_points)
+        sims = np.asarray(self.embeddings[entry_points]) @ q
+        candidates = [(-s, e) for s, e in zip(sims, entry_points)]
+        results = [(s, e) for s, e in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        while candidates:
+            neg_sim, current = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [n for n in graph.get(current, ()) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for sim, n in zip(np.asarray(self.embeddings[neighbors]) @ q, neighbors):
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, n))
+                    heapq.heappush(results, (sim, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _select_neighbors(self, candidates, m):
+        # Heurística do artigo (Alg. 4): um candidato só entra se for mais similar à base
+        # do que a qualquer vizinho já escolhido; mantém o grafo conectado entre clusters.
+        # candidates: lista de (similaridade, nó) ordenada da mais para a menos similar.
+        if len(candidates) <= 1:
+            return [n for _, n in candidates]
+        sims = np.array([s for s, _ in candidates])
+        nodes = [n for _, n in candidates]
+        # Similaridade entre todos os pares de candidatos num único produto de matrizes
+        vetores = np.asarray(self.embeddings[nodes])
+        pares = vetores @ vetores.T
+        # Uma iteração por vizinho escolhido: cada escolha descarta de uma vez os candidatos
+        # mais similares a ele do que à base
+        dominados = np.zeros(len(nodes), dtype=bool)
+        selected, inicio = [], 0
+        while len(selected) < m and inicio < len(nodes):
+            i = inicio + int(np.argmin(dominados[inicio:]))
+            if dominados[i]:
+                inicio = len(nodes)
+                break
+            selected.append(i)
+            dominados |= pares[:, i] > sims
+            inicio = i + 1
+        # Completa com os descartados mais próximos para não desperdiçar grau
+        pruned = [i for i in range(inicio) if i not in selected]
+        return [nodes[i] for i in selected + pruned[:m - len(selected)]]
+
+    def _insert(self, node, level, ef_construction):
+        q = np.asarray(self.embeddings[node])
+        while len(self.layers) <= level:
+            self.layers.append({})
+        self.node_levels[node] = level
+        if self.entry_point < 0:
+            for layer in range(level + 1):
+                self.layers[layer][node] = []
+            self.entry_point, self.max_level = node, level
+            return
+        entry = [self.entry_point]
+        for layer in range(self.max_level, level, -1):
+            entry = [self._search_layer(q, entry, 1, layer)[0][1]]
+        for layer in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(q, entry, ef_construction, layer)
+            m_max = 2 * self.M if layer == 0 else self.M
+            selected = self._select_neighbors(found, self.M)
+            self.layers[layer][node] = selected
+            for n in selected:
+                vizinhos = self.layers[layer][n]
+                vizinhos.append(node)
+                if len(vizinhos) > m_max:
+                    # Poda com a mesma heurística de seleção
+                    sims = np.asarray(self.embeddings[vizinhos]) @ np.asarray(self.embeddings[n])
+                    order = np.argsort(-sims)
+                    self.layers[layer][n] = self._select_neighbors(
+                        [(sims[i], vizinhos[i]) for i in order], m_max)
+            entry = [n for _, n in found]
+        for layer in range(self.max_level + 1, level + 1):
+            self.layers[layer][node] = []
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def search(self, queries, top_k, ef_search=None):
+        queries = normalize(queries)
+        top_k = max(1, top_k)
+        ef = max(ef_search or self.ef_search, top_k)
+        out_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        if self.entry_point < 0:
+            return out_scores, out_ids
+        for i, q in enumerate(queries):
+            entry = [self.entry_point]
+            for layer in range(self.max_level, 0, -1):
+                entry = [self._search_layer(q, entry, 1, layer)[0][1]]
+            found = self._search_layer(q, entry, ef + len(self.deleted), 0)
+            found = [(s, n) for s, n in found if n not in self.deleted][:top_k]
+            out_scores[i, :len(found)] = [s for s, _ in found]
+            out_ids[i, :len(found)] = [n for _, n in found]
+        return out_scores, out_ids
+
+    def state(self):
+        state = {
+            'node_levels': self.node_levels,
+            'entry_point': np.array(self.entry_point),
+            'max_level': np.array(self.max_level),
+            'M': np.array(self.M),
+            'ef_search': np.array(self.ef_search),
+        }
+        # Cada camada é persistida em formato CSR (nós, offsets, vizinhos)
+        for layer, graph in enumerate(self.layers):
+            nodes = np.array(sorted(graph), dtype=np.int64)
+            counts = [len(graph[n]) for n in nodes]
+            state[f'layer{layer}_nodes'] = nodes
+            state[f'layer{layer}_offsets'] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            state[f'layer{layer}_neighbors'] = np.array(
+                [v for n in nodes for v in graph[n]], dtype=np.int64)
+        return state
+
+    @classmethod
+    def from_state(cls, embeddings, state, normalized=False, ef_search=None):
+        layers = []
+        layer = 0
+        while f'layer{layer}_nodes' in state:
+            nodes = state[f'layer{layer}_nodes']
+            offsets = state[f'layer{layer}_offsets']
+            neighbors = state[f'layer{layer}_neighbors']
+            layers.append({int(n): neighbors[offsets[i]:offsets[i + 1]].tolist()
+                           for i, n in enumerate(nodes)})
+            layer += 1
+        return cls(embeddings, layers, state['node_levels'], int(state['entry_point']),
+                   int(state['max_level']), M=int(state['M']),
+                   ef_search=ef_search or int(state['ef_search']), normalized=normalized)
+
+
+class QuantizedIndex:
+    """Varredura exata sobre embeddings float16/int8 com re-rank float32 dos melhores candidatos.
+
+    codes são os vetores quantizados (já normalizados antes da quantização); em int8,
+    scale e minimo são os parâmetros por dimensão de store.quantize_int8. rerank_vectors
+    (tipicamente o embeddings.bin float32 via mmap) só é lido nas linhas candidatas.
+    """
+    kind = 'quantized'
+
+    def __init__(self, codes, scale=None, minimo=None, rerank_vectors=None, rerank_factor=4,
+                 block_size=2048):
+        self.codes = codes
+        self.scale = scale
+        self.minimo = minimo
+        self.rerank_vectors = rerank_vectors
+        self.rerank_factor = rerank_factor
+        self.block_size = block_size
+        self.deleted = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.codes) - len(self.deleted)
+
+    def add(self, ids):
+        pass
+
+    def remove(self, ids):
+        self.deleted = np.union1d(self.deleted, np.asarray(ids, dtype=np.int64))
+
+    def approximate_scores(self, queries, ids=None):
+        """Scores aproximados das perguntas contra todas as linhas ou só as de ids (ordenadas)."""
+        queries = normalize(queries)
+        if self.scale is not None:
+            # q . ((c + 128) * scale + minimo) = (q * scale) . c + q . (128 * scale + minimo)
+            q_scaled = queries * self.scale
+            bias = queries @ (128.0 * self.scale + self.minimo)
+        else:
+            q_scaled, bias = queries, 0.0
+        n = len(self.codes) if ids is None else len(ids)
+        scores = torch.empty((len(queries), n), dtype=torch.float32)
+        q_scaled = torch.from_numpy(np.ascontiguousarray(q_scaled, dtype=np.float32))
+        # Converte os códigos em blocos pequenos (cabem no cache) sem materializar a matriz em float32.
+        # A conversão float16/int8 -> float32 do torch é bem mais rápida que a do NumPy;
+        # os blocos (memmap somente leitura) nunca são escritos.
+        for start in range(0, n, self.block_size):
+            linhas = slice(start, start + self.block_size) if ids is None else ids[start:start + self.block_size]
+            bloco = torch.from_numpy(np.asarray(self.codes[linhas])).float()
+            scores[:, start:start + self.block_size] = q_scaled @ bloco.T
+        return scores.numpy() + np.asarray(bias, dtype=np.float32).reshape(-1, 1)
+
+    def search(self, queries, top_k, ids=None):
+        """Busca em todas as linhas ou, com ids (ordenados, ex.: os de um filtro de metadados),
+        só nelas: os códigos e o re-rank float32 leem apenas essas linhas."""
+        queries = normalize(queries)
+        top_k = max(1, top_k)
+        ids = np.arange(len(self.codes)) if ids is None else np.asarray(ids, dtype=np.int64)
+        scores = self.approximate_scores(queries, None if len(ids) == len(self.codes) else ids)
+        if len(self.deleted):
+            scores[:, np.isin(ids, self.deleted)] = -np.inf
+        n_candidates = top_k * self.rerank_factor if self.rerank_vectors is not None else top_k
+        out_scores = np.empty((len(queries), top_k), dtype=np.float32)
+        out_ids = np.empty((len(queries), top_k), dtype=np.int64)
+        for i, q in enumerate(queries):
+            cand_scores, candidates = _top_k(scores[i], ids, n_candidates)
+            validos = (candidates >= 0) & ~np.isneginf(cand_scores)
+            cand_scores, candidates = cand_scores[validos], candidates[validos]
+            if self.rerank_vectors is not None and len(candidates):
+                # Re-rank exato em float32 só das linhas candidatas
+                ordem = np.sort(candidates)
+                exact = np.asarray(self.rerank_vectors[ordem], dtype=np.float32) @ q
+                out_scores[i], out_ids[i] = _top_k(exact, ordem, top_k)
+            else:
+                out_scores[i], out_ids[i] = _top_k(cand_scores, candidates, top_k)
+        return out_scores, out_ids
+
+
+INDEX_TYPES = {cls.kind: cls for cls in (ExactIndex, IVFIndex, HNSWIndex)}
+
+
+def build_index(kind, embeddings, **params):
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconhecido: {kind}. Opções: {sorted(INDEX_TYPES)}")
+    if kind == 'exact':
+        return ExactIndex(embeddings, **params)
+    return INDEX_TYPES[kind].build(embeddings, **params)
+
+
+def save_index(index, path):
+    # Só a estrutura do índice é salva; os vetores continuam em embeddings.npy
+    np.savez(path, kind=np.array(index.kind), **index.state())
+
+
+def load_index(path, embeddings, **params):
+    """Reabre um índice salvo por save_index sobre embeddings. params de busca de outros tipos de
+    índice (nprobe para um HNSW, ef_search para um IVF, qualquer um para o exato) são ignorados."""
+    with np.load(path) as data:
+        state = {key: data[key] for key in data.files}
+    kind = str(state.pop('kind'))
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconhecido em {path}: {kind}")
+    cls = INDEX_TYPES[kind]
+    accepted = inspect.signature(cls.from_state).parameters
+    return cls.from_state(embeddings, state, **{k: v for k, v in params.items() if k in accepted})
+
+
+def recall_at_k(index, reference_index, queries, k=3):
+    """Fração média dos top-k do índice de referência (exato) recuperados pelo índice avaliado."""
+    _, approx_ids = index.search(queries, k)
+    _, exact_ids = reference_index.search(queries, k)
+    hits = [len(set(a[a >= 0]) & set(e[e >= 0])) / max(1, (e >= 0).sum())
+            for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits)) if hits else 0.0
@@ -0,0 +1,127 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import torch
+from src import cache as cache_module
+from src.cache import (RESPONSE_CACHE_DB, LRUCache, PrefixKVCache, ResponseCache, build_cache, cache_layers,
+                       invalidate_response_cache, normalize_query)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestLRUCache(unittest.TestCase):
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query('  Quais  competências\tpara a vaga PYTHON? '),
+                         'quais competências para a vaga python?')
+        # Forma decomposta (NFD) e composta caem na mesma chave
+        self.assertEqual(normalize_query('competências'), normalize_query('competências'))
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2, ttl=None)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual((cache.get('a'), cache.get('c'), cache.get('b')), (1, 3, None))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_ttl_expires_entries(self):
+        clock = FakeClock()
+        cache = LRUCache(maxsize=10, ttl=60, clock=clock)
+        cache.put('a', 1)
+        clock.now = 59
+        self.assertEqual(cache.get('a'), 1)
+        clock.now = 61
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_pickle_starts_empty(self):
+        cache = LRUCache(maxsize=4, ttl=10)
+        cache.put('a', 1)
+        cache.get('a')
+        restored = pickle.loads(pickle.dumps(cache))
+        self.assertEqual((len(restored), restored.hits, restored.maxsize), (0, 0, 4))
+        restored.put('b', 2)
+        self.assertEqual(restored.get('b'), 2)
+
+def fake_kv(length):
+    # DynamicCache de uma camada com length posições (valor de cada posição = índice)
+    keys = torch.arange(length, dtype=torch.float32).view(1, 1, length, 1)
+    return build_cache([(keys, keys.clone())])
+
+class TestPrefixKVCache(unittest.TestCase):
+    def test_longest_prefix_and_token_budget(self):
+        cache = PrefixKVCache(max_tokens=10, min_prefix=2)
+        cache.store([1, 2, 3, 4], fake_kv(7))
+        cache.store([1, 2, 9, 9, 9], fake_kv(5))
+        # Guardado cortado no tamanho do prompt; devolvido cortado no prefixo em comum
+        self.assertEqual(cache.lookup([1, 2, 3, 4, 5]).get_seq_length(), 4)
+        # Prompt idêntico: ao menos o último token volta ao modelo
+        self.assertEqual(cache.lookup([1, 2, 9, 9, 9]).get_seq_length(), 4)
+        self.assertIsNone(cache.lookup([7, 7, 7]))
+        cache.store([5, 6, 7], fake_kv(3))
+        # 4 + 5 + 3 > 10: sai o menos usado recentemente
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.lookup([1, 2, 3, 4, 0]).get_seq_length(), 2)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_lookup_copies_only_the_prefix(self):
+        cache = PrefixKVCache(max_tokens=10, min_prefix=2)
+        cache.store([1, 2, 3, 4, 5, 6], fake_kv(6))
+        keys, _ = cache_layers(cache.lookup([1, 2, 3, 9]))[0]
+        self.assertEqual(keys.flatten().tolist(), [0.0, 1.0, 2.0])
+        # A cópia devolvida não compartilha memória com o guardado
+        keys.fill_(-1)
+        keys, _ = cache_layers(cache.lookup([1, 2, 3, 4, 5, 6, 7]))[0]
+        self.assertEqual(keys.flatten().tolist(), [0.0, 1.0, 2.0, 3.0, 4.0, 5.0])
+
+class TestResponseCache(unittest.TestCase):
+    def test_memory_tier_keyed_on_normalized_question(self):
+        cache = ResponseCache('RAG_Recrutamento:v1', {'index': 'exact'})
+        self.assertEqual(cache.get_many(['Vaga Python?']), [None])
+        cache.put_many(['Vaga Python?'], ['resposta'])
+        self.assertEqual(cache.get_many(['  vaga python? ', 'Vaga Java?']), ['resposta', None])
+        self.assertEqual((cache.hits, cache.misses), ({'memory': 1, 'disk': 0}, 2))
+        # Outra configuração de retrieval não reaproveita a resposta
+        self.assertEqual(ResponseCache('RAG_Recrutamento:v1', {'index': 'hnsw'}).get_many(['Vaga Python?']), [None])
+        # Nem a mesma pergunta com filtros de metadados
+        self.assertEqual(cache.get_many(['Vaga Python?'], {'aprovado': True}), [None])
+        cache.put_many(['Vaga Python?'], ['só aprovados'], {'aprovado': True})
+        self.assertEqual(cache.get_many(['Vaga Python?'], {'aprovado': True}), ['só aprovados'])
+        self.assertEqual(cache.get_many(['Vaga Python?']), ['resposta'])
+
+    def test_disk_tier_shared_and_invalidated_by_model_tag(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, 'responses.sqlite')
+            ResponseCache('RAG_Recrutamento:v1', db_path=db).put_many(['a', 'b'], ['ra', 'rb'])
+            # Outro worker (outra instância) lê do disco e promove para a memória
+            worker = ResponseCache('RAG_Recrutamento:v1', db_path=db)
+            self.assertEqual(worker.get_many(['a', 'b', 'c']), ['ra', 'rb', None])
+            self.assertEqual(worker.get_many(['a']), ['ra'])
+            self.assertEqual((worker.hits, worker.misses), ({'memory': 1, 'disk': 2}, 1))
+            # Nova versão registrada: respostas da v1 saem do disco
+            self.assertEqual(ResponseCache('RAG_Recrutamento:v2', db_path=db).get_many(['a']), [None])
+            self.assertEqual(invalidate_response_cache(db, keep_model_tag='RAG_Recrutamento:v2'), 2)
+            self.assertEqual(ResponseCache('RAG_Recrutamento:v1', db_path=db).get_many(['a']), [None])
+
+    def test_disk_tier_creates_missing_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, 'data', 'processed', 'responses.sqlite')
+            ResponseCache('RAG_Recrutamento:v1', db_path=db).put_many(['a'], ['ra'])
+            self.assertTrue(os.path.exists(db))
+
+    def test_default_db_path_independent_of_cwd(self):
+        self.assertTrue(os.path.isabs(RESPONSE_CACHE_DB))
+        raiz = os.path.dirname(os.path.dirname(os.path.abspath(cache_module.__file__)))
+        self.assertEqual(os.path.dirname(RESPONSE_CACHE_DB), os.path.join(raiz, 'data', 'processed'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+from src.chunking import aggregate_passages, chunk_text
+
+class TestChunkText(unittest.TestCase):
+    def test_short_text_is_one_passage(self):
+        self.assertEqual(chunk_text('Analista de dados\ncom Python', max_words=10, overlap=2),
+                         ['Analista de dados com Python'])
+        self.assertEqual(chunk_text('', max_words=10, overlap=2), [])
+
+    def test_keeps_paragraphs_and_sentences_whole_with_overlap(self):
+        paragrafos = 'Experiência em Python e SQL. Projetos de ETL.\n\nFormação em Estatística pela USP.'
+        self.assertEqual(chunk_text(paragrafos, max_words=10, overlap=3),
+                         ['Experiência em Python e SQL. Projetos de ETL.', 'Formação em Estatística pela USP.'])
+        # Parágrafo maior que max_words: divide entre frases, repetindo a última frase que cabe no overlap
+        texto = 'Experiência em Python e SQL. Projetos de ETL. Formação em Estatística pela USP. Inglês avançado.'
+        passagens = chunk_text(texto, max_words=8, overlap=3)
+        self.assertEqual(passagens, ['Experiência em Python e SQL. Projetos de ETL.',
+                                     'Projetos de ETL. Formação em Estatística pela USP.',
+                                     'Inglês avançado.'])
+
+    def test_long_sentence_is_split_in_windows(self):
+        palavras = [f'p{i}' for i in range(25)]
+        passagens = chunk_text(' '.join(palavras), max_words=10, overlap=4)
+        self.assertEqual([p.split() for p in passagens], [palavras[0:10], palavras[6:16], palavras[12:22],
+                                                          palavras[18:25]])
+        # Toda palavra do CV está em alguma passagem
+        self.assertEqual(set(w for p in passagens for w in p.split()), set(palavras))
+
+    def test_invalid_overlap_raises(self):
+        with self.assertRaises(ValueError):
+            chunk_text('texto', max_words=4, overlap=4)
+
+class TestAggregatePassages(unittest.TestCase):
+    def test_best_passage_per_cv(self):
+        passage_cv = np.array([0, 0, 1, 2, 2])
+        scores = np.array([[0.9, 0.8, 0.7, 0.6, 0.5]])
+        ids = np.array([[1, 0, 4, 3, -1]])
+        out_scores, out_ids = aggregate_passages(scores, ids, passage_cv, top_k=2)
+        self.assertEqual(out_ids.tolist(), [[1, 4]])
+        np.testing.assert_allclose(out_scores, [[0.9, 0.7]])
+        _, out_ids = aggregate_passages(scores, ids, passage_cv, top_k=3, per_cv=2)
+        self.assertEqual(out_ids.tolist(), [[1, 0, 4, 3, -1, -1]])
+
+if __name__ == '__main__':
+    unittest.main()
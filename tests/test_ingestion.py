@@ -2,8 +2,25 @@ import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
 import numpy as np
+import os
 from src import ingestion
 
+class FakeEncoder:
+    # Definido no módulo para poder ser enviado aos workers do pool (spawn)
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def encode(self, textos, batch_size=32, show_progress_bar=False):
+        return np.array([[len(t), os.getpid()] for t in textos], dtype=np.float32)
+
+class WordTokenizer:
+    # Um token por palavra (id = tamanho da palavra), no lugar do tokenizador do distilgpt2
+    def __call__(self, textos, **kwargs):
+        return {'input_ids': [[len(w) for w in t.split()] for t in textos]}
+
+    def __len__(self):
+        return 100
+
 class TestIngestionV2(unittest.TestCase):
     def setUp(self):
         self.sample_csv = 'fake_path.csv'
@@ -33,5 +50,186 @@ class TestIngestionV2(unittest.TestCase):
         mock_model.encode.assert_called_once_with(['contexto1', 'contexto2'], show_progress_bar=True)
         np.testing.assert_array_equal(embeddings, np.array([[1,2,3],[4,5,6]]))
 
+    def test_build_retriever_index_reports_recall(self):
+        embeddings = np.random.default_rng(0).standard_normal((200, 8)).astype(np.float32)
+        index, recall = ingestion.build_retriever_index(embeddings, kind='ivf', nlist=4, nprobe=4)
+        self.assertEqual(index.kind, 'ivf')
+        self.assertEqual(recall, 1.0)
+
+    @patch('src.ingestion.AutoTokenizer')
+    @patch('src.ingestion.SentenceTransformer')
+    def test_incremental_update_embeds_only_new_rows(self, mock_sentence_transformer, mock_tokenizer):
+        import tempfile
+        from src.store import open_context_store, open_embedding_store, open_token_counts, open_token_store
+        mock_tokenizer.from_pretrained.return_value = WordTokenizer()
+        # Embedding determinístico por texto, para comparar com uma ingestão completa
+        encode = lambda textos, **kw: np.array(
+            [np.random.default_rng(sum(map(ord, t))).standard_normal(4) for t in textos], dtype=np.float32)
+        mock_sentence_transformer.return_value.encode.side_effect = encode
+        with tempfile.TemporaryDirectory() as tmp:
+            df = pd.DataFrame({'contexto': ['cv a', 'cv b', 'cv c'], 'situacao_candidado': ['Aprovado', None, 'Prospect']})
+            ingestion.build_processed_data(df, tmp, model_name='mock-model', index_kind='ivf',
+                                           index_params={'nlist': 1})
+            df2 = pd.DataFrame({'contexto': ['cv a', 'cv c alterado', 'cv c', 'cv d', 'cv d'],
+                                'situacao_candidado': ['Aprovado', 'Proposta Aceita', 'Prospect', None, None]})
+            stats = ingestion.incremental_update(df2, tmp)
+            self.assertEqual(stats, {'novos': 2, 'removidos': 1, 'metadados_atualizados': 0, 'ativos': 4})
+            mock_sentence_transformer.return_value.encode.assert_called_with(
+                ['cv c alterado', 'cv d'], show_progress_bar=True)
+            self.assertEqual(list(open_context_store(os.path.join(tmp, 'contextos.bin'))),
+                             ['cv a', 'cv b', 'cv c', 'cv c alterado', 'cv d'])
+            self.assertEqual(len(open_embedding_store(os.path.join(tmp, 'embeddings.bin'))), 5)
+            ntok = open_token_counts(os.path.join(tmp, 'contextos.ntok'))
+            self.assertEqual((ntok.tokenizer, list(ntok.counts)), ('distilgpt2', [2, 2, 2, 3, 2]))
+            tokens = open_token_store(os.path.join(tmp, 'contextos.tok'))
+            self.assertEqual([t.tolist() for t in tokens], [[2, 1], [2, 1], [2, 1], [2, 1, 8], [2, 1]])
+            manifest = ingestion.load_manifest(tmp)
+            self.assertEqual(manifest['deleted'], [1])
+            # Rodar de novo sem mudanças não embeda nada
+            self.assertEqual(ingestion.incremental_update(df2, tmp),
+                             {'novos': 0, 'removidos': 0, 'metadados_atualizados': 0, 'ativos': 4})
+            index = ingestion.load_index(os.path.join(tmp, 'index.npz'),
+                                         open_embedding_store(os.path.join(tmp, 'embeddings.bin')).vectors,
+                                         normalized=True)
+            self.assertEqual(len(index), 5)
+            # BM25 acompanha as linhas do store, sem re-tokenizar as antigas
+            lexico = ingestion.load_lexical_index(os.path.join(tmp, 'lexico.npz'))
+            self.assertEqual(len(lexico.doc_lengths), 5)
+            self.assertEqual(lexico.search(['alterado'], 1)[1].tolist(), [[3]])
+            # Metadados também: as linhas novas entram com os seus valores
+            metadados = ingestion.load_metadata_index(os.path.join(tmp, 'metadados.npz'))
+            self.assertEqual(len(metadados), 5)
+            self.assertEqual(metadados.select({'aprovado': True}).tolist(), [0, 3])
+            # Só a situação muda: os metadados das linhas são regravados, sem embedar nada
+            mock_sentence_transformer.return_value.encode.reset_mock()
+            df3 = df2.assign(situacao_candidado=['Prospect', 'Proposta Aceita', 'Aprovado', None, None])
+            self.assertEqual(ingestion.incremental_update(df3, tmp),
+                             {'novos': 0, 'removidos': 0, 'metadados_atualizados': 2, 'ativos': 4})
+            mock_sentence_transformer.return_value.encode.assert_not_called()
+            metadados = ingestion.load_metadata_index(os.path.join(tmp, 'metadados.npz'))
+            self.assertEqual(len(metadados), 5)
+            self.assertEqual(metadados.select({'aprovado': True}).tolist(), [2, 3])
+            self.assertEqual(metadados.select({'situacao': 'prospect'}).tolist(), [0])
+            self.assertEqual(ingestion.incremental_update(df3, tmp)['metadados_atualizados'], 0)
+
+    @patch('src.ingestion.AutoTokenizer')
+    @patch('src.ingestion.SentenceTransformer')
+    def test_chunking_writes_passages_mapped_to_cvs(self, mock_sentence_transformer, mock_tokenizer):
+        import tempfile
+        from src.store import corpus_files, open_context_store, open_embedding_store, open_passage_map, open_token_store
+        mock_tokenizer.from_pretrained.return_value = WordTokenizer()
+        mock_sentence_transformer.return_value.encode.side_effect = lambda textos, **kw: np.array(
+            [[len(t), 1.0] for t in textos], dtype=np.float32)
+        df = self.sample_df.copy()
+        df['cv_pt'] = ['um dois três quatro cinco seis', 'CV2']
+        df = ingestion.prepare_contexts(df)
+        with tempfile.TemporaryDirectory() as tmp:
+            ingestion.build_processed_data(df, tmp, model_name='mock-model', chunking=(4, 1))
+            files = corpus_files(tmp, passages=True)
+            # Cada coluna é uma seção: nenhuma passagem junta o CV com a vaga
+            self.assertEqual(list(open_context_store(files['contexts'])),
+                             ['um dois três quatro', 'quatro cinco seis', 'Ativ1', 'Comp1', 'CV2', 'Ativ2', 'Comp2'])
+            self.assertEqual(open_passage_map(files['map']).cv.tolist(), [0, 0, 0, 0, 1, 1, 1])
+            self.assertEqual(len(open_embedding_store(files['embeddings'])), 7)
+            self.assertEqual(len(open_token_store(files['tokens'])), 7)
+            self.assertTrue(os.path.exists(files['index']))
+            self.assertEqual(ingestion.load_lexical_index(files['lexical']).search(['cinco'], 2)[1].tolist(), [[1, -1]])
+            # Incremental: as passagens do CV novo apontam para a linha dele no contextos.bin
+            df2 = pd.concat([df, df.iloc[[1]].assign(cv_pt='CV3')], ignore_index=True)
+            ingestion.incremental_update(ingestion.prepare_contexts(df2), tmp)
+            self.assertEqual(open_passage_map(files['map']).cv.tolist()[7:], [2, 2, 2])
+            self.assertEqual(list(open_context_store(files['contexts']))[7:], ['CV3', 'Ativ2', 'Comp2'])
+            index = ingestion.load_index(files['index'], open_embedding_store(files['embeddings']).vectors,
+                                         normalized=True)
+            self.assertEqual(len(index), 10)
+            # Ingestão completa sem chunking não deixa passagens desatualizadas para trás
+            ingestion.build_processed_data(df, tmp, model_name='mock-model')
+            self.assertFalse(any(os.path.exists(files[key]) for key in ('map', 'contexts', 'embeddings', 'index', 'lexical')))
+
+    def test_iter_json_object_small_buffer(self):
+        import json, tempfile
+        data = {'1': {'cv_pt': 'Python "sênior" {json}', 'idiomas': [1, {'a': None}]}, '2': {'cv_pt': 'x' * 40}}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'applicants.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.assertEqual(dict(ingestion.iter_json_object(path, buffer_chars=3)), data)
+            chunks = list(ingestion.iter_json_chunks(path, chunk_size=1))
+            self.assertEqual([c['id'].tolist() for c in chunks], [['1'], ['2']])
+            self.assertEqual(chunks[1]['contexto'][0], 'x' * 40 + '  ')
+
+    @patch('src.ingestion.AutoTokenizer')
+    @patch('src.ingestion.SentenceTransformer')
+    def test_streaming_ingestion_resumes_from_checkpoint(self, mock_sentence_transformer, mock_tokenizer):
+        import tempfile
+        from src.store import open_context_store, open_embedding_store, open_token_counts, open_token_store
+        mock_tokenizer.from_pretrained.return_value = WordTokenizer()
+        encode = lambda textos, **kw: np.array([[len(t), 1.0] for t in textos], dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, 'cv.csv')
+            df = self.sample_df.copy()
+            pd.concat([df] * 3, ignore_index=True).assign(cv_pt=[f'CV{i}' * (i + 1) for i in range(6)],
+                                                          modalidade=['PJ', 'CLT'] * 3).to_csv(csv_path, index=False)
+            out = os.path.join(tmp, 'processed')
+            os.makedirs(out)
+            # Primeira execução falha no terceiro bloco
+            chamadas = []
+            def encode_falha(textos, **kw):
+                chamadas.append(textos)
+                if len(chamadas) == 3:
+                    raise RuntimeError('worker morreu')
+                return encode(textos)
+            mock_sentence_transformer.return_value.encode.side_effect = encode_falha
+            with self.assertRaises(RuntimeError):
+                ingestion.run_streaming_ingestion(csv_path, out, chunk_size=2, encode_batch_size=8,
+                                                  quantization=('int8',))
+            mock_sentence_transformer.return_value.encode.reset_mock()
+            mock_sentence_transformer.return_value.encode.side_effect = encode
+            checkpoint = ingestion.run_streaming_ingestion(csv_path, out, chunk_size=2, encode_batch_size=8)
+            self.assertEqual((checkpoint['rows_done'], checkpoint['stored'], checkpoint['done']), (6, 6, True))
+            # Só o bloco que faltava foi embedado na retomada
+            mock_sentence_transformer.return_value.encode.assert_called_once_with(
+                ['CV4CV4CV4CV4CV4 Ativ1 Comp1', 'CV5CV5CV5CV5CV5CV5 Ativ2 Comp2'], batch_size=8, show_progress_bar=False)
+            contextos = list(open_context_store(os.path.join(out, 'contextos.bin')))
+            self.assertEqual(contextos, ingestion.load_and_prepare_data(csv_path)['contexto'].tolist())
+            self.assertEqual(len(open_embedding_store(os.path.join(out, 'embeddings.bin'))), 6)
+            # A cópia int8 pedida na primeira execução é gravada ao final da retomada
+            self.assertEqual(len(open_embedding_store(os.path.join(out, 'embeddings.int8.bin'))), 6)
+            self.assertEqual(list(open_token_counts(os.path.join(out, 'contextos.ntok')).counts), [3] * 6)
+            self.assertEqual(len(open_token_store(os.path.join(out, 'contextos.tok'))), 6)
+            self.assertEqual(len(ingestion.load_manifest(out)['rows']), 6)
+            self.assertTrue(os.path.exists(os.path.join(out, 'index.npz')))
+            self.assertEqual(len(ingestion.load_lexical_index(os.path.join(out, 'lexico.npz')).doc_lengths), 6)
+            metadados = ingestion.load_metadata_index(os.path.join(out, 'metadados.npz'))
+            self.assertEqual(metadados.select({'modalidade': 'clt'}).tolist(), [1, 3, 5])
+
+            # Execução concluída e fonte inalterada: nada a fazer
+            mock_sentence_transformer.return_value.encode.reset_mock()
+            ingestion.run_streaming_ingestion(csv_path, out, chunk_size=2, encode_batch_size=8)
+            mock_sentence_transformer.return_value.encode.assert_not_called()
+            # Mesmo caminho com outro conteúdo: o checkpoint concluído não vale e a fonte é ingerida de novo
+            pd.concat([df] * 2, ignore_index=True).to_csv(csv_path, index=False)
+            checkpoint = ingestion.run_streaming_ingestion(csv_path, out, chunk_size=2, encode_batch_size=8)
+            self.assertEqual((checkpoint['rows_done'], checkpoint['stored'], checkpoint['done']), (4, 4, True))
+            contextos = list(open_context_store(os.path.join(out, 'contextos.bin')))
+            self.assertEqual(contextos, ingestion.load_and_prepare_data(csv_path)['contexto'].tolist())
+            self.assertEqual(len(ingestion.load_manifest(out)['rows']), 4)
+            # Cópia quantizada existente: regravada com o corpus novo, não apagada
+            self.assertEqual(len(open_embedding_store(os.path.join(out, 'embeddings.int8.bin'))), 4)
+
+    def test_length_buckets_groups_similar_lengths(self):
+        textos = ['a' * n for n in [3, 10, 1, 7, 5]]
+        buckets = ingestion.length_buckets(textos, batch_size=2)
+        self.assertEqual([list(b) for b in buckets], [[1, 3], [4, 0], [2]])
+
+    def test_parallel_encoder_preserves_input_order(self):
+        textos = ['x' * n for n in np.random.default_rng(0).integers(1, 50, size=40)]
+        with ingestion.ParallelEncoder('mock-model', workers=2, batch_size=4,
+                                       model_factory=FakeEncoder) as encoder:
+            embeddings = encoder.encode(textos)
+        np.testing.assert_array_equal(embeddings[:, 0], [len(t) for t in textos])
+        # O trabalho foi feito fora do processo do teste
+        self.assertNotIn(os.getpid(), embeddings[:, 1])
+
 if __name__ == "__main__":
     unittest.main()
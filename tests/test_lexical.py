@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from src.lexical import (BM25Index, fold, fuse_rankings, load_lexical_index, save_lexical_index, tokenize,
+                         write_lexical_index)
+
+CVS = ['Analista SAP com experiência em módulos FI e CO',
+       'Desenvolvedor Java e Python, APIs REST',
+       'Gestão de projetos e liderança de equipes',
+       'Desenvolvedor C++ e C#, back-end em ASP.NET e Node.js']
+
+class TestTokenize(unittest.TestCase):
+    def test_folds_accents_and_keeps_technology_names(self):
+        self.assertEqual(fold('Gestão Técnica'), 'gestao tecnica')
+        self.assertEqual(tokenize('Experiência em C++, C# e Node.js.'), ['experiencia', 'c++', 'c#', 'node.js'])
+        # Palavras funcionais não entram
+        self.assertEqual(tokenize('vaga para o cargo de analista'), ['vaga', 'cargo', 'analista'])
+
+class TestBM25Index(unittest.TestCase):
+    def test_exact_terms_rank_first(self):
+        index = BM25Index.build(CVS)
+        _, ids = index.search(['vaga SAP', 'experiência com gestao', 'Python', 'cobol'], top_k=2)
+        self.assertEqual(ids[0].tolist(), [0, -1])
+        self.assertEqual(ids[1][0], 2)
+        self.assertEqual(ids[2].tolist(), [1, -1])
+        self.assertEqual(ids[3].tolist(), [-1, -1])
+
+    def test_add_documents_matches_full_build_and_remove(self):
+        index = BM25Index.build(CVS[:2])
+        index.add_documents(CVS[2:])
+        completo = BM25Index.build(CVS)
+        for query in ['desenvolvedor', 'sap', 'c++ node.js']:
+            np.testing.assert_allclose(index.search([query], 4)[0], completo.search([query], 4)[0], rtol=1e-6)
+            np.testing.assert_array_equal(index.search([query], 4)[1], completo.search([query], 4)[1])
+        index.remove([1])
+        self.assertEqual(index.search(['desenvolvedor'], 4)[1][0].tolist(), [3, -1, -1, -1])
+        self.assertEqual(len(index), 3)
+
+    def test_search_restricted_to_ids(self):
+        index = BM25Index.build(CVS)
+        self.assertEqual(index.search(['desenvolvedor'], 2, ids=np.array([0, 3]))[1][0].tolist(), [3, -1])
+        self.assertEqual(index.search(['sap'], 2, ids=np.array([1, 2]))[1][0].tolist(), [-1, -1])
+
+    def test_write_lexical_index_matches_build(self):
+        completo = BM25Index.build(CVS * 3)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'lexico.npz')
+            # Blocos de 2 textos e fatias de 5 postings: listas de um termo espalhadas por várias fatias
+            blocos = [(CVS * 3)[i:i + 2] for i in range(0, len(CVS) * 3, 2)]
+            self.assertEqual(write_lexical_index(iter(blocos), path, slice_size=5), len(completo.doc_ids))
+            gravado = load_lexical_index(path)
+            self.assertEqual(os.listdir(tmp), ['lexico.npz'])
+            vazio = os.path.join(tmp, 'vazio.npz')
+            write_lexical_index(iter([]), vazio)
+            self.assertEqual(len(load_lexical_index(vazio)), 0)
+        self.assertEqual(gravado.vocabulary, completo.vocabulary)
+        for name in ('offsets', 'doc_ids', 'tfs', 'doc_lengths'):
+            np.testing.assert_array_equal(getattr(gravado, name), getattr(completo, name))
+
+    def test_save_and_load(self):
+        index = BM25Index.build(CVS, k1=1.5, b=0.5)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'lexico.npz')
+            save_lexical_index(index, path)
+            loaded = load_lexical_index(path)
+        self.assertEqual((loaded.k1, loaded.b), (1.5, 0.5))
+        self.assertEqual(loaded.vocabulary, index.vocabulary)
+        np.testing.assert_array_equal(loaded.search(['java projetos'], 3)[1], index.search(['java projetos'], 3)[1])
+
+class TestFuseRankings(unittest.TestCase):
+    def test_reciprocal_rank_fusion(self):
+        dense = np.array([[3, 1, 2]])
+        lexical = np.array([[1, 0, -1]])
+        _, ids = fuse_rankings([dense, lexical], [1.0, 1.0], top_k=3)
+        # 1 aparece bem nos dois rankings e passa à frente do primeiro denso
+        self.assertEqual(ids.tolist(), [[1, 3, 0]])
+        _, ids = fuse_rankings([dense, lexical], [1.0, 0.0], top_k=2)
+        self.assertEqual(ids.tolist(), [[3, 1]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+from unittest.mock import patch
+from click.testing import CliRunner
+from src.data.make_dataset import main
+
+class TestMakeDataset(unittest.TestCase):
+    @patch('src.data.make_dataset.run_streaming_ingestion')
+    def test_cli_forwards_options(self, mock_run):
+        mock_run.return_value = {'rows_done': 10, 'stored': 10, 'done': True}
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            open('applicants.json', 'w').write('{}')
+            result = runner.invoke(main, ['applicants.json', 'processed', '--chunk-size', '500',
+                                          '--encode-batch-size', '32', '--no-resume', '--index', 'ivf',
+                                          '--workers', '4', '--chunk-words', '64', '--quantization', 'int8'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        mock_run.assert_called_once_with(
+            'applicants.json', 'processed', source_format=None, chunk_size=500, encode_batch_size=32,
+            model_name='sentence-transformers/all-MiniLM-L6-v2', resume=False, index_kind='ivf',
+            workers=4, chunking=(64, 32), quantization=('int8',))
+
+if __name__ == "__main__":
+    unittest.main()
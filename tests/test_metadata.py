@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from src.metadata import MetadataIndex, load_metadata_index, parse_dates, save_metadata_index
+
+def prospects():
+    return pd.DataFrame({
+        'vaga_id': ['4530', '4530', '4531', '4532'],
+        'titulo': ['Desenvolvedor Python', 'Desenvolvedor Python', 'Consultor SAP', None],
+        'situacao_candidado': ['Contratado pela Decision', 'Não Aprovado pelo RH', 'Proposta Aceita', 'Prospect'],
+        'data_candidatura': ['25-03-2021', '2021-04-10', '10-01-2022', None],
+        'formacao_e_idiomas.nivel_ingles': ['Avançado', 'Básico', 'Avançado', ''],
+        'codigo': [31000.0, 31001.0, np.nan, 31003.0],
+    })
+
+class TestMetadataIndex(unittest.TestCase):
+    def test_select_values_and_derived_approval(self):
+        index = MetadataIndex.build(prospects())
+        self.assertEqual(index.fields, ['aprovado', 'codigo', 'data_candidatura', 'nivel_ingles',
+                                        'situacao', 'titulo', 'vaga'])
+        self.assertEqual(index.select({'aprovado': True}).tolist(), [0, 2])
+        # Sem diferença de caixa/acentos; lista aceita qualquer dos valores
+        self.assertEqual(index.select({'nivel_ingles': 'avancado'}).tolist(), [0, 2])
+        self.assertEqual(index.select({'vaga': ['4531', '4532']}).tolist(), [2, 3])
+        self.assertEqual(index.select({'codigo': '31001'}).tolist(), [1])
+        # Campos diferentes se combinam com E
+        self.assertEqual(index.select({'titulo': 'Desenvolvedor Python', 'aprovado': True}).tolist(), [0])
+        self.assertEqual(index.select({'titulo': 'Analista'}).tolist(), [])
+        self.assertIsNone(index.select({}))
+        with self.assertRaises(ValueError):
+            index.select({'salario': 10})
+
+    def test_date_ranges(self):
+        index = MetadataIndex.build(prospects())
+        self.assertEqual(parse_dates(['25-03-2021', '2021-03-25', 'ontem'])[:2].tolist(), [18711, 18711])
+        self.assertEqual(index.select({'data_candidatura': {'de': '2021-04-01'}}).tolist(), [1, 2])
+        self.assertEqual(index.select({'data_candidatura': {'de': '01-01-2021', 'ate': '10-04-2021'}}).tolist(), [0, 1])
+        with self.assertRaises(ValueError):
+            index.select({'data_candidatura': '2021-04-10'})
+        with self.assertRaises(ValueError):
+            index.select({'data_candidatura': {'de': 'ontem'}})
+
+    def test_add_rows_truncate_remove_and_save(self):
+        df = prospects()
+        index = MetadataIndex.build(df.iloc[:2])
+        index.add_rows(df.iloc[2:])
+        # Campo novo nas linhas acrescentadas: as anteriores ficam sem valor
+        index.add_rows(pd.DataFrame({'modalidade': ['PJ']}))
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.select({'aprovado': True}).tolist(), [0, 2])
+        self.assertEqual(index.select({'modalidade': 'pj'}).tolist(), [4])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metadados.npz')
+            save_metadata_index(index, path)
+            loaded = load_metadata_index(path)
+        self.assertEqual(loaded.fields, index.fields)
+        for filters in [{'aprovado': True}, {'titulo': 'desenvolvedor python'}, {'data_candidatura': {'ate': '2021-12-31'}}]:
+            self.assertEqual(loaded.select(filters).tolist(), index.select(filters).tolist())
+        loaded.remove([0])
+        self.assertEqual(loaded.select({'aprovado': True}).tolist(), [2])
+        loaded.truncate(2)
+        self.assertEqual(loaded.select({'aprovado': [True, False]}).tolist(), [1])
+
+    def test_update_rows_replaces_values_in_place(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metadados.npz')
+            save_metadata_index(MetadataIndex.build(prospects()), path)
+            index = load_metadata_index(path)
+        novos = prospects().iloc[[1, 3]].assign(situacao_candidado=['Aprovado', 'Contratado como Hunting'],
+                                                data_candidatura=['01-02-2023', '02-02-2023'])
+        index.update_rows([1, 3], novos)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.select({'aprovado': True}).tolist(), [0, 1, 2, 3])
+        self.assertEqual(index.select({'situacao': 'não aprovado pelo rh'}).tolist(), [])
+        self.assertEqual(index.select({'data_candidatura': {'de': '2023-01-01'}}).tolist(), [1, 3])
+        self.assertEqual(index.select({'titulo': 'desenvolvedor python'}).tolist(), [0, 1])
+
+if __name__ == "__main__":
+    unittest.main()
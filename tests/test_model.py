@@ -1,13 +1,37 @@
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 import numpy as np
 import pandas as pd
-from src.model import RAGAgent, RAGRunnable
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel, StoppingCriteriaList
+from src import model as model_module
+from src.cache import PrefixKVCache
+from src.model import (CancelCriteria, RAGAgent, RAGRunnable, conv1d_to_linear, corpus_fingerprint, get_embedder,
+                       load_llm, repeated_tail)
+
+class FakeTokenizer:
+    # Tokenizador mínimo para rodar o generate de um GPT2 pequeno sem baixar nada
+    pad_token_id = 0
+
+    def __call__(self, prompts, **kwargs):
+        # Um token por caractere, com padding à esquerda como o tokenizador real
+        seqs = [[1 + ord(c) % 31 for c in p] for p in prompts]
+        n = max(len(seq) for seq in seqs)
+        ids = torch.tensor([[0] * (n - len(seq)) + seq for seq in seqs])
+        mask = torch.tensor([[0] * (n - len(seq)) + [1] * len(seq) for seq in seqs])
+        return {'input_ids': ids, 'attention_mask': mask}
+
+    def decode(self, ids, skip_special_tokens=True, **kwargs):
+        return ''.join(f'w{int(t)} ' for t in ids)
 
 class TestRAGAgent(unittest.TestCase):
+    @patch('src.model.SentenceTransformer')
     @patch('src.model.AutoTokenizer')
     @patch('src.model.AutoModelForCausalLM')
-    def test_init_and_generate(self, mock_model, mock_tokenizer):
+    def test_init_and_generate(self, mock_model, mock_tokenizer, mock_st):
         # Setup mocks
         mock_tokenizer.from_pretrained.return_value = MagicMock()
         mock_model.from_pretrained.return_value = MagicMock(generate=MagicMock(return_value=[[1,2,3]]))
@@ -15,15 +39,340 @@ class TestRAGAgent(unittest.TestCase):
         contexts = ['ctx1', 'ctx2']
         agent = RAGAgent('distilgpt2', embeddings, contexts)
         # Patch retrieve to avoid sentence_transformers
-        agent.retrieve = MagicMock(return_value=['ctx1'])
+        agent.retrieve_batch = MagicMock(return_value=[['ctx1']])
         agent.tokenizer = MagicMock()
         agent.tokenizer.return_tensors = 'pt'
-        agent.tokenizer.__call__ = MagicMock(return_value={'input_ids': np.array([[1,2,3]])})
+        agent.tokenizer.return_value = {'input_ids': np.array([[1,2]])}
         agent.model = MagicMock()
         agent.model.generate = MagicMock(return_value=np.array([[1,2,3]]))
         agent.tokenizer.decode = MagicMock(return_value='mocked output')
         result = agent.generate('pergunta')
         self.assertEqual(result, 'mocked output')
+        # Só os tokens gerados são decodificados, sem ecoar prompt e contextos
+        np.testing.assert_array_equal(agent.tokenizer.decode.call_args[0][0], [3])
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_retrieve_reuses_injected_embedder(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[1.0, 0.0, 0.0]])
+        embeddings = np.array([[0.0, 1.0, 0.0], [1.0, 0.0, 0.0]])
+        with patch('src.model.SentenceTransformer') as mock_st:
+            agent = RAGAgent('distilgpt2', embeddings, ['ctx1', 'ctx2'], embedder=embedder)
+            self.assertEqual(agent.retrieve('a', top_k=1), ['ctx2'])
+            agent.retrieve('b', top_k=1)
+            mock_st.assert_not_called()
+        self.assertEqual(embedder.encode.call_count, 2)
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_generate_batch_single_encode_and_generate(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[1.0, 0.0], [0.0, 1.0]])
+        agent = RAGAgent('distilgpt2', np.array([[1.0, 0.0], [0.0, 1.0]]), ['ctx1', 'ctx2'], embedder=embedder)
+        agent.tokenizer.return_value = {'input_ids': np.zeros((2, 1))}
+        agent.model.generate.return_value = np.array([[0, 1], [0, 2]])
+        agent.tokenizer.decode.side_effect = lambda seq, skip_special_tokens: f"out{seq[0]}"
+        result = agent.generate_batch(['a', 'b'])
+        self.assertEqual(result, ['out1', 'out2'])
+        embedder.encode.assert_called_once_with(['a', 'b'])
+        agent.model.generate.assert_called_once()
+        prompts = agent.tokenizer.call_args[0][0]
+        self.assertEqual(prompts, ['a\nContexto:\nctx1\nctx2', 'b\nContexto:\nctx2\nctx1'])
+        self.assertTrue(agent.tokenizer.call_args[1]['padding'])
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_retrieved_contexts_are_ids_and_scores(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[0.6, 0.8]])
+        agent = RAGAgent('distilgpt2', np.array([[1.0, 0.0], [0.0, 1.0]]), ['ctx1', 'ctx2'], embedder=embedder)
+        contextos = agent.retrieved_contexts(['a'], top_k=3)
+        self.assertEqual([c['id'] for c in contextos[0]], [1, 0])
+        np.testing.assert_allclose([c['score'] for c in contextos[0]], [0.8, 0.6], rtol=1e-6)
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_passage_search_aggregates_by_cv(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[1.0, 0.0]])
+        # Passagens 0-1 do CV 0, 2-3 do CV 1 e 4 do CV 2
+        passagens = np.array([[0.9, 0.1], [0.99, 0.01], [0.8, 0.2], [0.7, 0.3], [0.1, 0.9]])
+        agent = RAGAgent('distilgpt2', passagens, ['p0', 'p1', 'p2', 'p3', 'p4'], embedder=embedder,
+                         passage_cv=np.array([0, 0, 1, 1, 2]), passage_fetch=2)
+        self.assertEqual(agent.retrieve('a', top_k=2), ['p1', 'p2'])
+        self.assertEqual([(c['id'], c['cv']) for c in agent.retrieved_contexts(['a'], top_k=3)[0]],
+                         [(1, 0), (2, 1), (4, 2)])
+        agent.passages_per_cv = 2
+        self.assertEqual(agent.retrieve('a', top_k=2), ['p1', 'p0', 'p2', 'p3'])
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_hybrid_search_finds_exact_terms(self, mock_model, mock_tokenizer):
+        from src.lexical import BM25Index
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[1.0, 0.0]])
+        contextos = ['Desenvolvedor Java sênior', 'Analista de sistemas', 'Consultor SAP FI']
+        # Para o embedding, o CV de SAP é o mais distante da pergunta
+        agent = RAGAgent('distilgpt2', np.array([[0.9, 0.1], [0.8, 0.2], [0.1, 0.9]]), contextos,
+                         embedder=embedder)
+        self.assertEqual(agent.retrieve('vaga SAP', top_k=1), ['Desenvolvedor Java sênior'])
+        agent.lexical_index = BM25Index.build(contextos)
+        self.assertEqual(agent.retrieve('vaga SAP', top_k=1), ['Consultor SAP FI'])
+        # Sem termo em comum com o corpus, vale o ranking denso
+        self.assertEqual(agent.retrieve('vaga cobol', top_k=2), contextos[:2])
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_metadata_filters_restrict_candidates(self, mock_model, mock_tokenizer):
+        from src.lexical import BM25Index
+        from src.metadata import MetadataIndex
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[1.0, 0.0]])
+        metadata = MetadataIndex.build(pd.DataFrame({
+            'titulo': ['Dev Java', 'Dev Python', 'Dev Python'],
+            'situacao_candidado': ['Não Aprovado pelo Cliente', 'Aprovado', 'Prospect'],
+        }))
+        # Passagens 0-1 do CV 0, 2 do CV 1 e 3-4 do CV 2
+        passagens = np.array([[0.99, 0.01], [0.9, 0.1], [0.5, 0.5], [0.8, 0.2], [0.7, 0.3]])
+        agent = RAGAgent('distilgpt2', passagens, ['p0', 'p1', 'p2', 'p3', 'p4'], embedder=embedder,
+                         passage_cv=np.array([0, 0, 1, 2, 2]), passages_per_cv=2, metadata=metadata)
+        self.assertEqual(agent.candidate_ids({'titulo': 'dev python'}).tolist(), [2, 3, 4])
+        self.assertEqual(agent.retrieve('a', top_k=1), ['p0', 'p1'])
+        self.assertEqual(agent.retrieve('a', top_k=1, filters={'titulo': 'Dev Python'}), ['p3', 'p4'])
+        self.assertEqual(agent.retrieve('a', top_k=3, filters={'aprovado': True}), ['p2'])
+        agent.lexical_index = BM25Index.build(['java', 'java', 'python', 'java', 'java'])
+        self.assertEqual(agent.retrieve('java', top_k=3, filters={'aprovado': True}), ['p2'])
+        self.assertEqual(agent.retrieve('a', filters={'titulo': 'Dev Cobol'}), [])
+        with self.assertRaises(ValueError):
+            agent.retrieve('a', filters={'salario': 1})
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_retrieve_batch_caches_query_embeddings(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.side_effect = lambda qs: np.array([[1.0, 0.0] if 'python' in q.lower() else [0.0, 1.0] for q in qs])
+        agent = RAGAgent('distilgpt2', np.array([[1.0, 0.0], [0.0, 1.0]]), ['ctx1', 'ctx2'], embedder=embedder)
+        first = agent.retrieve_batch(['Vaga Python', 'vaga  python ', 'Vaga Java'], top_k=1)
+        self.assertEqual(first, [['ctx1'], ['ctx1'], ['ctx2']])
+        # Variações de caixa/espaços da mesma pergunta são encodadas uma vez só
+        embedder.encode.assert_called_once_with(['Vaga Python', 'Vaga Java'])
+        self.assertEqual(agent.retrieve('VAGA PYTHON', top_k=1), ['ctx1'])
+        self.assertEqual(embedder.encode.call_count, 1)
+        self.assertEqual((agent.query_cache.hits, agent.query_cache.misses), (1, 2))
+
+    def test_cancel_criteria_stops_generation(self):
+        torch.manual_seed(0)
+        llm = GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=64, n_embd=16, n_layer=1, n_head=2)).eval()
+        prompt = torch.tensor([[1, 2, 3]])
+        cancel = threading.Event()
+        stopping = StoppingCriteriaList([CancelCriteria(cancel)])
+        completo = llm.generate(prompt, max_new_tokens=10, do_sample=False, pad_token_id=0, stopping_criteria=stopping)
+        self.assertEqual(completo.shape[1], 13)
+        cancel.set()
+        cancelado = llm.generate(prompt, max_new_tokens=10, do_sample=False, pad_token_id=0, stopping_criteria=stopping)
+        self.assertEqual(cancelado.shape[1], 4)
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_generate_stream_yields_only_new_tokens(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[1.0, 0.0]])
+        # Sem corte da repetição final: o stream não tem como "desenviar" tokens
+        agent = RAGAgent('distilgpt2', np.array([[1.0, 0.0], [0.0, 1.0]]), ['ctx1', 'ctx2'], embedder=embedder,
+                         generation_policy={'repeated_span': None})
+        torch.manual_seed(0)
+        agent.model = GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=512, n_embd=16, n_layer=1, n_head=2)).eval()
+        agent.tokenizer = FakeTokenizer()
+        completo = agent.generate('pergunta')
+        trechos = list(agent.generate_stream('pergunta'))
+        self.assertGreater(len(trechos), 1)
+        self.assertEqual(''.join(trechos), completo)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(''.join(agent.generate_stream('pergunta', executor=executor)), completo)
+            # Falha na geração: o stream termina e relança o erro, sem esperar o timeout do streamer
+            agent.model.generate = MagicMock(side_effect=RuntimeError('sem memória'))
+            inicio = time.perf_counter()
+            with self.assertRaises(RuntimeError):
+                list(agent.generate_stream('pergunta', executor=executor, timeout=30))
+            self.assertLess(time.perf_counter() - inicio, 5)
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_prefix_cache_skips_cached_prompt_tokens(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[1.0, 0.0]])
+        contextos = ['CV com experiência em Python e SQL', 'CV com inglês avançado']
+        agent = RAGAgent('distilgpt2', np.array([[1.0, 0.0], [0.0, 1.0]]), contextos, embedder=embedder,
+                         generation_policy={'max_new_tokens': 20}, prefix_cache=PrefixKVCache(max_tokens=1000, min_prefix=4))
+        torch.manual_seed(0)
+        agent.model = GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=512, n_embd=16, n_layer=1, n_head=2)).eval()
+        agent.tokenizer = FakeTokenizer()
+        processados = []
+        forward = agent.model.forward
+        agent.model.forward = lambda *args, **kwargs: processados.append(kwargs['input_ids'].shape[1]) or forward(*args, **kwargs)
+        primeira = agent.generate('Quais competências para a vaga Python?')
+        prompt_length = processados[0]
+        processados.clear()
+        self.assertEqual(agent.generate('Quais competências para a vaga Python?'), primeira)
+        # Só o último token do prompt passou pelo modelo na segunda vez
+        self.assertEqual(processados[0], 1)
+        self.assertEqual(agent.prefix_cache.reused_tokens, prompt_length - 1)
+        # Prompt parcialmente igual reaproveita o prefixo em comum e gera o mesmo que sem cache
+        processados.clear()
+        outra = agent.generate('Quais competências para a vaga Python e Java?')
+        self.assertLess(processados[0], prompt_length)
+        agent.prefix_cache = None
+        self.assertEqual(agent.generate('Quais competências para a vaga Python e Java?'), outra)
+
+    def test_int8_backend_converts_and_quantizes_gpt2(self):
+        def gpt2_pequeno():
+            torch.manual_seed(0)
+            return GPT2LMHeadModel(GPT2Config(vocab_size=64, n_positions=64, n_embd=32, n_layer=2, n_head=2)).eval()
+
+        ids = torch.tensor([[1, 5, 9, 3, 7]])
+        with torch.no_grad():
+            referencia = gpt2_pequeno()(ids).logits
+            # Conv1D -> Linear não muda o resultado
+            torch.testing.assert_close(conv1d_to_linear(gpt2_pequeno())(ids).logits, referencia)
+            with patch('src.model.AutoModelForCausalLM') as mock_auto:
+                mock_auto.from_pretrained.return_value = gpt2_pequeno()
+                quantizado = load_llm('distilgpt2', backend='int8')
+            self.assertFalse(any(type(m).__name__ == 'Conv1D' for m in quantizado.modules()))
+            self.assertTrue(any(isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in quantizado.modules()))
+            logits = quantizado(ids).logits
+        self.assertGreater(torch.nn.functional.cosine_similarity(logits.flatten(), referencia.flatten(), dim=0), 0.99)
+        with self.assertRaises(ValueError):
+            load_llm('distilgpt2', backend='onnx')
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_pack_contexts_keeps_whole_contexts_within_budget(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[1.0, 0.0]])
+        contextos = ['a' * 50, 'b' * 10, 'c' * 300]
+        # Ranking: c, a, b; orçamento de entrada = 1024 - 924 = 100 tokens (um por caractere)
+        agent = RAGAgent('distilgpt2', np.array([[0.9, 0.1], [0.5, 0.5], [1.0, 0.0]]), contextos,
+                         embedder=embedder, generation_policy={'max_new_tokens': 924},
+                         context_token_counts=np.array([50, 10, 300]))
+        tokenizados = []
+        tokenizer = FakeTokenizer()
+        agent.tokenizer = MagicMock(side_effect=lambda textos, **kw: (tokenizados.extend(textos), tokenizer(textos))[1],
+                                    decode=tokenizer.decode, pad_token_id=0)
+        # 'q\nContexto:\n' ocupa 12 tokens: c não cabe, a (50) e b (10 + separador) cabem inteiros
+        self.assertEqual(agent.build_prompts(['q']), ['q\nContexto:\n' + 'a' * 50 + '\n' + 'b' * 10])
+        self.assertFalse(any('c' * 300 in t for t in tokenizados))
+        # Sem nenhum contexto inteiro no orçamento, o primeiro entra cortado
+        agent.context_token_counts = np.array([500, 500, 300])
+        agent.retriever_contexts = ['a' * 500, 'b' * 500, 'c' * 300]
+        packed = agent.pack_contexts('q', [2, 0, 1])
+        self.assertEqual(len(packed), 1)
+        self.assertEqual(packed[0], tokenizer.decode([1 + ord('c') % 31] * 88))
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_pretokenized_contexts_match_text_prompt(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.side_effect = lambda qs: np.array([[1.0, 0.0] if len(q) % 2 else [0.0, 1.0] for q in qs])
+        contextos = ['CV com Python ' * 5, 'CV com SQL', 'x' * 300]
+        tokenizer = FakeTokenizer()
+        context_tokens = [tokenizer([c])['input_ids'][0].numpy().astype(np.uint16) for c in contextos]
+        agent = RAGAgent('distilgpt2', np.array([[0.9, 0.1], [0.5, 0.5], [0.1, 0.9]]), contextos,
+                         embedder=embedder, generation_policy={'max_new_tokens': 924},
+                         context_token_counts=np.array([len(t) for t in context_tokens]))
+        tokenizados = []
+        agent.tokenizer = MagicMock(side_effect=lambda textos, **kw: (tokenizados.extend(textos), tokenizer(textos))[1],
+                                    decode=tokenizer.decode, pad_token_id=0)
+        perguntas = ['pergunta?', 'outra pergunta']
+        esperado = agent.tokenize_prompts(agent.build_prompts(perguntas))
+        tokenizados.clear()
+        agent.context_tokens = context_tokens
+        inputs = agent.prompt_inputs(perguntas)
+        # Mesmos input_ids do prompt em texto, sem tokenizar nenhum contexto na requisição
+        self.assertTrue(torch.equal(inputs['input_ids'], esperado['input_ids']))
+        self.assertTrue(torch.equal(inputs['attention_mask'], esperado['attention_mask']))
+        self.assertFalse(any(c in t for c in contextos for t in tokenizados))
+        # Nenhum contexto inteiro cabe: o primeiro entra cortado direto nos tokens gravados
+        ids = agent.pack_context_ids('q', [2])
+        self.assertEqual(len(ids), agent.input_budget())
+        self.assertEqual(ids[12:], context_tokens[2][:88].tolist())
+
+    def test_repeated_tail(self):
+        self.assertEqual(repeated_tail([9, 1, 2, 3, 1, 2, 3], 2, 8), 3)
+        self.assertEqual(repeated_tail([1, 2, 3, 4, 5], 2, 8), 0)
+        # Blocos menores que min_span não contam
+        self.assertEqual(repeated_tail([7, 7], 2, 8), 0)
+
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def test_generation_policies_cut_degenerate_output(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.return_value = np.array([[1.0, 0.0]])
+        torch.manual_seed(0)
+        llm = GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=512, n_embd=16, n_layer=1, n_head=2)).eval()
+
+        def agente(**policy):
+            agent = RAGAgent('distilgpt2', np.array([[1.0, 0.0], [0.0, 1.0]]), ['ctx1', 'ctx2'],
+                             embedder=embedder, generation_policy=policy)
+            agent.model, agent.tokenizer = llm, FakeTokenizer()
+            return agent
+
+        def tokens(texto):
+            return texto.split()
+
+        sem_politica = tokens(agente(no_repeat_ngram_size=0, repeated_span=None).generate('pergunta'))
+        self.assertEqual(len(sem_politica), 256)
+        # O modelo aleatório entra em laço: a política para no primeiro bloco repetido e o remove
+        cortado = tokens(agente(no_repeat_ngram_size=0, repeated_span=(2, 16)).generate('pergunta'))
+        self.assertLess(len(cortado), len(sem_politica))
+        self.assertEqual(cortado, sem_politica[:len(cortado)])
+        self.assertEqual(repeated_tail(cortado, 2, 16), 0)
+
+        bloqueado = tokens(agente(no_repeat_ngram_size=3, repeated_span=None).generate('pergunta'))
+        trigramas = [tuple(bloqueado[i:i + 3]) for i in range(len(bloqueado) - 2)]
+        self.assertEqual(len(trigramas), len(set(trigramas)))
+
+        # A política padrão, sem ajustes, também para o laço bem antes de max_new_tokens
+        padrao = tokens(agente().generate('pergunta'))
+        self.assertLess(len(padrao), len(sem_politica) // 2)
+        self.assertEqual(padrao, sem_politica[:len(padrao)])
+        with self.assertRaises(ValueError):
+            agente(no_repeat_ngram_size=4, repeated_span=(4, 32))
+
+        parada = sem_politica[5]
+        antes = tokens(agente(no_repeat_ngram_size=0, repeated_span=None, stop_sequences=[parada]).generate('pergunta'))
+        self.assertEqual(antes, sem_politica[:sem_politica.index(parada)])
+
+    @patch('src.model.SentenceTransformer')
+    def test_get_embedder_loads_once_per_process(self, mock_st):
+        with patch.dict(model_module._embedders, clear=True):
+            first = get_embedder('mock-embedder')
+            second = get_embedder('mock-embedder')
+        self.assertIs(first, second)
+        mock_st.assert_called_once_with('mock-embedder')
+
+class TestCorpusFingerprint(unittest.TestCase):
+    def test_changes_with_manifest_content(self):
+        import json, os, tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            contextos = os.path.join(tmp, 'contextos.bin')
+            with open(contextos, 'wb') as f:
+                f.write(b'abc')
+            # Sem manifesto: tamanho e data dos arquivos
+            sem_manifesto = corpus_fingerprint(tmp, [contextos, os.path.join(tmp, 'ausente.bin')])
+            with open(contextos, 'wb') as f:
+                f.write(b'abcd')
+            self.assertNotEqual(corpus_fingerprint(tmp, [contextos]), sem_manifesto)
+            manifest = {'rows': ['h1', 'h2'], 'metadata': ['m1', 'm2'], 'deleted': []}
+            with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+            antes = corpus_fingerprint(tmp, [contextos])
+            self.assertEqual(corpus_fingerprint(tmp, [contextos]), antes)
+            # Mesmo número de linhas, só os metadados de uma mudaram
+            manifest['metadata'][1] = 'm3'
+            with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+            self.assertNotEqual(corpus_fingerprint(tmp, [contextos]), antes)
 
 class TestRAGRunnable(unittest.TestCase):
     @patch('src.model.RAGAgent')
@@ -38,9 +387,62 @@ class TestRAGRunnable(unittest.TestCase):
         self.assertIs(runnable.agent, rag_agent_instance)
 
     @patch('src.model.RAGAgent')
-    def test_predict(self, mock_rag_agent):
+    @patch('src.model.open_embedding_store')
+    @patch('src.model.np.load')
+    @patch('src.model.pd.read_csv')
+    def test_init_prefers_memory_mapped_store(self, mock_read_csv, mock_np_load, mock_open_store, mock_rag_agent):
+        mock_read_csv.return_value = pd.DataFrame({'contexto': ['ctx1', 'ctx2']})
+        store = mock_open_store.return_value
+        store.vectors = np.eye(2, dtype=np.float32)
+        store.model_name = 'mock-embedder'
+        store.normalized = True
+        with patch('src.model.os.path.exists', side_effect=lambda p: p.endswith('embeddings.bin')):
+            runnable = RAGRunnable()
+        mock_np_load.assert_not_called()
+        kwargs = mock_rag_agent.call_args[1]
+        self.assertIs(kwargs['retriever_embeddings'], store.vectors)
+        self.assertEqual(kwargs['embedder_name'], 'mock-embedder')
+        self.assertIs(kwargs['index'].embeddings, store.vectors)
+        self.assertEqual(runnable.retrieval_config['embedder_name'], 'mock-embedder')
+        self.assertEqual((runnable.retrieval_config['index'], runnable.retrieval_config['corpus_rows']), ('exact', 2))
+
+    @patch('src.model.RAGAgent')
+    @patch('src.model.open_context_store')
+    @patch('src.model.np.load')
+    @patch('src.model.pd.read_csv')
+    def test_init_uses_context_store_without_pandas(self, mock_read_csv, mock_np_load, mock_open_ctx, mock_rag_agent):
+        mock_np_load.return_value = np.random.rand(2, 3)
+        with patch('src.model.os.path.exists', side_effect=lambda p: p.endswith('contextos.bin')):
+            RAGRunnable()
+        mock_read_csv.assert_not_called()
+        self.assertIs(mock_rag_agent.call_args[1]['retriever_contexts'], mock_open_ctx.return_value)
+
+    @patch('src.model.RAGAgent')
+    @patch('src.model.np.load')
+    @patch('src.model.pd.read_csv')
+    def test_pickle_leaves_agent_out_and_load_context_reopens(self, mock_read_csv, mock_np_load, mock_rag_agent):
+        import os, pickle
+        mock_np_load.return_value = np.random.rand(2, 3)
+        mock_read_csv.return_value = pd.DataFrame({'contexto': ['ctx1', 'ctx2']})
+        mock_rag_agent.return_value.generation_policy = {'max_new_tokens': 8}
+        runnable = RAGRunnable(prefix_cache_tokens=0, processed_dir='dados')
+        self.assertEqual(runnable.processed_dir, os.path.abspath('dados'))
+        restored = pickle.loads(pickle.dumps(runnable))
+        self.assertFalse(hasattr(restored, 'agent'))
+        self.assertEqual(restored.retrieval_config, runnable.retrieval_config)
+        with patch.dict('os.environ', {'RAG_PROCESSED_DIR': '/srv/processed'}):
+            restored.load_context(None)
+        self.assertIs(restored.agent, mock_rag_agent.return_value)
+        self.assertEqual(mock_np_load.call_args[0][0], os.path.join('/srv/processed', 'embeddings.npy'))
+        self.assertIsNone(mock_rag_agent.call_args[1]['prefix_cache'])
+
+    @patch('src.model.RAGAgent')
+    @patch('src.model.np.load')
+    @patch('src.model.pd.read_csv')
+    def test_predict(self, mock_read_csv, mock_np_load, mock_rag_agent):
+        mock_read_csv.return_value = pd.DataFrame({'contexto': ['ctx1', 'ctx2']})
         agent_instance = MagicMock()
-        agent_instance.generate.side_effect = lambda q: f"resp:{q}"
+        agent_instance.generate_batch.side_effect = lambda qs: [f"resp:{q}" for q in qs]
         mock_rag_agent.return_value = agent_instance
         runnable = RAGRunnable()
         # DataFrame input
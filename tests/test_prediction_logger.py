@@ -0,0 +1,68 @@
+import threading
+import unittest
+from src.prediction_logger import PredictionLogger
+
+class TestPredictionLogger(unittest.TestCase):
+    def test_flushes_in_batches_and_on_close(self):
+        lotes = []
+        logger = PredictionLogger(writer=lotes.append, batch_size=2, flush_interval=60)
+        ids = [logger.log({'perguntas': [f'p{i}']}) for i in range(5)]
+        logger.close(timeout=5)
+        self.assertEqual([len(lote) for lote in lotes], [2, 2, 1])
+        self.assertEqual([r['id'] for lote in lotes for r in lote], ids)
+        self.assertEqual((logger.enqueued, logger.flushed, logger.dropped), (5, 5, 0))
+
+    def test_drop_policies_when_queue_full(self):
+        liberar = threading.Event()
+        lotes = []
+
+        def writer_lento(lote):
+            liberar.wait(5)
+            lotes.append([r['perguntas'][0] for r in lote])
+
+        for policy, esperado in [('drop_newest', ['p0', 'p1', 'p2']), ('drop_oldest', ['p0', 'p2', 'p3'])]:
+            liberar.clear()
+            lotes.clear()
+            logger = PredictionLogger(writer=writer_lento, max_queue=2, batch_size=1,
+                                      flush_interval=60, drop_policy=policy)
+            logger.log({'perguntas': ['p0']})
+            # Espera o escritor pegar o primeiro registro e travar nele
+            while logger.qsize():
+                pass
+            resultados = [logger.log({'perguntas': [f'p{i}']}) for i in (1, 2, 3)]
+            liberar.set()
+            logger.close(timeout=5)
+            self.assertEqual([p for lote in lotes for p in lote], esperado, policy)
+            self.assertEqual(logger.dropped, 1, policy)
+            self.assertEqual(resultados[2] is None, policy == 'drop_newest')
+
+    def test_reports_queue_depth_on_enqueue_and_dequeue(self):
+        profundidades = []
+        logger = PredictionLogger(writer=lambda lote: None, batch_size=10, flush_interval=60,
+                                  on_queue_change=profundidades.append)
+        for i in range(3):
+            logger.log({'perguntas': [f'p{i}']})
+        logger.close(timeout=5)
+        # Um aviso por registro enfileirado e um pelo lote retirado da fila
+        self.assertEqual(len(profundidades), 4)
+        self.assertEqual(profundidades[-1], 0)
+
+    def test_writer_failure_is_counted(self):
+        flushes = []
+
+        def writer_falha(lote):
+            raise RuntimeError('mlflow indisponível')
+
+        logger = PredictionLogger(writer=writer_falha, batch_size=10, flush_interval=60,
+                                  on_flush=lambda n, segundos, ok: flushes.append((n, ok)))
+        logger.log({'perguntas': ['a']})
+        logger.close(timeout=5)
+        self.assertEqual(flushes, [(1, False)])
+        self.assertEqual((logger.flushed, logger.failed), (0, 1))
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            PredictionLogger(writer=list.append, drop_policy='ignorar')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -46,5 +46,16 @@ class TestRegisterV2(unittest.TestCase):
         mock_mlflow.register_model.assert_called_once()
         mock_bentoml.mlflow.import_model.assert_called_once()
 
+    def test_stage_model_code_packages_src_modules(self):
+        import os, subprocess, sys, tempfile
+        from src.register import MODEL_CODE_MODULES, stage_model_code
+        with tempfile.TemporaryDirectory() as tmp:
+            pacote = stage_model_code(tmp)
+            self.assertEqual(os.path.basename(pacote), 'src')
+            self.assertEqual(sorted(os.listdir(pacote)), sorted(MODEL_CODE_MODULES))
+            # Só com o código copiado (sem a raiz do projeto no path), src.model importa suas dependências
+            subprocess.run([sys.executable, '-c', 'import src.model'], cwd=tmp, check=True,
+                           env={**os.environ, 'PYTHONPATH': tmp})
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,35 @@
+import os
+import unittest
+from unittest.mock import patch
+import torch
+from src.runtime import configure_threads, layout_from_env, thread_layout
+
+class TestRuntime(unittest.TestCase):
+    def test_thread_layout_splits_budget(self):
+        self.assertEqual(thread_layout(4)['intra_op_threads'], 4)
+        self.assertEqual(thread_layout(4, workers=2)['intra_op_threads'], 2)
+        self.assertEqual(thread_layout(4, workers=2, concurrency=2)['intra_op_threads'], 1)
+        # Nunca menos de uma thread, mesmo com mais workers que núcleos
+        self.assertEqual(thread_layout(2, workers=4)['intra_op_threads'], 1)
+
+    def test_layout_from_env(self):
+        with patch.dict(os.environ, {'RAG_WORKERS': '2', 'RAG_INFERENCE_CONCURRENCY': '1'}):
+            layout = layout_from_env(4)
+        self.assertEqual((layout['workers'], layout['concurrency'], layout['intra_op_threads']), (2, 1, 2))
+        with patch.dict(os.environ, {'RAG_WORKERS': '2', 'RAG_TORCH_THREADS': '3'}):
+            self.assertEqual(layout_from_env(4)['intra_op_threads'], 3)
+
+    def test_configure_threads(self):
+        anterior = torch.get_num_threads()
+        try:
+            with patch.dict(os.environ, {}):
+                efetivo = configure_threads(1)
+                self.assertEqual(os.environ['OMP_NUM_THREADS'], '1')
+                self.assertEqual(os.environ['TOKENIZERS_PARALLELISM'], 'false')
+            self.assertEqual(efetivo['intra_op_threads'], 1)
+            self.assertEqual(torch.get_num_threads(), 1)
+        finally:
+            torch.set_num_threads(anterior)
+
+if __name__ == '__main__':
+    unittest.main()
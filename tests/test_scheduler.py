@@ -0,0 +1,116 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+import numpy as np
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+from src.cache import PrefixKVCache
+from src.model import RAGAgent
+from src.scheduler import ContinuousBatchScheduler
+from tests.test_model import FakeTokenizer
+
+class TestContinuousBatchScheduler(unittest.TestCase):
+    @patch('src.model.AutoTokenizer')
+    @patch('src.model.AutoModelForCausalLM')
+    def setUp(self, mock_model, mock_tokenizer):
+        embedder = MagicMock()
+        embedder.encode.side_effect = lambda qs: np.array([[1.0, 0.0] if len(q) % 2 else [0.0, 1.0] for q in qs])
+        self.agent = RAGAgent('distilgpt2', np.array([[1.0, 0.0], [0.0, 1.0]]),
+                              ['CV com Python', 'CV com SQL e inglês avançado'], embedder=embedder,
+                              generation_policy={'max_new_tokens': 40})
+        torch.manual_seed(0)
+        self.agent.model = GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=512, n_embd=16,
+                                                      n_layer=2, n_head=2)).eval()
+        self.agent.tokenizer = FakeTokenizer()
+        self.perguntas = ['pergunta curta', 'uma pergunta bem mais longa sobre python', 'sql?',
+                          'outra pergunta de tamanho médio']
+
+    def test_matches_generate_with_admission_mid_batch(self):
+        esperado = [self.agent.generate(p) for p in self.perguntas]
+        scheduler = ContinuousBatchScheduler(self.agent, max_batch_size=4, max_wait=0.0)
+        try:
+            futures = scheduler.submit_many(self.perguntas[:1])
+            # As demais entram com a primeira já em andamento (prompts e posições diferentes no lote)
+            while scheduler.steps < 3:
+                time.sleep(0.001)
+            futures += scheduler.submit_many(self.perguntas[1:])
+            self.assertEqual([f.result(timeout=30) for f in futures], esperado)
+        finally:
+            scheduler.close()
+        self.assertEqual((scheduler.admitted, scheduler.completed, scheduler.batch_size()), (4, 4, 0))
+
+    def test_max_batch_size_and_cancel(self):
+        scheduler = ContinuousBatchScheduler(self.agent, max_batch_size=1, max_wait=0.0)
+        try:
+            cancel = threading.Event()
+            cancel.set()
+            # Cancelada antes de entrar no lote: nenhum token gerado
+            self.assertEqual(scheduler.submit('pergunta', cancel_event=cancel).result(timeout=30), '')
+            tamanhos = []
+            choose = scheduler._choose
+            scheduler._choose = lambda seqs, logits: (tamanhos.append(len(seqs)), choose(seqs, logits))
+            futures = scheduler.submit_many(self.perguntas[:2])
+            self.assertEqual(len([f.result(timeout=30) for f in futures]), 2)
+            self.assertEqual(scheduler.admitted, 2)
+            # Uma sequência por vez: a segunda só entra quando a primeira sai do lote
+            self.assertEqual(set(tamanhos), {1})
+        finally:
+            scheduler.close()
+
+    def test_prefill_error_fails_only_new_sequences(self):
+        esperado = self.agent.generate(self.perguntas[0])
+        scheduler = ContinuousBatchScheduler(self.agent, max_batch_size=4, max_wait=0.0)
+        try:
+            primeira = scheduler.submit(self.perguntas[0])
+            while scheduler.steps < 3:
+                time.sleep(0.001)
+            forward = scheduler._forward
+
+            def falha(seqs, past_key_values=None):
+                raise RuntimeError('falha no prefill')
+            scheduler._forward = falha
+            nova = scheduler.submit(self.perguntas[1])
+            with self.assertRaises(RuntimeError):
+                nova.result(timeout=30)
+            scheduler._forward = forward
+            # A sequência que já estava no lote termina normalmente
+            self.assertEqual(primeira.result(timeout=30), esperado)
+        finally:
+            scheduler.close()
+
+    def test_uses_agent_prefix_cache(self):
+        esperado = [self.agent.generate(p) for p in self.perguntas]
+        self.agent.prefix_cache = PrefixKVCache(max_tokens=4096, min_prefix=4)
+        scheduler = ContinuousBatchScheduler(self.agent, max_batch_size=4, max_wait=0.0)
+        try:
+            primeira = [f.result(timeout=30) for f in scheduler.submit_many(self.perguntas)]
+            self.assertEqual(len(self.agent.prefix_cache), len(self.perguntas))
+            # Mesmos prompts de novo: o prefill parte do K/V em cache e a saída não muda
+            segunda = [f.result(timeout=30) for f in scheduler.submit_many(self.perguntas)]
+        finally:
+            scheduler.close()
+        self.assertEqual(primeira, esperado)
+        self.assertEqual(segunda, esperado)
+        self.assertEqual(self.agent.prefix_cache.hits, len(self.perguntas))
+
+    def test_on_change_reports_batch_and_queue(self):
+        estados = []
+        scheduler = ContinuousBatchScheduler(self.agent, max_batch_size=4, max_wait=0.0,
+                                             on_change=lambda lote, fila: estados.append((lote, fila)))
+        try:
+            for f in scheduler.submit_many(self.perguntas):
+                f.result(timeout=30)
+            while scheduler.batch_size():
+                time.sleep(0.001)
+            time.sleep(0.05)
+        finally:
+            scheduler.close()
+        self.assertTrue(any(fila > 0 for _, fila in estados))
+        self.assertTrue(any(lote > 0 for lote, _ in estados))
+        self.assertEqual(estados[-1], (0, 0))
+        # Só mudanças de estado são repassadas
+        self.assertTrue(all(a != b for a, b in zip(estados, estados[1:])))
+
+if __name__ == '__main__':
+    unittest.main()
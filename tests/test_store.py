@@ -0,0 +1,163 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from src.store import (HEADER_SIZE, append_contexts, append_embeddings, append_passage_map, append_tokens,
+                       corpus_files, dequantize_int8, open_context_store, open_embedding_store, open_passage_map,
+                       open_token_store, quantize_int8, token_dtype, truncate_store, write_context_store,
+                       write_embedding_store, write_passage_map, write_quantized_store, write_token_store)
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'embeddings.bin')
+        self.embeddings = np.array([[3.0, 4.0], [1.0, 0.0], [0.0, 2.0]], dtype=np.float32)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip_is_normalized_and_memory_mapped(self):
+        write_embedding_store(self.path, self.embeddings, 'mock-model')
+        store = open_embedding_store(self.path)
+        self.assertIsInstance(store.vectors, np.memmap)
+        self.assertEqual((store.count, store.dim, store.model_name), (3, 2, 'mock-model'))
+        self.assertTrue(store.normalized)
+        np.testing.assert_allclose(store.vectors, [[0.6, 0.8], [1.0, 0.0], [0.0, 1.0]], rtol=1e-6)
+
+    def test_pickle_reopens_memory_map(self):
+        import pickle
+        write_embedding_store(self.path, self.embeddings, 'mock-model')
+        data = pickle.dumps(open_embedding_store(self.path))
+        # Só o caminho vai no pickle, não os vetores
+        self.assertLess(len(data), 200)
+        store = pickle.loads(data)
+        self.assertIsInstance(store.vectors, np.memmap)
+        self.assertEqual(store.vectors.filename, os.path.abspath(self.path))
+        np.testing.assert_allclose(store.vectors[0], [0.6, 0.8], rtol=1e-6)
+
+    def test_without_normalization_keeps_values(self):
+        write_embedding_store(self.path, self.embeddings, 'mock-model', normalize_vectors=False)
+        store = open_embedding_store(self.path)
+        self.assertFalse(store.normalized)
+        np.testing.assert_array_equal(store.vectors, self.embeddings)
+
+    def test_quantized_stores_are_smaller_and_close(self):
+        embeddings = np.random.default_rng(0).standard_normal((100, 16)).astype(np.float32)
+        normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        write_embedding_store(self.path, embeddings, 'mock-model')
+        sizes = {'float32': os.path.getsize(self.path) - HEADER_SIZE}
+        for dtype, tol in [('float16', 1e-3), ('int8', 1e-2)]:
+            path = os.path.join(self.tmp.name, f'embeddings.{dtype}.bin')
+            write_embedding_store(path, embeddings, 'mock-model', dtype=dtype)
+            store = open_embedding_store(path)
+            self.assertEqual(store.vectors.dtype, np.dtype(dtype))
+            np.testing.assert_allclose(store.dequantize(), normalized, atol=tol)
+            np.testing.assert_allclose(store.dequantize([3, 7]), normalized[[3, 7]], atol=tol)
+            sizes[dtype] = os.path.getsize(path) - HEADER_SIZE
+        self.assertEqual(sizes['float32'], 2 * sizes['float16'])
+        self.assertLess(sizes['int8'], sizes['float32'] / 3)
+
+    def test_quantized_store_from_float32_store_in_blocks(self):
+        embeddings = np.random.default_rng(0).standard_normal((100, 16)).astype(np.float32)
+        write_embedding_store(self.path, embeddings, 'mock-model')
+        for dtype in ('float16', 'int8'):
+            direto = os.path.join(self.tmp.name, f'direto.{dtype}.bin')
+            em_blocos = os.path.join(self.tmp.name, f'blocos.{dtype}.bin')
+            write_embedding_store(direto, embeddings, 'mock-model', dtype=dtype)
+            write_quantized_store(em_blocos, self.path, dtype, block_size=7)
+            esperado, store = open_embedding_store(direto), open_embedding_store(em_blocos)
+            self.assertEqual((store.count, store.model_name, store.normalized), (100, 'mock-model', True))
+            np.testing.assert_array_equal(store.vectors, esperado.vectors)
+            np.testing.assert_array_equal(store.dequantize(), esperado.dequantize())
+
+    def test_quantize_int8_roundtrip(self):
+        embeddings = np.random.default_rng(1).uniform(-1, 1, (50, 8)).astype(np.float32)
+        codes, scale, minimo = quantize_int8(embeddings)
+        self.assertEqual(codes.dtype, np.int8)
+        np.testing.assert_allclose(dequantize_int8(codes, scale, minimo), embeddings, atol=scale.max())
+
+    def test_append_embeddings_keeps_layout(self):
+        extra = np.array([[0.0, 5.0]], dtype=np.float32)
+        for dtype in ('float32', 'int8'):
+            path = os.path.join(self.tmp.name, f'append.{dtype}.bin')
+            write_embedding_store(path, self.embeddings, 'mock-model', dtype=dtype)
+            append_embeddings(path, extra)
+            store = open_embedding_store(path)
+            self.assertEqual(store.count, 4)
+            np.testing.assert_allclose(store.dequantize([3]), [[0.0, 1.0]], atol=1e-2)
+            np.testing.assert_allclose(store.dequantize([0]), [[0.6, 0.8]], atol=1e-2)
+
+    def test_invalid_dtype_raises(self):
+        with self.assertRaises(ValueError):
+            write_embedding_store(self.path, self.embeddings, 'mock-model', dtype='int4')
+
+    def test_invalid_file_raises(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a store')
+        with self.assertRaises(ValueError):
+            open_embedding_store(self.path)
+
+class TestContextStore(unittest.TestCase):
+    def test_roundtrip_utf8_contexts(self):
+        textos = ['Python, Django e SQL', '', 'Inglês avançado/fluente. Experiência CI/CD', 'ação']
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'contextos.bin')
+            self.assertEqual(write_context_store(path, textos), 4)
+            store = open_context_store(path)
+            self.assertEqual(len(store), 4)
+            self.assertEqual([store[i] for i in range(len(store))], textos)
+            self.assertEqual(store[np.int64(2)], textos[2])
+            self.assertEqual(store[-1], 'ação')
+            self.assertEqual(list(store), textos)
+            with self.assertRaises(IndexError):
+                store[4]
+
+    def test_pickle_reopens_memory_map(self):
+        import pickle
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'contextos.bin')
+            write_context_store(path, ['um', 'dois'])
+            store = pickle.loads(pickle.dumps(open_context_store(path)))
+            self.assertIsInstance(store.blob, np.memmap)
+            self.assertEqual(list(store), ['um', 'dois'])
+
+    def test_append_contexts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'contextos.bin')
+            write_context_store(path, ['um', 'dois'])
+            self.assertEqual(append_contexts(path, ['três', 'quatro']), 4)
+            self.assertEqual(list(open_context_store(path)), ['um', 'dois', 'três', 'quatro'])
+
+class TestTokenStore(unittest.TestCase):
+    def test_roundtrip_append_and_truncate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'contextos.tok')
+            self.assertEqual(token_dtype(50257), 'uint16')
+            self.assertEqual(write_token_store(path, [[1, 2, 3], []], 'distilgpt2'), 2)
+            self.assertEqual(append_tokens(path, [[50256, 7]]), 3)
+            store = open_token_store(path)
+            self.assertEqual(store.tokenizer, 'distilgpt2')
+            self.assertEqual([store[i].tolist() for i in range(len(store))], [[1, 2, 3], [], [50256, 7]])
+            self.assertEqual(store.lengths().tolist(), [3, 0, 2])
+            self.assertEqual(os.path.getsize(path), HEADER_SIZE + 5 * 2)
+            truncate_store(path, 1)
+            self.assertEqual([t.tolist() for t in open_token_store(path)], [[1, 2, 3]])
+            self.assertEqual(os.path.getsize(path), HEADER_SIZE + 3 * 2)
+
+class TestPassageMap(unittest.TestCase):
+    def test_roundtrip_append_and_truncate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            files = corpus_files(tmp, passages=True)
+            self.assertEqual(os.path.basename(files['embeddings']), 'passagens_embeddings.bin')
+            self.assertEqual(os.path.basename(corpus_files(tmp)['quantized']['int8']), 'embeddings.int8.bin')
+            self.assertEqual(write_passage_map(files['map'], [0, 0, 1], max_words=64, overlap=8), 3)
+            self.assertEqual(append_passage_map(files['map'], [2, 2]), 5)
+            passage_map = open_passage_map(files['map'])
+            self.assertEqual((passage_map.max_words, passage_map.overlap), (64, 8))
+            self.assertEqual(passage_map.cv.tolist(), [0, 0, 1, 2, 2])
+            truncate_store(files['map'], 3)
+            self.assertEqual(open_passage_map(files['map']).cv.tolist(), [0, 0, 1])
+            self.assertEqual(os.path.getsize(files['map']), HEADER_SIZE + 3 * 4)
+
+if __name__ == "__main__":
+    unittest.main()
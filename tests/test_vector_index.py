@@ -0,0 +1,117 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from src.vector_index import (ExactIndex, IVFIndex, HNSWIndex, QuantizedIndex, build_index,
+                              load_index, recall_at_k, save_index, search_subset)
+
+def clustered_data(n, dim=32, n_clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim))
+    return (centers[rng.integers(0, n_clusters, n)] + 0.3 * rng.standard_normal((n, dim))).astype(np.float32)
+
+class TestVectorIndex(unittest.TestCase):
+    def setUp(self):
+        self.corpus = clustered_data(1000)
+        self.queries = clustered_data(30, seed=1)
+
+    def test_exact_matches_brute_force_cosine(self):
+        scores, ids = ExactIndex(self.corpus).search(self.queries, 5)
+        corpus = self.corpus / np.linalg.norm(self.corpus, axis=1, keepdims=True)
+        queries = self.queries / np.linalg.norm(self.queries, axis=1, keepdims=True)
+        expected = np.argsort(-(queries @ corpus.T), axis=1)[:, :5]
+        np.testing.assert_array_equal(ids, expected)
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+    def test_exact_pads_when_corpus_smaller_than_k(self):
+        scores, ids = ExactIndex(self.corpus[:2]).search(self.queries[:1], 3)
+        self.assertEqual(ids[0, 2], -1)
+        self.assertEqual(sorted(ids[0, :2]), [0, 1])
+
+    def test_ivf_full_probe_is_exact(self):
+        index = IVFIndex.build(self.corpus, nlist=10, nprobe=10)
+        self.assertEqual(recall_at_k(index, ExactIndex(self.corpus), self.queries, k=5), 1.0)
+
+    def test_ivf_partial_probe_recall(self):
+        index = IVFIndex.build(self.corpus, nlist=20, nprobe=4)
+        self.assertGreater(recall_at_k(index, ExactIndex(self.corpus), self.queries, k=5), 0.8)
+
+    def test_hnsw_recall(self):
+        index = HNSWIndex.build(self.corpus, M=8, ef_construction=64, ef_search=64)
+        self.assertGreater(recall_at_k(index, ExactIndex(self.corpus), self.queries, k=5), 0.9)
+
+    def test_save_and_load_roundtrip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for kind, params in [('exact', {}), ('ivf', {'nlist': 10}), ('hnsw', {'M': 8})]:
+                index = build_index(kind, self.corpus, **params)
+                path = os.path.join(tmp, f'{kind}.npz')
+                save_index(index, path)
+                loaded = load_index(path, self.corpus)
+                self.assertIsInstance(loaded, type(index))
+                np.testing.assert_array_equal(loaded.search(self.queries, 3)[1], index.search(self.queries, 3)[1])
+            # index_params de outro tipo de índice são ignorados
+            for kind in ('exact', 'hnsw'):
+                loaded = load_index(os.path.join(tmp, f'{kind}.npz'), self.corpus, nprobe=4)
+                self.assertEqual(loaded.kind, kind)
+            self.assertEqual(load_index(os.path.join(tmp, 'ivf.npz'), self.corpus, ef_search=32).kind, 'ivf')
+
+    def test_quantized_index_with_rerank_matches_exact(self):
+        from src.store import quantize_int8
+        normalized = ExactIndex(self.corpus).embeddings
+        codes, scale, minimo = quantize_int8(normalized)
+        exact_scores, exact_ids = ExactIndex(self.corpus).search(self.queries, 5)
+        for index in (QuantizedIndex(codes, scale, minimo, rerank_vectors=normalized, rerank_factor=4),
+                      QuantizedIndex(normalized.astype(np.float16), rerank_vectors=normalized)):
+            scores, ids = index.search(self.queries, 5)
+            np.testing.assert_array_equal(ids, exact_ids)
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+    def test_quantized_index_subset_matches_search_subset(self):
+        from src.store import quantize_int8
+        normalized = ExactIndex(self.corpus).embeddings
+        codes, scale, minimo = quantize_int8(normalized)
+        ids = np.arange(0, len(self.corpus), 3)
+        index = QuantizedIndex(codes, scale, minimo, rerank_vectors=normalized, rerank_factor=4)
+        exact_scores, exact_ids = search_subset(normalized, self.queries, 5, ids, normalized=True)
+        scores, found = index.search(self.queries, 5, ids=ids)
+        np.testing.assert_array_equal(found, exact_ids)
+        np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+        # Linhas removidas também ficam fora da busca restrita
+        index.remove(exact_ids[:, 0])
+        self.assertFalse(np.isin(index.search(self.queries, 5, ids=ids)[1], exact_ids[:, 0]).any())
+
+    def test_quantized_index_without_rerank_overlap(self):
+        from src.store import quantize_int8
+        codes, scale, minimo = quantize_int8(ExactIndex(self.corpus).embeddings)
+        index = QuantizedIndex(codes, scale, minimo)
+        self.assertGreater(recall_at_k(index, ExactIndex(self.corpus), self.queries, k=5), 0.9)
+
+    def test_add_and_remove(self):
+        base, extra = self.corpus[:800], self.corpus[800:]
+        for kind, params in [('exact', {}), ('ivf', {'nlist': 10, 'nprobe': 10}), ('hnsw', {'M': 8})]:
+            index = build_index(kind, base, **params)
+            # Simula o store reaberto após o append: a matriz cresce e só as linhas novas são indexadas
+            index.embeddings = ExactIndex(self.corpus).embeddings
+            index.add(np.arange(800, 1000))
+            _, ids = index.search(extra[:10], 1)
+            np.testing.assert_array_equal(ids[:, 0], np.arange(800, 810), err_msg=kind)
+            index.remove(np.arange(800, 810))
+            _, ids = index.search(extra[:10], 3)
+            self.assertFalse(np.isin(ids, np.arange(800, 810)).any(), kind)
+
+    def test_search_subset_matches_exact_on_subset(self):
+        subset = np.arange(0, 1000, 7)
+        scores, ids = search_subset(self.corpus, self.queries, 5, subset)
+        sub_scores, sub_ids = ExactIndex(self.corpus[subset]).search(self.queries, 5)
+        np.testing.assert_array_equal(ids, subset[sub_ids])
+        np.testing.assert_allclose(scores, sub_scores, rtol=1e-5)
+        # Subconjunto menor que k: sobras com -1
+        _, ids = search_subset(self.corpus, self.queries[:1], 3, np.array([4]))
+        self.assertEqual(ids[0].tolist(), [4, -1, -1])
+
+    def test_build_index_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            build_index('lsh', self.corpus)
+
+if __name__ == "__main__":
+    unittest.main()